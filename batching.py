@@ -0,0 +1,127 @@
+# coding=utf-8
+import threading
+import time
+
+from globalvars import GlobalVars
+
+
+# The most post ids one API call can ask for
+MAX_BATCH_SIZE = 100
+# How much a site's spam rate shortens its wait: a site where a quarter of the posts are spam waits half as long
+SPAM_URGENCY = 4
+
+
+class BatchingController:
+    """
+    Works out how many posts each site's queue batches up, and for how long at most, from how fast the site's posts
+    arrive, how many of them have been spam, and how much of the API quota is left.
+
+    The wait is the latency target, shortened for sites with more spam and stretched by up to double while the
+    quota runs low, and never longer than the static wait. A batch is as many posts as are expected to arrive within
+    the wait, up to what one API call can ask for, so a busy site's batches grow past the static batch size (and
+    save API calls) for as long as filling them still takes no longer than the wait. It's never smaller than the
+    static batch size, though: the wait already bounds how long a post is held, so a smaller batch would only cost
+    quieter sites more API calls. Sites seen for fewer than min_arrivals posts keep their static policy, and sites
+    in the overrides table always get the (batch size, max wait) given there.
+    """
+    def __init__(self, latency_target, overrides=None, min_arrivals=10, arrival_smoothing=0.1,
+                 spam_smoothing=0.05, low_quota=2000):
+        self.latency_target = latency_target
+        self.overrides = overrides if overrides is not None else {}
+        self.min_arrivals = min_arrivals
+        self.arrival_smoothing = arrival_smoothing
+        self.spam_smoothing = spam_smoothing
+        self.low_quota = low_quota
+        # site -> [time of its last arrival, average seconds between arrivals, arrivals]
+        self.arrivals = {}
+        # site -> average fraction of its scanned posts that were spam
+        self.spam_rates = {}
+        self.lock = threading.Lock()
+
+    def record_arrival(self, site, now=None):
+        now = time.monotonic() if now is None else now
+        self.lock.acquire()
+        try:
+            arrival = self.arrivals.get(site)
+            if arrival is None:
+                # Nothing to measure a gap from yet, so start by assuming the latency target
+                self.arrivals[site] = [now, self.latency_target, 1]
+                return
+            arrival[1] += self.arrival_smoothing * (now - arrival[0] - arrival[1])
+            arrival[0] = now
+            arrival[2] += 1
+        finally:
+            self.lock.release()
+
+    def record_scans(self, site, spam, scanned):
+        if scanned == 0:
+            return
+        self.lock.acquire()
+        try:
+            spam_rate = self.spam_rates.get(site, 0.0)
+            # The same as smoothing in the posts one by one, if they were in a random order
+            weight = 1 - (1 - self.spam_smoothing) ** scanned
+            self.spam_rates[site] = spam_rate + weight * (spam / scanned - spam_rate)
+        finally:
+            self.lock.release()
+
+    def quota_factor(self):
+        # apiquota is -1 until the first API response says what it is
+        quota = GlobalVars.apiquota
+        if 0 <= quota < self.low_quota:
+            return 1 + (self.low_quota - quota) / self.low_quota
+        return 1
+
+    def policy(self, site, static_size, static_wait):
+        """
+        :return: The site's batch size, its max wait in seconds, and where they came from: "override",
+                 "adaptive" or "static"
+        """
+        if site in self.overrides:
+            size, wait = self.overrides[site]
+            return size, wait, "override"
+
+        self.lock.acquire()
+        arrival = self.arrivals.get(site)
+        interval = arrival[1] if arrival is not None else None
+        arrivals = arrival[2] if arrival is not None else 0
+        spam_rate = self.spam_rates.get(site, 0.0)
+        self.lock.release()
+        if arrivals < self.min_arrivals:
+            return static_size, static_wait, "static"
+
+        quota_factor = self.quota_factor()
+        wait = min(static_wait, self.latency_target * quota_factor / (1 + SPAM_URGENCY * spam_rate))
+        size = max(static_size, min(MAX_BATCH_SIZE, int(wait / max(interval, 0.001))))
+        return size, wait, "adaptive"
+
+    def report(self, static_policy, count=10):
+        """
+        Compares the policy of the busiest sites against their static_policy(site) of (batch size, max wait),
+        including how many API calls an hour each would take at the sites' current rates.
+        """
+        self.lock.acquire()
+        sites = sorted(((site, tuple(arrival)) for site, arrival in self.arrivals.items()), key=lambda item: item[1][1])
+        spam_rates = dict(self.spam_rates)
+        self.lock.release()
+
+        calls = 0.0
+        static_calls = 0.0
+        lines = []
+        for site, (_, interval, _) in sites:
+            interval = max(interval, 0.001)
+            static_size, static_wait = static_policy(site)
+            size, wait, source = self.policy(site, static_size, static_wait)
+            # A site is flushed when its batch fills up or its wait runs out, whichever comes first, but a wait
+            # only runs out once a post has arrived to start it
+            calls += 3600 / max(interval, min(wait, size * interval))
+            static_calls += 3600 / max(interval, min(static_wait, static_size * interval))
+            if len(lines) < count:
+                lines.append("{}: {} posts or {:.0f}s ({}), static {} posts or {:.0f}s; {:.1f} posts/min, "
+                             "{:.0%} spam".format(site, size, wait, source, static_size, static_wait,
+                                                  60 / interval, spam_rates.get(site, 0.0)))
+        if not lines:
+            return "No posts have been queued yet."
+        lines.append("About {:.0f} API calls an hour, against {:.0f} with the static policy; quota factor {:.2f}."
+                     .format(calls, static_calls, self.quota_factor()))
+        return "\n".join(lines)
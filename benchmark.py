@@ -0,0 +1,261 @@
+# coding=utf-8
+# benchmark.py
+# Replays a corpus of posts through the detection engine offline, and reports how fast it went.
+# Call from the command line using Python 3, from the root of the repository:
+#
+#   python3 benchmark.py generate corpus.jsonl --posts 2000
+#   python3 benchmark.py run corpus.jsonl
+#   python3 benchmark.py compare master HEAD corpus.jsonl
+#
+# A corpus has one question per line, shaped like the items of the API response that
+# BodyFetcher.make_api_call_for_site receives (answers nested under "answers"), plus the "site" it came from.
+
+import argparse
+from contextlib import contextmanager
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+SITES = ["stackoverflow.com", "superuser.com", "askubuntu.com", "serverfault.com", "math.stackexchange.com",
+         "english.stackexchange.com", "drupal.stackexchange.com", "softwarerecs.stackexchange.com"]
+
+WORDS = ["array", "function", "value", "return", "error", "server", "install", "package", "version", "file",
+         "class", "method", "string", "loop", "index", "query", "database", "table", "column", "request",
+         "response", "thread", "memory", "process", "config", "window", "button", "event", "handler", "list",
+         "matrix", "proof", "integral", "theorem", "graph", "network", "driver", "kernel", "update", "build"]
+
+SPAM_SNIPPETS = ["gmail customer service number 1866978-6819 gmail support number",
+                 "12 Month Loans quick @ http://www.quick12monthpaydayloans.co.uk/",
+                 "baba ji love problem solution specialist",
+                 "Garcinia Cambogia pure extract for quick weight loss, buy now",
+                 "Call +1-888-379-9909 for QuickBooks support phone number",
+                 "BEST ESSAY WRITING SERVICE CHEAP AND FAST!!!!!!!!!!!!!!"]
+
+CODE_SNIPPETS = ["for (int i = 0; i < n; i++) {\n    total += values[i];\n}",
+                 "def main():\n    print(sum(range(10)))",
+                 "SELECT id, name FROM users WHERE created_at > NOW() - INTERVAL 1 DAY;"]
+
+# How many of the slowest rules to report
+RULE_COUNT = 15
+
+
+def random_sentence(rng):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(5, 15))]
+    return " ".join(words).capitalize() + "."
+
+
+def random_body(rng, spam):
+    paragraphs = ["<p>{}</p>".format(" ".join(random_sentence(rng) for _ in range(rng.randint(1, 4))))
+                  for _ in range(rng.randint(1, 5))]
+    if rng.random() < 0.4:
+        paragraphs.insert(rng.randint(0, len(paragraphs)),
+                          "<pre><code>{}</code></pre>".format(rng.choice(CODE_SNIPPETS)))
+    if rng.random() < 0.3:
+        paragraphs.append('<p>See <a href="https://example.com/docs/{0}" rel="nofollow noreferrer">the {0} docs'
+                          '</a>.</p>'.format(rng.choice(WORDS)))
+    if spam:
+        paragraphs.insert(rng.randint(0, len(paragraphs)), "<p>{}</p>".format(rng.choice(SPAM_SNIPPETS)))
+    return "\n\n".join(paragraphs)
+
+
+def random_owner(rng, site, spam):
+    user_id = rng.randint(1, 9000000)
+    name = "{}{}".format(rng.choice(WORDS), rng.randint(1, 999))
+    # Most rules leave established users alone, and spam comes from new accounts
+    return {"display_name": name, "reputation": 1 if spam else rng.choice([1, 1, 1, 11, 101, 1500, 25000]),
+            "link": "https://{}/users/{}/{}".format(site, user_id, name)}
+
+
+def generate_corpus(count, seed=0, spam_ratio=0.1):
+    """
+    Makes up count questions with answers, of which about spam_ratio have spam in them.
+    The same seed always gives the same corpus.
+    """
+    rng = random.Random(seed)
+    questions = []
+    for question_id in range(1, count + 1):
+        site = rng.choice(SITES)
+        title = random_sentence(rng)[:-1] + "?"
+        spam = rng.random() < spam_ratio
+        if spam and rng.random() < 0.5:
+            title = rng.choice(SPAM_SNIPPETS)
+        question = {"question_id": question_id, "site": site, "title": title, "body": random_body(rng, spam),
+                    "owner": random_owner(rng, site, spam), "score": 0 if spam else rng.randint(-2, 10),
+                    "link": "https://{}/questions/{}".format(site, question_id), "answers": []}
+        for answer_index in range(rng.choice([0, 0, 1, 1, 2, 3])):
+            answer_id = count + question_id * 10 + answer_index
+            spam = rng.random() < spam_ratio
+            question["answers"].append({"answer_id": answer_id, "body": random_body(rng, spam),
+                                        "owner": random_owner(rng, site, spam),
+                                        "score": 0 if spam else rng.randint(-2, 10),
+                                        "link": "https://{}/a/{}".format(site, answer_id)})
+        questions.append(question)
+    return questions
+
+
+def load_corpus(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+@contextmanager
+def offline_dns():
+    """
+    Answers every DNS lookup with NXDOMAIN straight away, so that replays neither need the network nor wait on it.
+    """
+    import dns.resolver
+
+    # noinspection PyUnusedLocal
+    def query(*args, **kwargs):
+        raise dns.resolver.NXDOMAIN()
+
+    original_query = dns.resolver.query
+    dns.resolver.query = query
+    try:
+        yield
+    finally:
+        dns.resolver.query = original_query
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+def replay(questions):
+    """
+    Scans each question and its answers the way BodyFetcher does, timing every check_if_spam.
+
+    :return: A dict of the results
+    """
+    from blacklists import load_blacklists
+    from classes import Post
+    import findspam
+    from spamhandling import check_if_spam
+
+    load_blacklists()
+    # Older revisions don't have these, but can still be timed
+    rule_stats = getattr(findspam, "RuleStats", None)
+    if hasattr(findspam.FindSpam, "get_rule_set"):
+        findspam.FindSpam.get_rule_set()
+    if rule_stats is not None:
+        rule_stats.take_interval_summary()
+
+    latencies = []
+    flagged = 0
+    start = time.perf_counter()
+    for question in questions:
+        question = dict(question)
+        answers = question.pop("answers", [])
+        post = Post(api_response=question)
+        post_start = time.perf_counter()
+        is_spam, _, _ = check_if_spam(post)
+        latencies.append(time.perf_counter() - post_start)
+        flagged += bool(is_spam)
+        for answer in answers:
+            answer = dict(answer, IsAnswer=True, title="", site=question["site"])
+            answer_post = Post(api_response=answer, parent=post)
+            post_start = time.perf_counter()
+            is_spam, _, _ = check_if_spam(answer_post)
+            latencies.append(time.perf_counter() - post_start)
+            flagged += bool(is_spam)
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {"posts": len(latencies), "flagged": flagged, "seconds": round(elapsed, 3),
+            "posts_per_second": round(len(latencies) / elapsed, 1) if elapsed else 0,
+            "p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+            "rules": rule_stats.take_interval_summary(RULE_COUNT) if rule_stats is not None else []}
+
+
+def print_results(results):
+    print("{posts} posts ({flagged} flagged) in {seconds}s: {posts_per_second} posts/s, "
+          "p50 {p50_ms}ms, p95 {p95_ms}ms, p99 {p99_ms}ms".format(**results))
+    if results["rules"]:
+        print("REASON,FIELD,CALLS,TOTAL_MS,MAX_MS,MATCHES")
+        for rule in results["rules"]:
+            print("{reason},{field},{calls},{total_ms},{max_ms},{matches}".format(**rule))
+
+
+def run_revision(revision, corpus_path):
+    """
+    Checks the revision out into a temporary worktree and runs this script there, so that the revision's own
+    rules and blacklists are timed.
+    """
+    worktree = tempfile.mkdtemp(prefix="smokey-benchmark-")
+    try:
+        subprocess.check_call(["git", "worktree", "add", "--detach", worktree, revision],
+                              stdout=subprocess.DEVNULL)
+        shutil.copy(os.path.abspath(__file__), os.path.join(worktree, "benchmark_replay.py"))
+        output = subprocess.check_output([sys.executable, "benchmark_replay.py", "run", "--json",
+                                          os.path.abspath(corpus_path)], cwd=worktree)
+        return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+    finally:
+        subprocess.call(["git", "worktree", "remove", "--force", worktree])
+        shutil.rmtree(worktree, ignore_errors=True)
+
+
+def compare(old_revision, new_revision, corpus_path):
+    old = run_revision(old_revision, corpus_path)
+    new = run_revision(new_revision, corpus_path)
+    print("METRIC,{},{},CHANGE".format(old_revision, new_revision))
+    for metric in ["posts_per_second", "p50_ms", "p95_ms", "p99_ms", "flagged"]:
+        change = "{:+.1%}".format(new[metric] / old[metric] - 1) if old[metric] else ""
+        print("{},{},{},{}".format(metric, old[metric], new[metric], change))
+    if old["flagged"] != new["flagged"]:
+        print("The revisions flag different numbers of posts, so they don't detect the same things.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline throughput benchmark for the detection engine")
+    subparsers = parser.add_subparsers(dest="command")
+
+    generate_parser = subparsers.add_parser("generate", help="write a synthetic corpus")
+    generate_parser.add_argument("corpus")
+    generate_parser.add_argument("--posts", type=int, default=1000)
+    generate_parser.add_argument("--seed", type=int, default=0)
+    generate_parser.add_argument("--spam-ratio", type=float, default=0.1)
+
+    run_parser = subparsers.add_parser("run", help="replay a corpus through check_if_spam")
+    run_parser.add_argument("corpus")
+    run_parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    run_parser.add_argument("--dns", action="store_true", help="do real DNS lookups instead of failing them")
+
+    compare_parser = subparsers.add_parser("compare", help="replay a corpus on two git revisions")
+    compare_parser.add_argument("old_revision")
+    compare_parser.add_argument("new_revision")
+    compare_parser.add_argument("corpus")
+
+    args = parser.parse_args()
+    if args.command == "generate":
+        with open(args.corpus, "w", encoding="utf-8") as f:
+            for question in generate_corpus(args.posts, args.seed, args.spam_ratio):
+                f.write(json.dumps(question) + "\n")
+    elif args.command == "run":
+        questions = load_corpus(args.corpus)
+        if args.dns:
+            results = replay(questions)
+        else:
+            with offline_dns():
+                results = replay(questions)
+        if args.json:
+            print(json.dumps(results))
+        else:
+            print_results(results)
+    elif args.command == "compare":
+        compare(args.old_revision, args.new_revision, args.corpus)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
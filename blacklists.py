@@ -1,9 +1,288 @@
 import regex
+from bisect import bisect_right
+from collections import namedtuple
+from itertools import accumulate
+import warnings
+import ahocorasick
+# re's parser is a private API, used only to find the literals of an entry. It moved to re._parser in Python 3.11,
+# where importing it as sre_parse is deprecated.
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        import sre_constants
+        import sre_parse
 
 from globalvars import GlobalVars
 from helpers import log
 
 
+TrieRegexStats = namedtuple('TrieRegexStats', 'entries literals branches pattern_length joined_length')
+
+REGEX_METACHARACTERS = set('.^$*+?{}[]|()')
+
+REGEX_ONLY_SYNTAX = regex.compile(r"\[:|\{(?!\d*,?\d*\})")
+
+PLAIN_DOMAIN = regex.compile(r"(?:[a-z0-9-]+\.)+[a-z]{2,}$", regex.IGNORECASE)
+
+# Entries whose required literals are shorter than this would be candidates for almost every text
+MIN_PREFILTER_LITERAL_LENGTH = 3
+
+
+def unescape_literal(entry):
+    """
+    Returns the text an entry matches if it is a plain ASCII literal (optionally with backslash-escaped
+    punctuation), or None if it uses any regex syntax.
+    """
+    if any(ord(char) > 127 for char in entry):
+        return None
+    literal = []
+    i = 0
+    while i < len(entry):
+        char = entry[i]
+        if char == '\\':
+            if i + 1 < len(entry) and not entry[i + 1].isalnum():
+                literal.append(entry[i + 1])
+                i += 2
+                continue
+            return None
+        if char in REGEX_METACHARACTERS:
+            return None
+        literal.append(char)
+        i += 1
+    return ''.join(literal)
+
+
+def escape_char(char):
+    return '\\' + char if char in REGEX_METACHARACTERS or char == '\\' else char
+
+
+class TrieNode:
+    def __init__(self):
+        self.children = {}
+        self.is_entry = False
+        # Whether longer entries through this node come before this node's own entry in the list
+        self.longer_entries_first = False
+
+    def emit(self):
+        branches = [escape_char(char) + child.emit() for char, child in self.children.items()]
+        if not branches:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else "(?:{})".format("|".join(branches))
+        if self.is_entry:
+            # greedy if the longer entries were listed first, lazy otherwise
+            pattern = "(?:{}){}".format(pattern, "?" if self.longer_entries_first else "??")
+        return pattern
+
+
+class Trie:
+    """
+    Consecutive literal entries of a blacklist, factored by their common prefixes.
+
+    Entries are compared in lower case, so the resulting pattern is only meant for case-insensitive regexes.
+    """
+    def __init__(self):
+        self.root = TrieNode()
+
+    def add(self, literal):
+        """
+        Adds a literal that comes after all entries already in the trie, and returns whether the trie's
+        pattern still tries the entries in list order. Returns False (leaving the trie as it was) otherwise.
+        """
+        path = [self.root]
+        for char in literal.lower():
+            node = path[-1].children.get(char)
+            if node is None:
+                break
+            path.append(node)
+
+        # An entry which was listed after the longer ones through it can't be followed by another one
+        if any(node.is_entry and node.longer_entries_first for node in path[1:len(literal)]):
+            return False
+        if len(path) == len(literal) + 1:
+            node = path[-1]
+            if not node.is_entry:
+                node.is_entry = True
+                node.longer_entries_first = bool(node.children)
+            # a duplicate entry never matches ahead of the first one, so it's safe to drop
+            return True
+
+        node = path[-1]
+        for char in literal.lower()[len(path) - 1:]:
+            node = node.children.setdefault(char, TrieNode())
+        node.is_entry = True
+        return True
+
+    def branches(self):
+        return [escape_char(char) + child.emit() for char, child in self.root.children.items()]
+
+
+def build_trie_regex(entries):
+    """
+    Builds an alternation matching exactly what "|".join(entries) matches, with every match having the same span,
+    but with runs of literal entries factored into tries. Regex entries are kept as they are.
+
+    :return: The pattern, and a TrieRegexStats of how much it shrank the list
+    """
+    branches = []
+    literal_count = 0
+    trie = None
+    for entry in entries:
+        literal = unescape_literal(entry)
+        if not literal:
+            if trie is not None:
+                branches.extend(trie.branches())
+                trie = None
+            branches.append(entry)
+            continue
+
+        literal_count += 1
+        if trie is None:
+            trie = Trie()
+        if not trie.add(literal):
+            branches.extend(trie.branches())
+            trie = Trie()
+            trie.add(literal)
+    if trie is not None:
+        branches.extend(trie.branches())
+
+    pattern = "|".join(branches)
+    return pattern, TrieRegexStats(entries=len(entries), literals=literal_count, branches=len(branches),
+                                   pattern_length=len(pattern), joined_length=len("|".join(entries)))
+
+
+def required_literals(entry):
+    """
+    Finds literals such that any text an entry matches (case-insensitively) contains at least one of them.
+
+    :return: A set of casefolded literals, or None if none could be found
+    """
+    # POSIX classes and fuzzy matching are read as literal text by sre_parse
+    if REGEX_ONLY_SYNTAX.search(entry):
+        return None
+    try:
+        # Such as inline flags the regex module allows anywhere, but re warns about when they're not at the start
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            parsed = sre_parse.parse(entry)
+    except Exception:  # Other syntax only the regex module understands
+        return None
+    return required_literals_in_sequence(parsed)
+
+
+def required_literals_in_sequence(sequence):
+    options = []
+    run = []
+    for op, av in sequence:
+        # Characters with a multi-character case folding don't match their folded form case-insensitively
+        if op is sre_constants.LITERAL and len(chr(av).casefold()) == 1:
+            run.append(chr(av).casefold())
+            continue
+        if run:
+            options.append({''.join(run)})
+            run = []
+
+        literals = None
+        if op is sre_constants.SUBPATTERN:
+            literals = required_literals_in_sequence(av[-1])
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) and av[0] >= 1:
+            literals = required_literals_in_sequence(av[2])
+        elif op is sre_constants.BRANCH:
+            branch_literals = [required_literals_in_sequence(branch) for branch in av[1]]
+            if all(branch_literals):
+                literals = set().union(*branch_literals)
+        if literals:
+            options.append(literals)
+    if run:
+        options.append({''.join(run)})
+
+    if not options:
+        return None
+    # The most selective option is the one whose shortest literal is longest
+    return max(options, key=lambda literals: min(len(literal) for literal in literals))
+
+
+class LiteralPrefilter:
+    """
+    Finds which entries of some blacklists could match a text, using an Aho-Corasick automaton over the literals
+    each entry requires. Entries without a usable literal, listed in unfiltered, can match any text, so they're left
+    out of the candidates for the caller to always check.
+    """
+    def __init__(self, blacklists):
+        self.automaton = ahocorasick.Automaton()
+        self.unfiltered = [[] for _ in blacklists]
+        entries_by_literal = {}
+        for list_index, entries in enumerate(blacklists):
+            for entry_index, entry in enumerate(entries):
+                literals = required_literals(entry)
+                if not literals or min(len(literal) for literal in literals) < MIN_PREFILTER_LITERAL_LENGTH:
+                    self.unfiltered[list_index].append(entry_index)
+                    continue
+                for literal in literals:
+                    entries_by_literal.setdefault(literal, []).append((list_index, entry_index))
+
+        for literal, entries in entries_by_literal.items():
+            self.automaton.add_word(literal, entries)
+        self.has_literals = len(entries_by_literal) > 0
+        if self.has_literals:
+            self.automaton.make_automaton()
+
+    def unfiltered_count(self):
+        return sum(len(entry_indices) for entry_indices in self.unfiltered)
+
+    def candidates(self, text):
+        """
+        :return: For each blacklist, a sorted tuple of the indices of the entries with literals which could match the
+                 text, or None if none of them can
+        """
+        return self.candidates_of_texts([text])[0]
+
+    def candidates_of_texts(self, texts):
+        """
+        The candidates of each of the texts, in order, found in a single run of the automaton over all of them.
+        """
+        found = [[set() for _ in self.unfiltered] for _ in texts]
+        if self.has_literals:
+            folded = [text.casefold() for text in texts]
+            # The texts are joined with NULs, which no literal contains, so no literal is found across two texts
+            ends = list(accumulate(len(text) + 1 for text in folded))
+            for end_index, entries in self.automaton.iter("\0".join(folded)):
+                candidates = found[bisect_right(ends, end_index)]
+                for list_index, entry_index in entries:
+                    candidates[list_index].add(entry_index)
+        return [tuple(tuple(sorted(entry_indices)) for entry_indices in candidates) if any(candidates) else None
+                for candidates in found]
+
+
+class DomainIndex:
+    """
+    The plain domain entries of a blacklist (like "example\\.com"). Such an entry is a literal, so it matches
+    wherever the prefilter finds its domain in a text, without a regex having to be run for it.
+    """
+    def __init__(self, entries):
+        # entry index -> its domain, lowercased
+        self.domains = {}
+        for entry_index, entry in enumerate(entries):
+            literal = unescape_literal(entry)
+            if literal and PLAIN_DOMAIN.match(literal):
+                self.domains[entry_index] = literal.lower()
+
+    def split(self, entry_indices):
+        """
+        :return: The entry indices that are plain domains, and the ones that aren't
+        """
+        plain = tuple(entry_index for entry_index in entry_indices if entry_index in self.domains)
+        return plain, tuple(entry_index for entry_index in entry_indices if entry_index not in self.domains)
+
+
+def report_trie_regex_stats(file_name, entries):
+    stats = build_trie_regex(entries)[1]
+    GlobalVars.blacklist_pattern_stats[file_name] = stats
+    log('debug', "{}: {} entries ({} literal) in {} branches, {} characters instead of {}".format(
+        file_name, stats.entries, stats.literals, stats.branches, stats.pattern_length, stats.joined_length))
+
+
 def load_blacklists():
     with open("bad_keywords.txt", "r", encoding="utf-8") as f:
         GlobalVars.bad_keywords = [line.rstrip() for line in f if len(line.rstrip()) > 0]
@@ -23,3 +302,9 @@ def load_blacklists():
                     'watched_keywords.txt', lineno, err))
                 continue
             GlobalVars.watched_keywords[what] = {'when': when, 'by': by_whom}
+
+    report_trie_regex_stats("bad_keywords.txt", GlobalVars.bad_keywords)
+    report_trie_regex_stats("blacklisted_websites.txt", GlobalVars.blacklisted_websites)
+    report_trie_regex_stats("watched_keywords.txt", list(GlobalVars.watched_keywords.keys()))
+    # Lets FindSpam know that its compiled rule set is out of date
+    GlobalVars.blacklists_version += 1
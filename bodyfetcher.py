@@ -1,16 +1,19 @@
 # coding=utf-8
-from spamhandling import handle_spam, check_if_spam
+from spamhandling import handle_spam, iter_posts_if_spam
 from datahandling import (add_or_update_api_data, clear_api_data, store_bodyfetcher_queue, store_bodyfetcher_max_ids,
                           store_queue_timings)
 from globalvars import GlobalVars
 from operator import itemgetter
 from datetime import datetime
-import json
+import heapq
 import time
 import threading
+from threading import Thread
 import requests
 from classes import Post, PostParseError
 from helpers import log
+from batching import BatchingController
+from dispatcher import DelayedDispatcher
 from itertools import chain
 
 
@@ -90,27 +93,45 @@ class BodyFetcher:
 
     threshold = 2
 
+    # No post waits in the queue for much longer than this many seconds, however few others its site gets
+    max_queue_age = 60
+
+    # site -> (batch size, max wait in seconds), for sites that should keep to a fixed policy
+    batching_overrides = {
+        # "meta.stackexchange.com": (1, 30),
+    }
+    # Seconds a post should wait in the queue, at most, when its site's batching is adapted to its traffic
+    batching_latency_target = 10
+    batching = BatchingController(batching_latency_target, batching_overrides)
+
+    # Seconds to give the API to have the posts' data after they show up on the websocket
+    api_settle_delay = 3
+    # Runs the API calls for flushed sites once their delay or backoff is over
+    api_dispatcher = DelayedDispatcher("bodyfetcher API calls")
+
     last_activity_date = 0
 
+    # site -> when its queue is due to be flushed (by time.monotonic), for sites with posts queued
+    flush_deadlines = {}
+    # (deadline, site), with the sites' earliest deadline first. Entries whose deadline is no longer the site's in
+    # flush_deadlines are left in, and skipped when they come up.
+    flush_heap = []
+
     api_data_lock = threading.Lock()
     queue_modify_lock = threading.Lock()
+    flush_condition = threading.Condition(queue_modify_lock)
     max_ids_modify_lock = threading.Lock()
     queue_timing_modify_lock = threading.Lock()
 
-    def add_to_queue(self, post, should_check_site=False):
+    def add_to_queue(self, event, should_check_site=False):
         mse_sandbox_id = 3122
 
-        try:
-            d = json.loads(json.loads(post)["data"])
-        except ValueError:
-            # post didn't contain a valid JSON object in its ["data"] member
-            # indicative of a server-side socket reset
-            return
-
-        site_base = d["siteBaseHostAddress"]
-        post_id = d["id"]
+        site_base = event.site
+        post_id = event.post_id
         if post_id == mse_sandbox_id and site_base == "meta.stackexchange.com":
             return  # don't check meta sandbox, it's full of weird posts
+        self.batching.record_arrival(site_base)
+        batch_size, max_wait, _ = self.flush_policy(site_base)
         self.queue_modify_lock.acquire()
         if site_base not in self.queue:
             self.queue[site_base] = {}
@@ -135,45 +156,113 @@ class BodyFetcher:
         # This line only works if we are using a dict in the self.queue[site_base] object, which we should be with
         # the previous conversion code.
         self.queue[site_base][str(post_id)] = datetime.utcnow()
+        if site_base not in self.flush_deadlines:
+            self.schedule_flush(site_base, time.monotonic() + max_wait)
+        should_flush = should_check_site or len(self.queue[site_base]) >= batch_size
+        if not should_flush:
+            # We're not making an API request, so explicitly store the queue
+            store_bodyfetcher_queue()
         self.queue_modify_lock.release()
 
-        if should_check_site:
+        if should_flush:
             self.make_api_call_for_site(site_base)
-        else:
-            self.check_queue()
         return
 
-    def check_queue(self):
-        for site, values in self.queue.items():
-            if site in self.special_cases:
-                if len(values) >= self.special_cases[site]:
-                    self.make_api_call_for_site(site)
-                    return
-            if site in self.time_sensitive:
-                if len(values) >= 1 and datetime.utcnow().hour in range(4, 12):
-                    self.make_api_call_for_site(site)
-                    return
-
-        # if we don't have any sites with their queue filled, take the first one without a special case
-        for site, values in self.queue.items():
-            if site not in self.special_cases and len(values) >= self.threshold:
-                self.make_api_call_for_site(site)
-                return
-
-        # We're not making an API request, so explicitly store the queue
+    def flushed_post_by_post(self, site):
+        return site in self.time_sensitive and datetime.utcnow().hour in range(4, 12)
+
+    def flush_threshold(self, site):
+        # How many posts a site's queue fills up with before it's flushed, by the static policy
+        if self.flushed_post_by_post(site):
+            return 1
+        return self.special_cases.get(site, self.threshold)
+
+    def static_flush_policy(self, site):
+        return self.flush_threshold(site), self.max_queue_age
+
+    def flush_policy(self, site):
+        """
+        :return: How many posts the site's queue fills up with before it's flushed, the most seconds a post waits
+                 in it, and where these came from (see BatchingController.policy)
+        """
+        if self.flushed_post_by_post(site):
+            return self.flush_threshold(site), self.max_queue_age, "static"
+        return self.batching.policy(site, *self.static_flush_policy(site))
+
+    def batching_report(self):
+        return self.batching.report(self.static_flush_policy)
+
+    def schedule_flush(self, site, deadline):
+        # Call with queue_modify_lock held
+        self.flush_deadlines[site] = deadline
+        heapq.heappush(self.flush_heap, (deadline, site))
+        self.flush_condition.notify()
+
+    def start_flush_scheduler(self):
+        """
+        Schedules the sites which are already queued, like a queue loaded from its pickle, and starts the thread which
+        flushes sites when their deadlines pass.
+        """
         self.queue_modify_lock.acquire()
-        store_bodyfetcher_queue()
+        now = datetime.utcnow()
+        for site, posts in self.queue.items():
+            if site in self.flush_deadlines:
+                continue
+            add_times = [add_time for add_time in posts.values() if isinstance(add_time, datetime)] \
+                if isinstance(posts, dict) else []
+            age = max((now - add_time).total_seconds() for add_time in add_times) if add_times else 0
+            self.schedule_flush(site, time.monotonic() + self.max_queue_age - age)
         self.queue_modify_lock.release()
 
+        Thread(name="bodyfetcher flush scheduler", target=self.run_flush_scheduler, daemon=True).start()
+
+    def run_flush_scheduler(self):
+        while True:
+            # The API call itself is left to api_dispatcher, so this doesn't hold up the other sites' deadlines
+            self.make_api_call_for_site(self.next_due_site())
+
+    def next_due_site(self):
+        """
+        Waits for the earliest deadline to pass, and returns its site.
+        """
+        self.flush_condition.acquire()
+        try:
+            while True:
+                if not self.flush_heap:
+                    self.flush_condition.wait()
+                    continue
+                deadline, site = self.flush_heap[0]
+                if self.flush_deadlines.get(site) != deadline:
+                    # The site was flushed since this deadline was set
+                    heapq.heappop(self.flush_heap)
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    self.flush_condition.wait(remaining)
+                    continue
+                heapq.heappop(self.flush_heap)
+                del self.flush_deadlines[site]
+                return site
+        finally:
+            self.flush_condition.release()
+
     def print_queue(self):
-        return '\n'.join("{0}: {1}".format(key, str(len(values))) for (key, values) in self.queue.items())
+        lines = ["{0}: {1}".format(key, str(len(values))) for (key, values) in self.queue.items()]
+        lines.append("API calls waiting: {depth}; {dispatched} made, starting {average_lateness_ms}ms late on "
+                     "average (max {max_lateness_ms}ms)".format(**self.api_dispatcher.stats()))
+        return '\n'.join(lines)
 
     def make_api_call_for_site(self, site):
         if site not in self.queue:
             return
 
         self.queue_modify_lock.acquire()
-        new_posts = self.queue.pop(site)
+        new_posts = self.queue.pop(site, None)
+        if new_posts is None:
+            # Another thread flushed the site first
+            self.queue_modify_lock.release()
+            return
+        self.flush_deadlines.pop(site, None)
         store_bodyfetcher_queue()
         self.queue_modify_lock.release()
 
@@ -251,12 +340,16 @@ class BodyFetcher:
                                                   optional_min_query_param=pagesize_modifier)
 
         # wait to make sure API has/updates post data
-        time.sleep(3)
+        self.api_dispatcher.schedule(self.api_settle_delay, self.fetch_posts_for_site, site, url, new_posts)
 
+    def fetch_posts_for_site(self, site, url, new_posts):
         GlobalVars.api_request_lock.acquire()
-        # Respect backoff, if we were given one
+        # Respect backoff, if we were given one, by coming back once it's over
         if GlobalVars.api_backoff_time > time.time():
-            time.sleep(GlobalVars.api_backoff_time - time.time() + 2)
+            self.api_dispatcher.schedule(GlobalVars.api_backoff_time - time.time() + 2, self.fetch_posts_for_site,
+                                         site, url, new_posts)
+            GlobalVars.api_request_lock.release()
+            return
         try:
             time_request_made = datetime.now().strftime('%H:%M:%S')
             response = requests.get(url, timeout=20).json()
@@ -268,6 +361,8 @@ class BodyFetcher:
                 self.queue[site].update(new_posts)
             else:
                 self.queue[site] = new_posts
+            if site not in self.flush_deadlines:
+                self.schedule_flush(site, time.monotonic() + self.flush_policy(site)[1])
             self.queue_modify_lock.release()
             GlobalVars.api_request_lock.release()
             return
@@ -325,9 +420,10 @@ class BodyFetcher:
             if len(items) > 0 and "last_activity_date" in items[0]:
                 self.last_activity_date = items[0]["last_activity_date"]
 
-        num_scanned = 0
         start_time = time.time()
 
+        # The questions and answers of the response are scanned as a batch
+        posts = []
         for post in response["items"]:
             if "title" not in post or "body" not in post:
                 continue
@@ -340,43 +436,40 @@ class BodyFetcher:
                     err, post_))
                 continue
 
-            num_scanned += 1
-
-            is_spam, reason, why = check_if_spam(post_)
-
-            if is_spam:
-                try:
-                    handle_spam(post=post_,
-                                reasons=reason,
-                                why=why)
-                except Exception as e:
-                    log('error', "Exception in handle_spam:", e)
+            posts.append(post_)
 
             try:
                 if "answers" not in post:
                     pass
                 else:
                     for answer in post["answers"]:
-                        num_scanned += 1
                         answer["IsAnswer"] = True  # Necesssary for Post object
                         answer["title"] = ""  # Necessary for proper Post object creation
                         answer["site"] = site  # Necessary for proper Post object creation
-                        answer_ = Post(api_response=answer, parent=post_)
-
-                        is_spam, reason, why = check_if_spam(answer_)
-                        if is_spam:
-                            try:
-                                handle_spam(answer_,
-                                            reasons=reason,
-                                            why=why)
-                            except Exception as e:
-                                log('error', "Exception in handle_spam:", e)
+                        posts.append(Post(api_response=answer, parent=post_))
             except Exception as e:
                 log('error', "Exception handling answers:", e)
 
-        end_time = time.time()
-        GlobalVars.posts_scan_stats_lock.acquire()
-        GlobalVars.num_posts_scanned += num_scanned
-        GlobalVars.post_scan_time += end_time - start_time
-        GlobalVars.posts_scan_stats_lock.release()
+        num_scanned = len(posts)
+
+        # Each spam is reported as soon as its part of the batch has been scanned
+        num_spam = 0
+        try:
+            for post_, (is_spam, reason, why) in zip(posts, iter_posts_if_spam(posts)):
+                if is_spam:
+                    num_spam += 1
+                    try:
+                        handle_spam(post=post_,
+                                    reasons=reason,
+                                    why=why)
+                    except Exception as e:
+                        log('error', "Exception in handle_spam:", e)
+        finally:
+            self.batching.record_scans(site, num_spam, num_scanned)
+
+            end_time = time.time()
+            GlobalVars.posts_scan_stats_lock.acquire()
+            GlobalVars.num_posts_scanned += num_scanned
+            GlobalVars.post_scan_time += end_time - start_time
+            GlobalVars.posts_scan_stats_lock.release()
         return
@@ -1,7 +1,7 @@
 # coding=utf-8
 # noinspection PyUnresolvedReferences
 from globalvars import GlobalVars
-from findspam import FindSpam
+from findspam import FindSpam, RuleStats, RegexQuarantine, NS_RESOLVER, DOMAIN_CACHE, POST_LINKS_CACHE
 # noinspection PyUnresolvedReferences
 from datetime import datetime
 from utcdate import UtcDate
@@ -310,8 +310,8 @@ def check_blacklist(string_to_test, is_username, is_watchlist):
                                     'owner': {'display_name': "Valid username", 'reputation': 1, 'link': ''},
                                     'site': "", 'IsAnswer': True, 'score': 0})
 
-    question_reasons, _ = FindSpam.test_post(question)
-    answer_reasons, _ = FindSpam.test_post(answer)
+    question_reasons, _ = FindSpam.scan_post(question)
+    answer_reasons, _ = FindSpam.scan_post(answer)
 
     # Filter out duplicates
     reasons = list(set(question_reasons) | set(answer_reasons))
@@ -855,7 +855,130 @@ def command_queuestatus(*args, **kwargs):
     Report current API queue
     :return: A string
     """
-    return Response(command_status=True, message=GlobalVars.bodyfetcher.print_queue())
+    message = GlobalVars.bodyfetcher.print_queue()
+    if GlobalVars.ingestion_pool is not None:
+        message += "\nWebsocket posts waiting: {waiting}; {handled} handled, {coalesced} coalesced, " \
+                   "{dropped} queued without the summary scan".format(**GlobalVars.ingestion_pool.stats())
+    return Response(command_status=True, message=message)
+
+
+# noinspection PyIncorrectDocstring,PyUnusedLocal
+def command_batching(*args, **kwargs):
+    """
+    Report how many posts each of the busiest sites' queues batches up, against the static policy
+    :return: A string
+    """
+    return Response(command_status=True, message=GlobalVars.bodyfetcher.batching_report())
+
+
+# noinspection PyIncorrectDocstring,PyUnusedLocal
+def command_prefilter_stats(*args, **kwargs):
+    """
+    Report how many texts the blacklist prefilter let the blacklist rules skip
+    :return: A string
+    """
+    GlobalVars.prefilter_stats_lock.acquire()
+    checks = GlobalVars.prefilter_checks
+    rejections = GlobalVars.prefilter_rejections
+    GlobalVars.prefilter_stats_lock.release()
+
+    unfiltered = sum(rule.prefilter.unfiltered_count() for rule in FindSpam.get_rule_set().rules
+                     if rule.prefilter is not None)
+    if checks == 0:
+        return Response(command_status=True, message="The blacklist prefilter hasn't checked any text yet.")
+    return Response(command_status=True,
+                    message="The blacklist prefilter rejected {} of {} texts ({:.1%}); {} blacklist entries without "
+                            "a literal to prefilter them by are checked against every text.".format(
+                                rejections, checks, rejections / checks, unfiltered))
+
+
+# noinspection PyIncorrectDocstring,PyUnusedLocal
+def command_dns_stats(*args, **kwargs):
+    """
+    Report how the NS lookups for post links have been served
+    :return: A string
+    """
+    stats = NS_RESOLVER.stats()
+    return Response(command_status=True,
+                    message="NS lookups: {hits} cache hits, {negative_hits} cached NXDOMAINs, {misses} misses; "
+                            "{lookups} queries averaging {average_lookup_ms}ms (max {max_lookup_ms}ms), "
+                            "{errors} errors, {deadline_misses} past the deadline; "
+                            "{cached_domains} domains cached.".format(**stats))
+
+
+# noinspection PyIncorrectDocstring,PyUnusedLocal
+def command_scan_pool(*args, **kwargs):
+    """
+    Report how busy each of the scan worker processes has been
+    :return: A string
+    """
+    if GlobalVars.scan_pool is None:
+        return Response(command_status=True, message="Posts are scanned in this process; set scan_workers to use "
+                                                     "worker processes.")
+    rows = GlobalVars.scan_pool.utilization()
+    retried, abandoned = GlobalVars.scan_pool.fallback_counts()
+    fallbacks = "{} chunks sent to a replacement worker, {} posts given up on.".format(retried, abandoned)
+    if not rows:
+        return Response(command_status=True, message="None of the {} scan workers have scanned anything yet. {}"
+                                                     .format(GlobalVars.scan_pool.workers, fallbacks))
+    lines = ["Worker {}: {:.1%} busy, {} posts".format(pid, utilization, posts) for pid, utilization, posts in rows]
+    return Response(command_status=True, message="Scan workers:\n" + "\n".join(lines) + "\n" + fallbacks)
+
+
+# noinspection PyIncorrectDocstring,PyUnusedLocal
+def command_rule_stats(message_parts, *args, **kwargs):
+    """
+    Report the rules that have taken the most time scanning posts
+    :param message_parts:
+    :return: A string
+    """
+    if len(message_parts) > 2:
+        return Response(command_status=False, message="The !!/rulestats command requires either 0 or 1 arguments.")
+    try:
+        count = int(message_parts[1])
+    except (ValueError, IndexError):
+        count = 5
+
+    rows = RuleStats.most_expensive(count)
+    if not rows:
+        return Response(command_status=True, message="No rules have been run yet.")
+    lines = ["{} ({}): {:.1f}s over {} calls, max {:.1f}ms, {} matches".format(
+        reason.replace("{}", "..."), field, total, calls, maximum * 1000, matches)
+        for reason, field, calls, total, maximum, matches in rows]
+    lines.append("Domain cache hit rate {:.1%}, link extraction cache hit rate {:.1%}".format(
+        DOMAIN_CACHE.hit_rate(), POST_LINKS_CACHE.hit_rate()))
+    return Response(command_status=True, message="Most expensive rules:\n" + "\n".join(lines))
+
+
+# noinspection PyIncorrectDocstring,PyUnusedLocal
+def command_quarantine(*args, **kwargs):
+    """
+    Lists the blacklist entries and rule patterns quarantined for running past their time budget
+    :param kwargs: No additional arguments expected
+    :return: A string
+    """
+    quarantined = RegexQuarantine.list_entries()
+    if not quarantined:
+        return Response(command_status=True, message="Nothing is quarantined.")
+    lines = ["{} on {}".format(RegexQuarantine.describe(reason, entry), post_url)
+             for reason, entry, post_url in quarantined]
+    return Response(command_status=True, message="Quarantined:\n" + "\n".join(lines))
+
+
+# noinspection PyIncorrectDocstring,PyUnusedLocal
+@check_permissions
+def command_unquarantine(message_parts, *args, **kwargs):
+    """
+    Puts a quarantined entry, or everything quarantined from rules with the given reason, back into the scans
+    :param message_parts:
+    :return: A string
+    """
+    if len(message_parts) < 2:
+        return Response(command_status=False, message="The !!/unquarantine command requires an entry or a reason.")
+    entry = " ".join(message_parts[1:])
+    if RegexQuarantine.release(entry) == 0:
+        return Response(command_status=False, message="That isn't quarantined.")
+    return Response(command_status=True, message="Released from quarantine.")
 
 
 # noinspection PyIncorrectDocstring,PyUnusedLocal,PyProtectedMember
@@ -1731,6 +1854,7 @@ command_dict = {
     "!!/amicodepriviledged": command_code_privileged,   # TODO: add typo warning?
     "!!/apiquota": command_quota,
     "!!/approve": command_approve,
+    "!!/batching": command_batching,
     "!!/blame": command_blame,
     "!!/block": command_block,
     "!!/brownie": command_brownie,
@@ -1748,6 +1872,7 @@ command_dict = {
     # "!!/unwatch-keyword": command_unwatch_keyword,  # TODO
     "!!/commands": command_help,
     "!!/coffee": command_coffee,
+    "!!/dnsstats": command_dns_stats,
     "!!/errorlogs": command_errorlogs,
     "!!/gitstatus": command_gitstatus,
     "!!/help": command_help,
@@ -1760,8 +1885,10 @@ command_dict = {
     "!!/master": command_master,
     "!!/notify": command_notify,
     "!!/notify-": command_notify,
+    "!!/prefilter": command_prefilter_stats,
     "!!/pull": command_pull,
     "!!/pending": command_pending,
+    "!!/quarantine": command_quarantine,
     "!!/reboot": command_reboot,
     "!!/remote-diff": command_remotediff,
     "!!/reportuser": command_allspam,
@@ -1772,6 +1899,8 @@ command_dict = {
     "!!/report": command_report_post,
     "!!/restart": command_reboot,
     "!!/rev": command_version,
+    "!!/rulestats": command_rule_stats,
+    "!!/scanpool": command_scan_pool,
     "!!/stappit": command_stappit,
     "!!/status": command_status,
     "!!/stopflagging": command_stop_flagging,
@@ -1791,6 +1920,7 @@ command_dict = {
     "!!/unblock": command_unblock,
     "!!/unnotify": command_unnotify,
     "!!/unnotify-": command_unnotify,
+    "!!/unquarantine": command_unquarantine,
     "!!/ver": command_version,
     "!!/willibenotified": command_willbenotified,
     "!!/whoami": command_whoami,
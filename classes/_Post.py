@@ -2,6 +2,7 @@
 import json
 from helpers import log
 import html
+from ._QuestionEvent import QuestionEvent
 from typing import AnyStr, Union
 
 
@@ -27,8 +28,8 @@ class Post:
     _user_url = ""
     _votes = {'downvotes': None, 'upvotes': None}
 
-    def __init__(self, json_data=None, api_response=None, parent=None):
-        # type: (AnyStr, dict, Post) -> None
+    def __init__(self, json_data=None, api_response=None, parent=None, event=None):
+        # type: (AnyStr, dict, Post, QuestionEvent) -> None
 
         if parent is not None:
             if not isinstance(parent, Post):
@@ -40,8 +41,11 @@ class Post:
             self._parse_json_post(json_data)
         elif api_response is not None:
             self._parse_api_post(api_response)
+        elif event is not None:
+            self._parse_event(event)
         else:
-            raise PostParseError("Must provide either JSON Data or an API Response object for Post object.")
+            raise PostParseError("Must provide either JSON Data, an API Response or a QuestionEvent object for "
+                                 "Post object.")
 
         return  # Required for PEP484 compliance
 
@@ -70,35 +74,33 @@ class Post:
     def _parse_json_post(self, json_data):
         # type: (str) -> None
 
-        text_data = json.loads(json_data)["data"]
-        if text_data == "hb":
+        frame = json.loads(json_data)
+        if frame["data"] == "hb":
             return
 
-        try:
-            data = json.loads(text_data)
-        except ValueError:
-            log('error', u"Encountered ValueError parsing the following:\n{0}".format(json_data))
+        event = QuestionEvent.from_frame(frame)
+        if event is None:
+            log('error', u"Couldn't parse a question from the following:\n{0}".format(json_data))
             return
 
-        if "ownerUrl" not in data:
+        self._parse_event(event)
+
+        return  # PEP compliance
+
+    def _parse_event(self, event):
+        # type: (QuestionEvent) -> None
+
+        if event.owner_url is None:
             # owner's account doesn't exist anymore, no need to post it in chat:
             # http://chat.stackexchange.com/transcript/message/18380776#18380776
             return
 
-        element_map = {
-            'titleEncodedFancy': '_title',
-            'bodySummary': '_body',
-            'ownerDisplayName': '_user_name',
-            'url': '_user_url',
-            'id': '_post_id',
-            'siteBaseHostAddress': '_post_site',
-        }
-
-        self._process_element_mapping(element_map, data, is_api_response=False)
-
-        self._title = self._unescape_title(self._title)
-        self._post_id = str(self._post_id)
-        self._post_site = self._post_site.encode("ascii", errors="replace")
+        self._title = self._unescape_title(event.title)
+        self._body = event.summary
+        self._user_name = event.display_name
+        self._user_url = event.url
+        self._post_id = str(event.post_id)
+        self._post_site = event.site.encode("ascii", errors="replace")
         self._owner_rep = 1
         self._post_score = 0
         self._body_is_summary = True
@@ -0,0 +1,34 @@
+# coding=utf-8
+from collections import namedtuple
+import json
+
+
+class QuestionEvent(namedtuple("QuestionEvent", ["site", "post_id", "title", "summary", "url", "owner_url",
+                                                 "display_name"])):
+    """
+    The parts of a 155-questions-active websocket message that are used, decoded once when the message is received
+    so that scanning the summary and queueing the post don't each decode it again.
+
+    owner_url is None if the owner's account doesn't exist anymore.
+    """
+    __slots__ = ()
+
+    @staticmethod
+    def from_frame(frame):
+        # type: (dict) -> QuestionEvent
+        """
+        :param frame: The decoded websocket message, whose "data" member is itself a JSON string
+        :return: The message's QuestionEvent, or None if its data isn't a question
+        """
+        try:
+            data = json.loads(frame["data"])
+        except ValueError:
+            # data isn't a valid JSON object, indicative of a server-side socket reset
+            return None
+        if not isinstance(data, dict) or "siteBaseHostAddress" not in data or "id" not in data:
+            return None
+
+        return QuestionEvent(site=data["siteBaseHostAddress"], post_id=data["id"],
+                             title=data.get("titleEncodedFancy") or "", summary=data.get("bodySummary") or "",
+                             url=data.get("url") or "", owner_url=data.get("ownerUrl"),
+                             display_name=data.get("ownerDisplayName") or "")
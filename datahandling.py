@@ -13,6 +13,7 @@ import regex
 
 from globalvars import GlobalVars
 from blacklists import load_blacklists
+from findspam import RegexQuarantine
 
 
 def _load_pickle(path, encoding='utf-8'):
@@ -67,6 +68,9 @@ def load_files():
         GlobalVars.bodyfetcher.previous_max_ids = _load_pickle("bodyfetcherMaxIds.p", encoding='utf-8')
     if os.path.isfile("bodyfetcherQueueTimings.p"):
         GlobalVars.bodyfetcher.queue_timings = _load_pickle("bodyfetcherQueueTimings.p", encoding='utf-8')
+    if os.path.isfile("regexQuarantine.p"):
+        RegexQuarantine.replace(_load_pickle("regexQuarantine.p", encoding='utf-8') or [])
+    RegexQuarantine.on_change = store_regex_quarantine
     load_blacklists()
 
 
@@ -290,6 +294,11 @@ def store_bodyfetcher_max_ids():
         pickle.dump(GlobalVars.bodyfetcher.previous_max_ids, f, protocol=pickle.HIGHEST_PROTOCOL)
 
 
+def store_regex_quarantine():
+    with open("regexQuarantine.p", "wb") as f:
+        pickle.dump(RegexQuarantine.list_entries(), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
 def store_queue_timings():
     with open("bodyfetcherQueueTimings.p", "wb") as f:
         pickle.dump(GlobalVars.bodyfetcher.queue_timings, f, protocol=pickle.HIGHEST_PROTOCOL)
@@ -0,0 +1,87 @@
+# coding=utf-8
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+import itertools
+import threading
+import time
+
+from helpers import log
+
+
+class DelayedDispatcher:
+    """
+    Runs calls after a delay, on a small pool of threads, instead of each call's own thread sleeping until it's due.
+
+    One timer thread, started by the first call scheduled, waits for the earliest call on a heap and hands it to the
+    pool when it comes due. How late calls start, from waiting for the timer or for a free thread, is kept track of.
+    """
+    def __init__(self, name, workers=4):
+        self.name = name
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        # (when it's due by time.monotonic, sequence number to keep calls due at once in order, function, args)
+        self.heap = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.thread = None
+
+        # Calls handed to the pool that haven't started yet
+        self.handed_off = 0
+        self.dispatched = 0
+        self.total_lateness = 0
+        self.max_lateness = 0
+        self.stats_lock = threading.Lock()
+
+    def schedule(self, delay, function, *args):
+        self.condition.acquire()
+        try:
+            heapq.heappush(self.heap, (time.monotonic() + delay, next(self.sequence), function, args))
+            if self.thread is None:
+                self.thread = threading.Thread(name=self.name, target=self.run, daemon=True)
+                self.thread.start()
+            self.condition.notify()
+        finally:
+            self.condition.release()
+
+    def run(self):
+        while True:
+            self.condition.acquire()
+            try:
+                while not self.heap or self.heap[0][0] > time.monotonic():
+                    self.condition.wait(self.heap[0][0] - time.monotonic() if self.heap else None)
+                due, _, function, args = heapq.heappop(self.heap)
+                # Counted while the condition is held, so that stats never misses a call between the heap and the pool
+                self.stats_lock.acquire()
+                self.handed_off += 1
+                self.stats_lock.release()
+            finally:
+                self.condition.release()
+            self.executor.submit(self.call, due, function, args)
+
+    # noinspection PyBroadException
+    def call(self, due, function, args):
+        lateness = max(time.monotonic() - due, 0)
+        self.stats_lock.acquire()
+        self.handed_off -= 1
+        self.dispatched += 1
+        self.total_lateness += lateness
+        self.max_lateness = max(self.max_lateness, lateness)
+        self.stats_lock.release()
+        try:
+            function(*args)
+        except Exception as e:
+            log('error', "Exception in {}:".format(self.name), e)
+
+    def stats(self):
+        """
+        :return: The calls waiting, whether for their time or for a free thread, and how late the calls made started
+        """
+        self.condition.acquire()
+        self.stats_lock.acquire()
+        try:
+            return {'depth': len(self.heap) + self.handed_off, 'dispatched': self.dispatched,
+                    'average_lateness_ms': round(self.total_lateness * 1000 / self.dispatched, 1)
+                    if self.dispatched else 0,
+                    'max_lateness_ms': round(self.max_lateness * 1000, 1)}
+        finally:
+            self.stats_lock.release()
+            self.condition.release()
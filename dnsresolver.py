@@ -0,0 +1,168 @@
+# coding=utf-8
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+import threading
+import time
+import dns.exception
+import dns.resolver
+
+from helpers import log
+
+
+# noinspection PyBroadException
+class NameserverResolver:
+    """
+    Looks up the NS records of domains on a pool of threads.
+
+    Answers are cached for their TTL and NXDOMAINs for negative_ttl seconds, in an LRU of at most max_entries domains.
+    Other DNS errors aren't cached. Any object with dnspython's Resolver.resolve(qname, rdtype), or the query() it
+    replaced in dnspython 2.0, can be passed in as the resolver, which is how the tests use a stub.
+    """
+    def __init__(self, resolver=None, max_entries=10000, negative_ttl=300, workers=8):
+        self.resolver = resolver or dns.resolver
+        # query() is deprecated since dnspython 2.0, but is all that older versions have
+        self.resolve = getattr(self.resolver, 'resolve', None) or self.resolver.query
+        self.max_entries = max_entries
+        self.negative_ttl = negative_ttl
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        # domain -> (expiry time, list of nameservers, or None for NXDOMAIN)
+        self.cache = OrderedDict()
+        # domain -> future of a lookup in progress, so that concurrent posts share it
+        self.pending = {}
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.deadline_misses = 0
+        self.lookups = 0
+        self.lookup_time = 0
+        self.max_lookup_time = 0
+
+    def nameservers(self, domains, deadline):
+        """
+        Looks up all of the domains at once, waiting at most deadline seconds for the ones which aren't cached.
+        Lookups still running at the deadline carry on, and are cached for later posts.
+
+        :return: A dict of domain to its list of nameservers, or to None if it doesn't exist. Domains which
+                 failed or ran past the deadline are left out.
+        """
+        results = {}
+        futures = {}
+        now = time.monotonic()
+        self.lock.acquire()
+        try:
+            for domain in set(domains):
+                cached = self.cache.get(domain)
+                if cached is not None and cached[0] > now:
+                    self.cache.move_to_end(domain)
+                    results[domain] = cached[1]
+                    if cached[1] is None:
+                        self.negative_hits += 1
+                    else:
+                        self.hits += 1
+                    continue
+
+                self.misses += 1
+                future = self.pending.get(domain)
+                if future is None:
+                    future = self.executor.submit(self.look_up, domain)
+                    self.pending[domain] = future
+                futures[domain] = future
+        finally:
+            self.lock.release()
+
+        if futures:
+            not_done = wait(futures.values(), timeout=deadline).not_done
+            for domain, future in futures.items():
+                if future in not_done:
+                    self.lock.acquire()
+                    self.deadline_misses += 1
+                    self.lock.release()
+                    log('warning', 'NS lookup for {0} ran past the {1}s deadline'.format(domain, deadline))
+                    continue
+                found, nameservers = future.result()
+                if found:
+                    results[domain] = nameservers
+        return results
+
+    def look_up(self, domain):
+        """
+        Runs on the pool. Returns whether there's an answer for the domain, and the nameservers (None for NXDOMAIN).
+        """
+        start = time.monotonic()
+        try:
+            answer = self.resolve(domain, 'ns')
+            found = True
+            nameservers = [server.target.to_text() for server in answer]
+            ttl = answer.rrset.ttl
+        except dns.resolver.NXDOMAIN:
+            log('debug', 'domain {0} not found; skipping'.format(domain))
+            found = True
+            nameservers = None
+            ttl = self.negative_ttl
+        except dns.exception.DNSException as exc:
+            log('warning', 'DNS error {0} (duration: {1:.3f}s)'.format(exc, time.monotonic() - start))
+            found = False
+            nameservers = None
+            ttl = None
+        except Exception as exc:
+            log('error', 'NS lookup for {0} failed: {1}'.format(domain, exc))
+            found = False
+            nameservers = None
+            ttl = None
+        duration = time.monotonic() - start
+
+        self.lock.acquire()
+        try:
+            self.lookups += 1
+            self.lookup_time += duration
+            self.max_lookup_time = max(self.max_lookup_time, duration)
+            if found:
+                self.cache[domain] = (time.monotonic() + ttl, nameservers)
+                self.cache.move_to_end(domain)
+                while len(self.cache) > self.max_entries:
+                    self.cache.popitem(last=False)
+            else:
+                self.errors += 1
+            self.pending.pop(domain, None)
+        finally:
+            self.lock.release()
+        return found, nameservers
+
+    # The counters that take_counters and add_counters carry between processes
+    COUNTERS = ('hits', 'negative_hits', 'misses', 'errors', 'deadline_misses', 'lookups', 'lookup_time')
+
+    def take_counters(self):
+        """
+        :return: The counters since the last call, and the longest lookup, starting them over
+        """
+        self.lock.acquire()
+        try:
+            counters = {name: getattr(self, name) for name in self.COUNTERS}
+            counters['max_lookup_time'] = self.max_lookup_time
+            for name in counters:
+                setattr(self, name, 0)
+            return counters
+        finally:
+            self.lock.release()
+
+    def add_counters(self, counters):
+        self.lock.acquire()
+        try:
+            for name in self.COUNTERS:
+                setattr(self, name, getattr(self, name) + counters[name])
+            self.max_lookup_time = max(self.max_lookup_time, counters['max_lookup_time'])
+        finally:
+            self.lock.release()
+
+    def stats(self):
+        self.lock.acquire()
+        try:
+            return {'hits': self.hits, 'negative_hits': self.negative_hits, 'misses': self.misses,
+                    'errors': self.errors, 'deadline_misses': self.deadline_misses, 'lookups': self.lookups,
+                    'average_lookup_ms': round(self.lookup_time * 1000 / self.lookups, 1) if self.lookups else 0,
+                    'max_lookup_ms': round(self.max_lookup_time * 1000, 1), 'cached_domains': len(self.cache)}
+        finally:
+            self.lock.release()
@@ -5,23 +5,49 @@ import regex
 from difflib import SequenceMatcher
 from urllib.parse import urlparse
 from itertools import chain
-from collections import Counter
-from datetime import datetime
+from collections import Counter, namedtuple, OrderedDict
+from bisect import bisect_left
+import heapq
+import threading
+import time
 
 # noinspection PyPackageRequirements
 import tld
 # noinspection PyPackageRequirements
 from tld.utils import TldDomainNotFound
 import phonenumbers
-import dns.resolver
 
-from helpers import all_matches_unique, log
+from helpers import all_matches_unique, log, LRUCache
 from globalvars import GlobalVars
-from blacklists import load_blacklists
+from dnsresolver import NameserverResolver
+from blacklists import load_blacklists, build_trie_regex, LiteralPrefilter, DomainIndex
+from htmlsegments import segment_body
 
 SIMILAR_THRESHOLD = 0.95
 SIMILAR_ANSWER_THRESHOLD = 0.7
 CHARACTER_USE_RATIO = 0.42
+PREFILTERED_REGEX_CACHE_SIZE = 256
+# Longest a rule's regex may run on one field of a post, and a single blacklist entry when looking for the one to blame
+RULE_REGEX_TIMEOUT = 1
+ENTRY_REGEX_TIMEOUT = 0.25
+# Longest the search for the entries to blame may take altogether, enough to narrow a thousand entries down to one
+BLAME_TIME_BUDGET = 3
+# How many posts FindSpam.test_posts hands to a worker at a time
+TEST_POSTS_CHUNK_SIZE = 25
+# How long a post waits for the NS records of its links' domains
+NS_LOOKUP_DEADLINE = 5
+# The same popular domains turn up in a lot of posts
+DOMAIN_CACHE = LRUCache(10000)
+# similar_answer keeps an index of the answers seen on each recent question, and compares an answer exactly
+# with only the few most similar of them by shingle sketch
+SIMILAR_ANSWER_INDEX = LRUCache(1000)
+SIMILAR_ANSWER_CANDIDATES = 5
+SHINGLE_LENGTH = 5
+SKETCH_SIZE = 64
+# Highest username/domain ratio from perform_similarity_checks, for each (domain, username)
+SIMILARITY_CACHE = LRUCache(10000)
+# Rules checking links in the same text (title or body view) of the posts being scanned share the extraction
+POST_LINKS_CACHE = LRUCache(64)
 EXCEPTION_RE = r"^Domain (.*) didn't .*!$"
 RE_COMPILE = regex.compile(EXCEPTION_RE)
 COMMON_MALFORMED_PROTOCOLS = [
@@ -50,10 +76,127 @@ URL_REGEX = regex.compile(
     r"""*[a-z\u00a1-\uffff0-9]+)*(?:\.(?:[a-z\u00a1-\uffff]{2,})))(?::\d{2,5})?(?:/\S*)?""", regex.UNICODE)
 
 
+# Rules checking the same text of a post share what they work out about it
+TEXT_FEATURES_CACHE = LRUCache(64)
+
+
+def text_features(s):
+    return TEXT_FEATURES_CACHE.get_or_compute(s, lambda: TextFeatures(s))
+
+
+class TextFeatures:
+    """
+    Facts about one field of a post that several method rules use, each worked out on first use and then shared.
+
+    Transformations of the text that rules scan are derived TextFeatures themselves, so their facts are shared too.
+    """
+    def __init__(self, text):
+        self.text = text
+        self.features = {}
+
+    def feature(self, name, compute):
+        try:
+            return self.features[name]
+        except KeyError:
+            value = self.features[name] = compute()
+            return value
+
+    def derive(self, name, transform):
+        return self.feature(name, lambda: TextFeatures(transform(self.text)))
+
+    @property
+    def lower(self):
+        return self.feature('lower', self.text.lower)
+
+    @property
+    def links(self):
+        return self.feature('links', lambda: post_links(self.text))
+
+    @property
+    def domains(self):
+        return self.feature('domains', lambda: frozenset(get_domain(link, full=True) for link in self.links))
+
+    @property
+    def words(self):
+        return self.feature('words', lambda: [word for word in WORD_SEPARATOR_RE.split(self.text) if word != ""])
+
+    @property
+    def char_counts(self):
+        return self.feature('char_counts', lambda: Counter(self.text))
+
+    @property
+    def char_stats(self):
+        return self.feature('char_stats', lambda: character_stats(self.text, self.char_counts))
+
+    @property
+    def script_counts(self):
+        return self.char_stats.scripts
+
+    @property
+    def runs(self):
+        """
+        The runs of one character repeated, as (character, length). Only short texts are checked for these, so
+        they aren't part of char_stats.
+        """
+        return self.feature('runs', lambda: [(match.group(1), len(match.group(0)))
+                                             for match in CHARACTER_RUN_RE.finditer(self.text)])
+
+    @property
+    def digit_count(self):
+        return self.feature('digit_count', lambda: len(DIGIT_RE.findall(self.text)))
+
+    @property
+    def segments(self):
+        return self.feature('segments', lambda: segment_body(self.text))
+
+    @property
+    def nofollow_anchors(self):
+        """
+        The anchors which SE rendered from a user's link, i.e. whose rel ends the tag with nofollow, and which are
+        closed.
+        """
+        return self.feature('nofollow_anchors', lambda: [
+            segment for segment in self.segments
+            if segment.kind == 'anchor' and segment.text is not None and segment.tag.endswith(NOFOLLOW_TAG_ENDINGS)])
+
+    @property
+    def link_texts(self):
+        return self.feature('link_texts', lambda: [anchor.text for anchor in self.nofollow_anchors
+                                                   if "<" not in anchor.text])
+
+
+WORD_SEPARATOR_RE = regex.compile(r"[\s.,;!/\()\[\]+_-]")
+LATIN_RE = regex.compile(r"(?u)\p{script=Latin}")
+CYRILLIC_RE = regex.compile(r"(?u)\p{script=Cyrillic}")
+DIGIT_RE = regex.compile(r"\d")
+NOFOLLOW_TAG_ENDINGS = ('nofollow">', 'nofollow noreferrer">')
+CHARACTER_RUN_RE = regex.compile(r"(?s)(.)\1+")
+
+# The character distribution rules are thresholds on these.
+#   scripts: how many of the characters are Latin, Cyrillic, or in any other script
+CharacterStats = namedtuple("CharacterStats", ["length", "uniques", "most_common_count", "dots", "scripts"])
+
+
+def character_stats(text, char_counts):
+    """
+    Works out the CharacterStats of a text from the count of its characters, so each distinct character is only
+    looked at once however often it appears.
+    """
+    latin = cyrillic = 0
+    for char, count in char_counts.items():
+        if LATIN_RE.match(char):
+            latin += count
+        elif CYRILLIC_RE.match(char):
+            cyrillic += count
+    return CharacterStats(length=len(text), uniques=len(char_counts),
+                          most_common_count=max(char_counts.values()) if char_counts else 0,
+                          dots=char_counts['.'],
+                          scripts={'latin': latin, 'cyrillic': cyrillic, 'other': len(text) - latin - cyrillic})
+
+
 # noinspection PyUnusedLocal,PyMissingTypeHints,PyTypeChecker
 def has_repeated_words(s, site, *args):
-    words = regex.split(r"[\s.,;!/\()\[\]+_-]", s)
-    words = [word for word in words if word != ""]
+    words = text_features(s).words
     streak = 0
     prev = ""
     for word in words:
@@ -67,11 +210,16 @@ def has_repeated_words(s, site, *args):
     return False, ""
 
 
+PARAGRAPH_TAG_RE = regex.compile("</?p>")
+
+
 # noinspection PyUnusedLocal,PyMissingTypeHints
 def has_few_characters(s, site, *args):
-    s = regex.sub("</?p>", "", s).rstrip()    # remove HTML paragraph tags from posts
-    uniques = len(set(list(s)))
-    if (len(s) >= 30 and uniques <= 6) or (len(s) >= 100 and uniques <= 15):    # reduce if false reports appear
+    # remove HTML paragraph tags from posts
+    stripped = text_features(s).derive('paragraph_tags_stripped', lambda text: PARAGRAPH_TAG_RE.sub("", text).rstrip())
+    uniques = stripped.char_stats.uniques
+    length = stripped.char_stats.length
+    if (length >= 30 and uniques <= 6) or (length >= 100 and uniques <= 15):    # reduce if false reports appear
         if (uniques <= 15) and (uniques >= 5) and site == "math.stackexchange.com":
             # Special case for Math.SE: Uniques case may trigger false-positives.
             return False, ""
@@ -79,67 +227,96 @@ def has_few_characters(s, site, *args):
     return False, ""
 
 
+URL_START_RE = regex.compile('http[^"]*')
+PRE_OR_CODE_TAG_RE = regex.compile("<pre>|<code>")
+REPEATABLE_CHARACTER_RE = regex.compile(u"[^\\s_\u200b\u200c.,?!=~*/0-9-]", regex.UNICODE)
+
+
 # noinspection PyUnusedLocal,PyMissingTypeHints
 def has_repeating_characters(s, site, *args):
-    s = regex.sub('http[^"]*', "", s)    # remove URLs for this check
-    if s is None or len(s) == 0 or len(s) >= 300 or regex.compile("<pre>|<code>").search(s):
+    stripped = text_features(s).derive('urls_stripped', lambda text: URL_START_RE.sub("", text))  # remove URLs
+    s = stripped.text
+    if s is None or len(s) == 0 or len(s) >= 300 or PRE_OR_CODE_TAG_RE.search(s):
         return False, ""
-    matches = regex.compile(u"([^\\s_\u200b\u200c.,?!=~*/0-9-])(\\1{10,})", regex.UNICODE).findall(s)
-    match = "".join(["".join(match) for match in matches])
+    # Runs of at least 11 of a character
+    match = "".join(char * length for char, length in stripped.runs
+                    if length > 10 and REPEATABLE_CHARACTER_RE.match(char))
     if (100 * len(match) / len(s)) >= 20:  # Repeating characters make up >= 20 percent
         return True, u"Repeated character: *{}*".format(match)
     return False, ""
 
 
+CLOSING_FORMAT_TAG_RE = regex.compile("</strong>|</em>|</p>")
+LINK_AT_END_RE = regex.compile(r"(?i)https?://(?:[.A-Za-z0-9-]*/?[.A-Za-z0-9-]*/?|plus\.google\.com/"
+                               r"[\w/]*|www\.pinterest\.com/pin/[\d/]*)</a>\s*$")
+LINK_AT_END_WHITELIST_RE = regex.compile(
+    r"(?i)upload|\b(imgur|yfrog|gfycat|tinypic|sendvid|ctrlv|prntscr|gyazo|youtu\.?be|"
+    r"stackexchange|superuser|past[ie].*|dropbox|microsoft|newegg|cnet|regex101|"
+    r"(?<!plus\.)google|localhost|ubuntu|getbootstrap|"
+    r"jsfiddle\.net|codepen\.io)\b")
+
+
 # noinspection PyUnusedLocal,PyMissingTypeHints
 def link_at_end(s, site, *args):   # link at end of question, on selected sites
-    s = regex.sub("</strong>|</em>|</p>", "", s)
-    match = regex.compile(r"(?i)https?://(?:[.A-Za-z0-9-]*/?[.A-Za-z0-9-]*/?|plus\.google\.com/"
-                          r"[\w/]*|www\.pinterest\.com/pin/[\d/]*)</a>\s*$").search(s)
-    if match and not regex.compile(r"(?i)upload|\b(imgur|yfrog|gfycat|tinypic|sendvid|ctrlv|prntscr|gyazo|youtu\.?be|"
-                                   r"stackexchange|superuser|past[ie].*|dropbox|microsoft|newegg|cnet|regex101|"
-                                   r"(?<!plus\.)google|localhost|ubuntu|getbootstrap|"
-                                   r"jsfiddle\.net|codepen\.io)\b").search(match.group(0)):
+    s = CLOSING_FORMAT_TAG_RE.sub("", s)
+    match = LINK_AT_END_RE.search(s)
+    if match and not LINK_AT_END_WHITELIST_RE.search(match.group(0)):
         return True, u"Link at end: {}".format(match.group(0))
     return False, ""
 
 
+NON_WORD_CHAR_RE = regex.compile(r"(?u)\W")
+WORD_CHAR_RE = regex.compile(r"\w")
+
+
 # noinspection PyUnusedLocal,PyMissingTypeHints,PyTypeChecker
 def non_english_link(s, site, *args):   # non-english link in short answer
     if len(s) < 600:
-        links = regex.compile(r'nofollow(?: noreferrer)?">([^<]*)(?=</a>)', regex.UNICODE).findall(s)
+        links = text_features(s).link_texts
         for link_text in links:
-            word_chars = regex.sub(r"(?u)\W", "", link_text)
-            non_latin_chars = regex.sub(r"\w", "", word_chars)
+            word_chars = NON_WORD_CHAR_RE.sub("", link_text)
+            non_latin_chars = WORD_CHAR_RE.sub("", word_chars)
             if len(word_chars) >= 1 and ((len(word_chars) <= 20 and len(non_latin_chars) >= 1) or
                                          (len(non_latin_chars) >= 0.05 * len(word_chars))):
                 return True, u"Non-English link text: *{}*".format(link_text)
     return False, ""
 
 
+NON_WORD_CHAR_OR_URL_RE = regex.compile(r'(?u)[\W0-9]|http\S*')
+
+
 # noinspection PyUnusedLocal,PyMissingTypeHints,PyTypeChecker
 def mostly_non_latin(s, site, *args):   # majority of post is in non-Latin, non-Cyrillic characters
-    word_chars = regex.sub(r'(?u)[\W0-9]|http\S*', "", s)
-    non_latin_chars = regex.sub(r"(?u)\p{script=Latin}|\p{script=Cyrillic}", "", word_chars)
-    if len(non_latin_chars) > 0.4 * len(word_chars):
-        return True, u"Text contains {} non-Latin characters out of {}".format(len(non_latin_chars), len(word_chars))
+    word_chars = text_features(s).derive('word_chars', lambda text: NON_WORD_CHAR_OR_URL_RE.sub("", text))
+    non_latin_chars = word_chars.script_counts['other']
+    if non_latin_chars > 0.4 * len(word_chars.text):
+        return True, u"Text contains {} non-Latin characters out of {}".format(non_latin_chars, len(word_chars.text))
     return False, ""
 
 
+NOT_A_PHONE_NUMBER_RE = regex.compile(r"(?i)\b(address(es)?|run[- ]?time|error|value|server|hostname|timestamp|"
+                                      r"warning|code|(sp)?exception|version|chrome|1234567)\b", regex.UNICODE)
+PHONE_NUMBER_OBFUSCATION_RE = regex.compile("[^A-Za-z0-9\\s\"',]")
+LETTER_O_RE = regex.compile("[Oo]")
+LETTER_S_RE = regex.compile("[Ss]")
+LETTER_I_RE = regex.compile("[Ii]")
+PHONE_NUMBER_RE = regex.compile(r"(?<!\d)(?:\d{2}\s?\d{8,11}|\d\s{0,2}\d{3}\s{0,2}\d{3}\s{0,2}\d{4}|8\d{2}"
+                                r"\s{0,2}\d{3}\s{0,2}\d{4})(?!\d)", regex.UNICODE)
+NOT_A_PHONE_NUMBER_DIGITS_RE = regex.compile(r"^21474(672[56]|8364)|^192168")
+
+
 # noinspection PyUnusedLocal,PyMissingTypeHints
 def has_phone_number(s, site, *args):
-    if regex.compile(r"(?i)\b(address(es)?|run[- ]?time|error|value|server|hostname|timestamp|warning|code|"
-                     r"(sp)?exception|version|chrome|1234567)\b", regex.UNICODE).search(s):
+    if NOT_A_PHONE_NUMBER_RE.search(s):
         return False, ""  # not a phone number
-    s = regex.sub("[^A-Za-z0-9\\s\"',]", "", s)   # deobfuscate
-    s = regex.sub("[Oo]", "0", s)
-    s = regex.sub("[Ss]", "5", s)
-    s = regex.sub("[Ii]", "1", s)
-    matched = regex.compile(r"(?<!\d)(?:\d{2}\s?\d{8,11}|\d\s{0,2}\d{3}\s{0,2}\d{3}\s{0,2}\d{4}|8\d{2}"
-                            r"\s{0,2}\d{3}\s{0,2}\d{4})(?!\d)", regex.UNICODE).findall(s)
+    s = PHONE_NUMBER_OBFUSCATION_RE.sub("", s)   # deobfuscate
+    s = LETTER_O_RE.sub("0", s)
+    s = LETTER_S_RE.sub("5", s)
+    s = LETTER_I_RE.sub("1", s)
+    matched = PHONE_NUMBER_RE.findall(s)
     test_formats = ["IN", "US", "NG", None]      # ^ don't match parts of too long strings of digits
     for phone_number in matched:
-        if regex.compile(r"^21474(672[56]|8364)|^192168").search(phone_number):
+        if NOT_A_PHONE_NUMBER_DIGITS_RE.search(phone_number):
             return False, ""  # error code or limit of int size, or 192.168 IP
         for testf in test_formats:
             try:
@@ -153,47 +330,67 @@ def has_phone_number(s, site, *args):
     return False, ""
 
 
+NON_ALPHANUMERIC_RE = regex.compile(r"[^A-Za-z0-9\s]")
+SUPPORT_PHRASE_RE = regex.compile(r"(tech(nical)? support)|((support|service|contact|help(line)?) (telephone|phone|"
+                                  r"number))")
+SCAMMED_BUSINESS_RE = regex.compile(
+    r"(?i)\b(airlines?|apple|AVG|BT|netflix|dell|Delta|epson|facebook|gmail|google|hotmail|hp|"
+    r"lexmark|mcafee|microsoft|norton|out[l1]ook|quickbooks|sage|windows?|yahoo)\b")
+CUSTOMER_SERVICE_KEYWORD_RE = regex.compile(
+    r"(?i)\b(customer|help|care|helpline|reservation|phone|recovery|service|support|"
+    r"contact|tech|technical|telephone|number)\b")
+
+
 # noinspection PyUnusedLocal,PyMissingTypeHints
 def has_customer_service(s, site, *args):  # flexible detection of customer service in titles
-    s = s[0:300].lower()   # if applied to body, the beginning should be enough: otherwise many false positives
-    s = regex.sub(r"[^A-Za-z0-9\s]", "", s)   # deobfuscate
-    phrase = regex.compile(r"(tech(nical)? support)|((support|service|contact|help(line)?) (telephone|phone|"
-                           r"number))").search(s)
+    # if applied to body, the beginning should be enough: otherwise many false positives
+    deobfuscated = text_features(s).derive('customer_service_text',
+                                           lambda text: NON_ALPHANUMERIC_RE.sub("", text[0:300].lower()))
+    s = deobfuscated.text
+    phrase = SUPPORT_PHRASE_RE.search(s)
     if phrase and site in ["askubuntu.com", "webapps.stackexchange.com", "webmasters.stackexchange.com"]:
         return True, u"Key phrase: *{}*".format(phrase.group(0))
-    business = regex.compile(
-        r"(?i)\b(airlines?|apple|AVG|BT|netflix|dell|Delta|epson|facebook|gmail|google|hotmail|hp|"
-        r"lexmark|mcafee|microsoft|norton|out[l1]ook|quickbooks|sage|windows?|yahoo)\b").search(s)
-    digits = len(regex.compile(r"\d").findall(s))
+    business = SCAMMED_BUSINESS_RE.search(s)
+    digits = deobfuscated.digit_count
     if business and digits >= 5:
-        keywords = regex.compile(r"(?i)\b(customer|help|care|helpline|reservation|phone|recovery|service|support|"
-                                 r"contact|tech|technical|telephone|number)\b").findall(s)
+        keywords = CUSTOMER_SERVICE_KEYWORD_RE.findall(s)
         if len(set(keywords)) >= 2:
             matches = ", ".join(["".join(match) for match in keywords])
             return True, u"Scam aimed at *{}* customers. Keywords: *{}*".format(business.group(0), matches)
     return False, ""
 
 
+CAPITALIZED_WORD_RE = regex.compile(r"\b[A-Z][a-z]")
+HEALTH_ORGAN_RE = regex.compile(r"(?i)\b(colon|skin|muscle|bicep|fac(e|ial)|eye|brain|IQ|mind|head|hair|peni(s|le)|"
+                                r"breast|body|joint|belly|digest\w*)s?\b")
+HEALTH_CONDITION_RE = regex.compile(r"(?i)\b(weight|constipat(ed|ion)|dysfunction|swollen|sensitive|wrinkle|aging|"
+                                    r"suffer|acne|pimple|dry|clog(ged)?|inflam(ed|mation)|fat|age|pound)s?\b")
+HEALTH_GOAL_RE = regex.compile(r"(?i)\b(supple|build|los[es]|power|burn|erection|tone(d)|rip(ped)?|bulk|get rid|"
+                               r"mood)s?\b|"
+                               r"\b(diminish|look|reduc|beaut|renew|young|youth|lift|eliminat|enhance|energ|shred|"
+                               r"health(?!kit)|improve|enlarge|remov|vital|slim|lean|boost|str[oe]ng)")
+HEALTH_REMEDY_RE = regex.compile(r"(?i)\b(remed(y|ie)|serum|cleans?(e|er|ing)|care|(pro)?biotic|herbal|lotion|cream|"
+                                 r"gel|cure|drug|formula|recipe|regimen|solution|therapy|hydration|soap|treatment|"
+                                 r"supplement|diet|moist\w*|injection|potion|ingredient|aid|exercise|eat(ing)?)s?\b")
+HEALTH_BOAST_RE = regex.compile(r"(?i)\b(most|best|simple|top|pro|real|mirac(le|ulous)|secrets?|organic|natural|"
+                                r"perfect|ideal|fantastic|incredible|ultimate|important|reliable|critical|amazing|"
+                                r"fast|good)\b|"
+                                r"\b(super|hyper|advantag|benefi|effect|great|valu|eas[iy])")
+HEALTH_OTHER_RE = regex.compile(r"(?i)\b(product|thing|item|review|advi[cs]e|myth|make use|your?|really|work|tip|"
+                                r"shop|store|method|expert|instant|buy|fact|consum(e|ption)|baby|male|female|men|"
+                                r"women|grow|idea|suggest\w*|issue)s?\b")
+
+
 # noinspection PyUnusedLocal,PyMissingTypeHints
 def has_health(s, site, *args):   # flexible detection of health spam in titles
     s = s[0:200]   # if applied to body, the beginning should be enough: otherwise many false positives
-    capitalized = len(regex.compile(r"\b[A-Z][a-z]").findall(s)) >= 5   # words beginning with uppercase letter
-    organ = regex.compile(r"(?i)\b(colon|skin|muscle|bicep|fac(e|ial)|eye|brain|IQ|mind|head|hair|peni(s|le)|"
-                          r"breast|body|joint|belly|digest\w*)s?\b").search(s)
-    condition = regex.compile(r"(?i)\b(weight|constipat(ed|ion)|dysfunction|swollen|sensitive|wrinkle|aging|"
-                              r"suffer|acne|pimple|dry|clog(ged)?|inflam(ed|mation)|fat|age|pound)s?\b").search(s)
-    goal = regex.compile(r"(?i)\b(supple|build|los[es]|power|burn|erection|tone(d)|rip(ped)?|bulk|get rid|mood)s?\b|"
-                         r"\b(diminish|look|reduc|beaut|renew|young|youth|lift|eliminat|enhance|energ|shred|"
-                         r"health(?!kit)|improve|enlarge|remov|vital|slim|lean|boost|str[oe]ng)").search(s)
-    remedy = regex.compile(r"(?i)\b(remed(y|ie)|serum|cleans?(e|er|ing)|care|(pro)?biotic|herbal|lotion|cream|"
-                           r"gel|cure|drug|formula|recipe|regimen|solution|therapy|hydration|soap|treatment|supplement|"
-                           r"diet|moist\w*|injection|potion|ingredient|aid|exercise|eat(ing)?)s?\b").search(s)
-    boast = regex.compile(r"(?i)\b(most|best|simple|top|pro|real|mirac(le|ulous)|secrets?|organic|natural|perfect|"
-                          r"ideal|fantastic|incredible|ultimate|important|reliable|critical|amazing|fast|good)\b|"
-                          r"\b(super|hyper|advantag|benefi|effect|great|valu|eas[iy])").search(s)
-    other = regex.compile(r"(?i)\b(product|thing|item|review|advi[cs]e|myth|make use|your?|really|work|tip|shop|"
-                          r"store|method|expert|instant|buy|fact|consum(e|ption)|baby|male|female|men|women|grow|"
-                          r"idea|suggest\w*|issue)s?\b").search(s)
+    capitalized = len(CAPITALIZED_WORD_RE.findall(s)) >= 5   # words beginning with uppercase letter
+    organ = HEALTH_ORGAN_RE.search(s)
+    condition = HEALTH_CONDITION_RE.search(s)
+    goal = HEALTH_GOAL_RE.search(s)
+    remedy = HEALTH_REMEDY_RE.search(s)
+    boast = HEALTH_BOAST_RE.search(s)
+    other = HEALTH_OTHER_RE.search(s)
     score = 4 * bool(organ) + 2 * bool(condition) + 2 * bool(goal) + 2 * bool(remedy) + bool(boast) + \
         bool(other) + capitalized
     if score >= 8:
@@ -206,19 +403,27 @@ def has_health(s, site, *args):   # flexible detection of health spam in titles
     return False, ""
 
 
+PRODUCT_NAME_KEYWORDS = ["Testo?", "Dermapholia", "Garcinia", "Cambogia", "Aurora", "Kamasutra", "HL-?12", "NeuroFuse",
+                         "Junivive", "Apexatropin", "Gain", "Allure", "Nuvella", "Trimgenix", "Satin", "Prodroxatone",
+                         "Elite", "Force", "Exceptional", "Enhance(ment)?", "Nitro", "Max", "Boost", "E?xtreme",
+                         "Grow", "Deep", "Male", "Pro", "Advanced", "Monster", "Divine", "Royale", "Angele", "Trinity",
+                         "Andro", "Pure", "Skin", "Sea", "Muscle", "Ascend", "Youth", "Hyper(tone)?", "Hydroluxe",
+                         "Booster", "Serum", "Supplement", "Fuel", "Cream"]
+# These are too common on math sites
+NON_MATH_PRODUCT_NAME_KEYWORDS = ["E?X[tl\\d]?", "Alpha", "Plus", "Prime", "Formula"]
+# (whether the site is a math site) -> (regexes for three-word and two-word names)
+PRODUCT_NAME_RES = {
+    is_math_site: tuple(regex.compile(pattern.format("|".join(keywords))) for pattern in
+                        [r"(?i)\b(({0})[ -]({0})[ -]({0}))\b", r"(?i)\b(({0})[ -]({0}))\b"])
+    for is_math_site, keywords in [(True, PRODUCT_NAME_KEYWORDS),
+                                   (False, PRODUCT_NAME_KEYWORDS + NON_MATH_PRODUCT_NAME_KEYWORDS)]}
+
+
 # noinspection PyUnusedLocal,PyMissingTypeHints
 def pattern_product_name(s, site, *args):
-    keywords = ["Testo?", "Dermapholia", "Garcinia", "Cambogia", "Aurora", "Kamasutra", "HL-?12", "NeuroFuse",
-                "Junivive", "Apexatropin", "Gain", "Allure", "Nuvella", "Trimgenix", "Satin", "Prodroxatone",
-                "Elite", "Force", "Exceptional", "Enhance(ment)?", "Nitro", "Max", "Boost", "E?xtreme", "Grow",
-                "Deep", "Male", "Pro", "Advanced", "Monster", "Divine", "Royale", "Angele", "Trinity", "Andro",
-                "Pure", "Skin", "Sea", "Muscle", "Ascend", "Youth", "Hyper(tone)?", "Hydroluxe", "Booster",
-                "Serum", "Supplement", "Fuel", "Cream"]
-    if site != "math.stackexchange.com" and site != "mathoverflow.net":
-        keywords += ["E?X[tl\\d]?", "Alpha", "Plus", "Prime", "Formula"]
-    keywords = "|".join(keywords)
-    three_words = regex.compile(r"(?i)\b(({0})[ -]({0})[ -]({0}))\b".format(keywords)).findall(s)
-    two_words = regex.compile(r"(?i)\b(({0})[ -]({0}))\b".format(keywords)).findall(s)
+    three_words_re, two_words_re = PRODUCT_NAME_RES[site == "math.stackexchange.com" or site == "mathoverflow.net"]
+    three_words = three_words_re.findall(s)
+    two_words = two_words_re.findall(s)
     if len(three_words) >= 1 and all_matches_unique(three_words):
         return True, u"Pattern-matching product name *{}*".format(three_words[0][0])
     elif len(two_words) >= 2 and all_matches_unique(two_words):
@@ -226,62 +431,81 @@ def pattern_product_name(s, site, *args):
     return False, ""
 
 
+WHAT_IS_THIS_TITLE_RE = regex.compile(r'^what is this (?:[A-Z]|http://)')
+
+
 # noinspection PyUnusedLocal,PyMissingTypeHints
 def what_is_this_pharma_title(s, site, *args):   # title "what is this Xxxx?"
-    if regex.compile(r'^what is this (?:[A-Z]|http://)').match(s):
+    if WHAT_IS_THIS_TITLE_RE.match(s):
         return True, u'Title starts with "what is this"'
     else:
         return False, ""
 
 
+EMAIL_KEYWORD_RE = regex.compile(r"(?i)\b(training|we (will )?(offer|develop|provide)|sell|invest(or|ing|ment)|"
+                                 r"credit|money|quality|legit|interest(ed)?|guarantee|rent|crack|opportunity|"
+                                 r"fundraising|campaign|career|employment|candidate|loan|lover|husband|wife|marriage|"
+                                 r"illuminati|brotherhood|(join|contact) (me|us|him)|reach (us|him)|spell(caster)?|"
+                                 r"doctor|cancer|krebs|(cheat|hack)(er|ing)?|spying|passport|seaman|scam|pics|vampire|"
+                                 r"bless(ed)?|atm|miracle|cure|testimony|kidney|hospital|wetting)s?\b| Dr\.? |"
+                                 r"\$ ?[0-9,.]{4}|@qq\.com|"
+                                 r"\b(герпес|муж|жена|доктор|болезн)")
+EMAIL_RE = regex.compile(r"(?<![=#/])\b[A-z0-9_.%+-]+@(?!(example|domain|site|foo|\dx)\.[A-z]{2,4})"
+                         r"[A-z0-9_.%+-]+\.[A-z]{2,4}\b")
+OBFUSCATED_EMAIL_RE = regex.compile(r"(?<![=#/])\b[A-z0-9_.%+-]+ *@ *(g *mail|yahoo) *\. *com\b")
+
+
 # noinspection PyUnusedLocal,PyMissingTypeHints
 def keyword_email(s, site, *args):   # a keyword and an email in the same post
-    if regex.compile("<pre>|<code>").search(s) and site == "stackoverflow.com":  # Avoid false positives on SO
+    if PRE_OR_CODE_TAG_RE.search(s) and site == "stackoverflow.com":  # Avoid false positives on SO
         return False, ""
-    keyword = regex.compile(r"(?i)\b(training|we (will )?(offer|develop|provide)|sell|invest(or|ing|ment)|credit|"
-                            r"money|quality|legit|interest(ed)?|guarantee|rent|crack|opportunity|fundraising|campaign|"
-                            r"career|employment|candidate|loan|lover|husband|wife|marriage|illuminati|brotherhood|"
-                            r"(join|contact) (me|us|him)|reach (us|him)|spell(caster)?|doctor|cancer|krebs|"
-                            r"(cheat|hack)(er|ing)?|spying|passport|seaman|scam|pics|vampire|bless(ed)?|atm|miracle|"
-                            r"cure|testimony|kidney|hospital|wetting)s?\b| Dr\.? |\$ ?[0-9,.]{4}|@qq\.com|"
-                            r"\b(герпес|муж|жена|доктор|болезн)").search(s)
-    email = regex.compile(r"(?<![=#/])\b[A-z0-9_.%+-]+@(?!(example|domain|site|foo|\dx)\.[A-z]{2,4})"
-                          r"[A-z0-9_.%+-]+\.[A-z]{2,4}\b").search(s)
+    keyword = EMAIL_KEYWORD_RE.search(s)
+    email = EMAIL_RE.search(s)
     if keyword and email:
         return True, u"Keyword *{}* with email {}".format(keyword.group(0), email.group(0))
-    obfuscated_email = regex.compile(r"(?<![=#/])\b[A-z0-9_.%+-]+ *@ *(g *mail|yahoo) *\. *com\b").search(s)
+    obfuscated_email = OBFUSCATED_EMAIL_RE.search(s)
     if obfuscated_email and not email:
         return True, u"Obfuscated email {}".format(obfuscated_email.group(0))
     return False, ""
 
 
+PATTERN_EMAIL_RE = regex.compile(r"(?<![=#/])\b(dr|[A-z0-9_.%+-]*"
+                                 r"(loan|hack|financ|fund|spell|temple|herbal|spiritual|atm|heal|priest|classes|"
+                                 r"investment))[A-z0-9_.%+-]*"
+                                 r"@(?!(example|domain|site|foo|\dx)\.[A-z]{2,4})[A-z0-9_.%+-]+\.[A-z]{2,4}\b")
+
+
 # noinspection PyUnusedLocal,PyMissingTypeHints
 def pattern_email(s, site, *args):
-    pattern = regex.compile(r"(?<![=#/])\b(dr|[A-z0-9_.%+-]*"
-                            r"(loan|hack|financ|fund|spell|temple|herbal|spiritual|atm|heal|priest|classes|"
-                            r"investment))[A-z0-9_.%+-]*"
-                            r"@(?!(example|domain|site|foo|\dx)\.[A-z]{2,4})[A-z0-9_.%+-]+\.[A-z]{2,4}\b"
-                            ).search(s.lower())
+    pattern = PATTERN_EMAIL_RE.search(text_features(s).lower)
     if pattern:
         return True, u"Pattern-matching email {}".format(pattern.group(0))
     return False, ""
 
 
+KEYWORD_LINK_RE = regex.compile(r'(?i)<a href="https?://\S+')
+KEYWORD_LINK_WHITELIST_RE = regex.compile(
+    r"(?i)upload|\b(imgur|yfrog|gfycat|tinypic|sendvid|ctrlv|prntscr|gyazo|youtu\.?be|"
+    r"stackexchange|superuser|past[ie].*|dropbox|microsoft|newegg|cnet|(?<!plus\.)google|"
+    r"localhost|ubuntu)\b")
+PRAISE_RE = regex.compile(r"(?i)\b(nice|good|interesting|helpful|great|amazing) (article|blog|post|information)\b|"
+                          r"very useful")
+THANKS_RE = regex.compile(r"(?i)\b(appreciate|than(k|ks|x))\b")
+LINK_KEYWORD_RE = regex.compile(r"(?i)\b(I really appreciate|many thanks|thanks a lot|thank you (very|for)|"
+                                r"than(ks|x) for (sharing|this|your)|dear forum members|(very (informative|useful)|"
+                                r"stumbled upon (your|this)|wonderful|visit my) (blog|site|website))\b")
+
+
 # noinspection PyUnusedLocal,PyMissingTypeHints
 def keyword_link(s, site, *args):   # thanking keyword and a link in the same short answer
     if len(s) > 400:
         return False, ""
-    link = regex.compile(r'(?i)<a href="https?://\S+').search(s)
-    if not link or regex.compile(r"(?i)upload|\b(imgur|yfrog|gfycat|tinypic|sendvid|ctrlv|prntscr|gyazo|youtu\.?be|"
-                                 r"stackexchange|superuser|past[ie].*|dropbox|microsoft|newegg|cnet|(?<!plus\.)google|"
-                                 r"localhost|ubuntu)\b").search(link.group(0)):
+    link = KEYWORD_LINK_RE.search(s)
+    if not link or KEYWORD_LINK_WHITELIST_RE.search(link.group(0)):
         return False, ""
-    praise = regex.compile(r"(?i)\b(nice|good|interesting|helpful|great|amazing) (article|blog|post|information)\b|"
-                           r"very useful").search(s)
-    thanks = regex.compile(r"(?i)\b(appreciate|than(k|ks|x))\b").search(s)
-    keyword = regex.compile(r"(?i)\b(I really appreciate|many thanks|thanks a lot|thank you (very|for)|"
-                            r"than(ks|x) for (sharing|this|your)|dear forum members|(very (informative|useful)|"
-                            r"stumbled upon (your|this)|wonderful|visit my) (blog|site|website))\b").search(s)
+    praise = PRAISE_RE.search(s)
+    thanks = THANKS_RE.search(s)
+    keyword = LINK_KEYWORD_RE.search(s)
     if link and keyword:
         return True, u"Keyword *{}* with link {}".format(keyword.group(0), link.group(0))
     if link and thanks and praise:
@@ -289,46 +513,46 @@ def keyword_link(s, site, *args):   # thanking keyword and a link in the same sh
     return False, ""
 
 
+FONT_TAG_RE = regex.compile("</?strong>|</?em>")
+LINK_TEXT_BUSINESS_RE = regex.compile(
+    r"(?i)(^| )(airlines?|apple|AVG|BT|netflix|dell|Delta|epson|facebook|gmail|google|hotmail|hp|"
+    r"lexmark|mcafee|microsoft|norton|out[l1]ook|quickbooks|sage|windows?|yahoo)($| )")
+LINK_TEXT_SUPPORT_RE = regex.compile(r"(?i)(^| )(customer|care|helpline|reservation|phone|recovery|service|support|"
+                                     r"contact|tech|technical|telephone|number)($| )")
+# LINK_TEXT_KEYWORDS_RE uses FindSpam.city_list, so it's compiled after FindSpam
+
+
 # noinspection PyUnusedLocal,PyMissingTypeHints
 def bad_link_text(s, site, *args):   # suspicious text of a hyperlink
-    s = regex.sub("</?strong>|</?em>", "", s)  # remove font tags
-    keywords = regex.compile(
-        r"(?isu)"
-        r"\b(buy|cheap) |live[ -]?stream|"
-        r"\bmake (money|\$)|"
-        r"\b(porno?|(whole)?sale|coins|replica|luxury|essays?|in \L<city>)\b"
-        r"\b\L<city>(?:\b.{1.20}\b)?(service|escort|call girls?)|"
-        r"(best|make|full|hd|software|cell|data)[\w ]{1,20}(online|service|company|repair|recovery)|"
-        r"\b(writing service|essay (writing|tips))", city=FindSpam.city_list)
-    links = regex.compile(r'nofollow(?: noreferrer)?">([^<]*)(?=</a>)', regex.UNICODE).findall(s)
-    business = regex.compile(
-        r"(?i)(^| )(airlines?|apple|AVG|BT|netflix|dell|Delta|epson|facebook|gmail|google|hotmail|hp|"
-        r"lexmark|mcafee|microsoft|norton|out[l1]ook|quickbooks|sage|windows?|yahoo)($| )")
-    support = regex.compile(r"(?i)(^| )(customer|care|helpline|reservation|phone|recovery|service|support|contact|"
-                            r"tech|technical|telephone|number)($| )")
-    for link_text in links:
-        keywords_match = keywords.search(link_text)
+    for anchor in text_features(s).nofollow_anchors:
+        link_text = FONT_TAG_RE.sub("", anchor.text)
+        if "<" in link_text:
+            continue
+        keywords_match = LINK_TEXT_KEYWORDS_RE.search(link_text)
         if keywords_match:
             return True, u"Bad keyword *{}* in link text".format(keywords_match.group(0).strip())
-        business_match = business.search(link_text)
-        support_match = support.search(link_text)
+        business_match = LINK_TEXT_BUSINESS_RE.search(link_text)
+        support_match = LINK_TEXT_SUPPORT_RE.search(link_text)
         if business_match and support_match:
             return True, u"Bad keywords *{}*, *{}* in link text".format(business_match.group(0).strip(),
                                                                         support_match.group(0).strip())
     return False, ""
 
 
+BAD_URL_PATTERNS = [
+    r'[^"]*-reviews?(?:-(?:canada|(?:and|or)-scam))?/?',
+    r'[^"]*-support/?',
+]
+BAD_URL_PATTERN_RE = regex.compile(
+    r'<a href="(?P<frag>{0})"|<a href="[^"]*"(?:\s+"[^"]*")*>(?P<frag>{0})</a>'.format(
+        '|'.join(BAD_URL_PATTERNS)), regex.UNICODE)
+SE_SITE_URL_RE = regex.compile(r'^https?://{0}'.format(SE_SITES_RE))
+
+
 # noinspection PyUnusedLocal,PyMissingTypeHints
 def bad_pattern_in_url(s, site, *args):
-    patterns = [
-        r'[^"]*-reviews?(?:-(?:canada|(?:and|or)-scam))?/?',
-        r'[^"]*-support/?',
-    ]
-    matches = regex.compile(
-        r'<a href="(?P<frag>{0})"|<a href="[^"]*"(?:\s+"[^"]*")*>(?P<frag>{0})</a>'.format(
-            '|'.join(patterns)), regex.UNICODE).findall(s)
-    matches = [x for x in matches if not regex.match(
-        r'^https?://{0}'.format(SE_SITES_RE), x[0])]
+    matches = BAD_URL_PATTERN_RE.findall(s)
+    matches = [x for x in matches if not SE_SITE_URL_RE.match(x[0])]
     if matches:
         return True, u"Bad fragment in link {}".format(
             ", ".join(["".join(match) for match in matches]))
@@ -336,42 +560,39 @@ def bad_pattern_in_url(s, site, *args):
         return False, ""
 
 
+NS_RESOLVER = NameserverResolver()
+
+
 def bad_ns_for_url_domain(s, site, *args):
-    for domain in set([get_domain(link, full=True) for link in post_links(s)]):
+    domains = []
+    for domain in text_features(s).domains:
         if not tld.get_tld(domain, fix_protocol=True, fail_silently=True):
             log('debug', '{0} has no valid tld; skipping'.format(domain))
             continue
-        try:
-            starttime = datetime.now()
-            ns = dns.resolver.query(domain, 'ns')
-        except dns.exception.DNSException as exc:
-            if str(exc).startswith('None of DNS query names exist:'):
-                log('debug', 'domain {0} not found; skipping'.format(domain))
-                continue
-            endtime = datetime.now()
-            log('warning', 'DNS error {0} (duration: {1})'.format(
-                exc, endtime - starttime))
-            continue
-        endtime = datetime.now()
-        log('info', 'NS query duration {0}'.format(endtime - starttime))
-        nameservers = [server.target.to_text() for server in ns]
-        if any([ns.endswith('.namecheaphosting.com.') for ns in nameservers]):
+        domains.append(domain)
+
+    nameservers_by_domain = NS_RESOLVER.nameservers(domains, NS_LOOKUP_DEADLINE)
+    for domain in domains:
+        nameservers = nameservers_by_domain.get(domain)
+        if nameservers and any([ns.endswith('.namecheaphosting.com.') for ns in nameservers]):
             return True, '{domain} NS suspicious {ns}'.format(
                 domain=domain, ns=','.join(nameservers))
     return False, ""
 
 
+OFFENSIVE_RE = regex.compile(r"(?is)\b(ur mom|(yo)?u suck|8={3,}D|nigg[aeu][rh]?|(ass ?|a|a-)hole|fag(got)?|"
+                             r"daf[au][qk]|(?<!brain)(mother|mutha)?fuc?k+(a|ing?|e?(r|d)| off+| y(ou|e)(rself)?|"
+                             r" u+|tard)?|shit(t?er|head)|you scum|dickhead|pedo|whore|cunt|cocksucker|ejaculated?|"
+                             r"jerk off|cummies|butthurt|queef|(private|pussy) show|lesbo|"
+                             r"bitche?s?|(eat|suck)\b.{0,20}\b dick|dee[sz]e? nut[sz])s?\b")
+
+
 # noinspection PyUnusedLocal,PyMissingTypeHints
 def is_offensive_post(s, site, *args):
     if s is None or len(s) == 0:
         return False, ""
 
-    offensive = regex.compile(r"(?is)\b(ur mom|(yo)?u suck|8={3,}D|nigg[aeu][rh]?|(ass ?|a|a-)hole|fag(got)?|"
-                              r"daf[au][qk]|(?<!brain)(mother|mutha)?fuc?k+(a|ing?|e?(r|d)| off+| y(ou|e)(rself)?|"
-                              r" u+|tard)?|shit(t?er|head)|you scum|dickhead|pedo|whore|cunt|cocksucker|ejaculated?|"
-                              r"jerk off|cummies|butthurt|queef|(private|pussy) show|lesbo|"
-                              r"bitche?s?|(eat|suck)\b.{0,20}\b dick|dee[sz]e? nut[sz])s?\b")
-    matches = offensive.finditer(s)
+    matches = OFFENSIVE_RE.finditer(s)
     len_of_match = 0
     text_matched = []
     for match in matches:
@@ -383,10 +604,12 @@ def is_offensive_post(s, site, *args):
     return False, ""
 
 
+ELTIMA_RE = regex.compile(r"(?is)\beltima")
+
+
 # noinspection PyUnusedLocal,PyMissingTypeHints
 def has_eltima(s, site, *args):
-    reg = regex.compile(r"(?is)\beltima")
-    if reg.search(s) and len(s) <= 750:
+    if ELTIMA_RE.search(s) and len(s) <= 750:
         return True, u"Bad keyword *eltima* and body length under 750 chars"
     return False, ""
 
@@ -403,17 +626,8 @@ def username_similar_website(s, site, *args):
 
 # noinspection PyUnusedLocal,PyMissingTypeHints,PyTypeChecker
 def character_utilization_ratio(s, site, *args):
-    counter = Counter(s)
-    total_chars = len(s)
-    highest_ratio = 0.0
-    # highest_char = None
-
-    for key, value in counter.items():
-        char_ratio = value / float(total_chars)
-        key, value, char_ratio
-        if char_ratio > highest_ratio:
-            highest_ratio = char_ratio
-            # highest_char = key
+    stats = text_features(s).char_stats
+    highest_ratio = stats.most_common_count / float(stats.length) if stats.length else 0.0
 
     if highest_ratio > CHARACTER_USE_RATIO:
         return True, "The `{}` character appears in a high percentage of the post"
@@ -425,6 +639,10 @@ def post_links(post):
     """
     Helper function to extract URLs from a piece of HTML.
     """
+    return POST_LINKS_CACHE.get_or_compute(post, lambda: extract_links(post))
+
+
+def extract_links(post):
     # Fix stupid spammer tricks
     for p in COMMON_MALFORMED_PROTOCOLS:
         post = post.replace(p[0], p[1])
@@ -436,7 +654,7 @@ def post_links(post):
         else:
             links.append(l[:-1])
 
-    return set(links)
+    return frozenset(links)
 
 
 # noinspection PyMissingTypeHints
@@ -445,33 +663,60 @@ def perform_similarity_checks(post, name):
     Performs 4 tests to determine similarity between links in the post and the user name
     :param post: Test of the post
     :param name: Username to compare against
-    :return: Float ratio of similarity
+    :return: Float ratio of similarity. Checks that can't reach SIMILAR_THRESHOLD are skipped and count as 0,
+             so only whether the result reaches the threshold is exact.
     """
-    t1 = 0
-    t2 = 0
-    t3 = 0
-    t4 = 0
+    result = 0
+    similarity = None
 
     for link in post_links(post):
         domain = get_domain(link)
-        # Straight comparison
-        t1 = similar_ratio(domain, name)
-        # Strip all spaces check
-        t2 = similar_ratio(domain, name.replace(" ", ""))
-        # Strip all hypens
-        t3 = similar_ratio(domain.replace("-", ""), name.replace("-", ""))
-        # Strip both hypens and spaces
-        t4 = similar_ratio(domain.replace("-", "").replace(" ", ""), name.replace("-", "").replace(" ", ""))
+        key = (domain, name)
+        if similarity is None:
+            similarity = UsernameSimilarity(name)
+        result = SIMILARITY_CACHE.get_or_compute(key, lambda: similarity.ratio(domain))
         # Have we already exceeded the threshold? End now if so, otherwise, check the next link
-        if max(t1, t2, t3, t4) >= SIMILAR_THRESHOLD:
+        if result >= SIMILAR_THRESHOLD:
             break
 
-    return max(t1, t2, t3, t4)
+    return result
 
 
-# noinspection PyMissingTypeHints
-def similar_ratio(a, b):
-    return SequenceMatcher(None, a.lower(), b.lower()).ratio()
+class UsernameSimilarity:
+    """
+    The variants of a username that link domains are compared with, normalized once per post.
+
+    The checks are a straight comparison, with all spaces stripped, with all hyphens stripped from both, and with
+    both stripped from both.
+    """
+    def __init__(self, name):
+        name = name.lower()
+        self.checks = []
+        for strip_domain, name_variant in [("", name), ("", name.replace(" ", "")),
+                                           ("-", name.replace("-", "")),
+                                           ("- ", name.replace("-", "").replace(" ", ""))]:
+            if (strip_domain, name_variant) in [(check[0], check[1]) for check in self.checks]:
+                continue
+            matcher = SequenceMatcher()
+            # SequenceMatcher caches what it knows about the second sequence, so the name goes there
+            matcher.set_seq2(name_variant)
+            self.checks.append((strip_domain, name_variant, matcher))
+
+    def ratio(self, domain):
+        """
+        The highest ratio between the domain and the username over the checks, skipping those whose upper bounds
+        can't reach SIMILAR_THRESHOLD.
+        """
+        best = 0
+        for strip_domain, _, matcher in self.checks:
+            domain_variant = domain.lower()
+            for char in strip_domain:
+                domain_variant = domain_variant.replace(char, "")
+            matcher.set_seq1(domain_variant)
+            if matcher.real_quick_ratio() < SIMILAR_THRESHOLD or matcher.quick_ratio() < SIMILAR_THRESHOLD:
+                continue
+            best = max(best, matcher.ratio())
+        return best
 
 
 # noinspection PyMissingTypeHints
@@ -479,6 +724,11 @@ def get_domain(s, full=False):
     """
     Extract the domain name; with full=True, keep the TLD tacked on.
     """
+    return DOMAIN_CACHE.get_or_compute((s, full), lambda: extract_domain(s, full))
+
+
+# noinspection PyMissingTypeHints
+def extract_domain(s, full=False):
     try:
         extract = tld.get_tld(s, fix_protocol=True, as_object=True, )
         if full:
@@ -511,37 +761,97 @@ def get_domain(s, full=False):
     return domain
 
 
+class SimilarAnswerIndex:
+    """
+    The answers of one question seen so far, with their sanitized bodies and a bottom-k MinHash sketch of their
+    character shingles, so that each answer is only sanitized and sketched once.
+    """
+    def __init__(self):
+        # post id -> (body, sanitized body, sketch)
+        self.answers = {}
+        self.lock = threading.Lock()
+
+    def add(self, post_id, body):
+        self.lock.acquire()
+        cached = self.answers.get(post_id)
+        self.lock.release()
+        if cached is not None and cached[0] == body:
+            return cached[1], cached[2]
+
+        sanitized = strip_urls_and_tags(body)
+        sketch = shingle_sketch(sanitized)
+        self.lock.acquire()
+        self.answers[post_id] = (body, sanitized, sketch)
+        self.lock.release()
+        return sanitized, sketch
+
+    def others(self, post_id):
+        self.lock.acquire()
+        others = [(other_id, sanitized, sketch) for other_id, (_, sanitized, sketch) in self.answers.items()
+                  if other_id != post_id]
+        self.lock.release()
+        return others
+
+
+# noinspection PyMissingTypeHints
+def shingle_sketch(text):
+    text = " ".join(text.lower().split())
+    shingles = {text[i:i + SHINGLE_LENGTH] for i in range(max(len(text) - SHINGLE_LENGTH + 1, 1))}
+    return frozenset(heapq.nsmallest(SKETCH_SIZE, {hash(shingle) for shingle in shingles}))
+
+
+# noinspection PyMissingTypeHints
+def estimated_jaccard(sketch_a, sketch_b):
+    union_sketch = heapq.nsmallest(SKETCH_SIZE, sketch_a | sketch_b)
+    if not union_sketch:
+        return 0
+    return sum(1 for h in union_sketch if h in sketch_a and h in sketch_b) / len(union_sketch)
+
+
 # noinspection PyMissingTypeHints
 def similar_answer(post):
     if not post.parent:
         return False, False, False, ""
 
     question = post.parent
-    sanitized_body = strip_urls_and_tags(post.body)
-
-    for other_answer in question.answers:
-        if other_answer.post_id != post.post_id:
-            sanitized_answer = strip_urls_and_tags(other_answer.body)
-            ratio = similar_ratio(sanitized_body, sanitized_answer)
+    index = SIMILAR_ANSWER_INDEX.get_or_compute((post.post_site, question.post_id), SimilarAnswerIndex)
+    # Answers the API returned with the question only have a body if the caller parsed them fully
+    for other_answer in question.answers or []:
+        if other_answer.post_id and other_answer.post_id != post.post_id:
+            index.add(other_answer.post_id, other_answer.body)
+    sanitized_body, sketch = index.add(post.post_id, post.body)
+
+    # Rank the other answers by estimated similarity, and only compute the exact ratio for the top ones
+    candidates = sorted(index.others(post.post_id), key=lambda other: estimated_jaccard(sketch, other[2]),
+                        reverse=True)
+    for other_id, sanitized_answer, _ in candidates[:SIMILAR_ANSWER_CANDIDATES]:
+        matcher = SequenceMatcher(None, sanitized_body.lower(), sanitized_answer.lower())
+        # Both are upper bounds of ratio(), and much cheaper
+        if matcher.real_quick_ratio() < SIMILAR_ANSWER_THRESHOLD or matcher.quick_ratio() < SIMILAR_ANSWER_THRESHOLD:
+            continue
+        ratio = matcher.ratio()
 
-            if ratio >= SIMILAR_ANSWER_THRESHOLD:
-                return False, False, True, \
-                    u"Answer similar to answer {}, ratio {}".format(other_answer.post_id, ratio)
+        if ratio >= SIMILAR_ANSWER_THRESHOLD:
+            return False, False, True, \
+                u"Answer similar to answer {}, ratio {}".format(other_id, ratio)
 
     return False, False, False, ""
 
 
+TAG_OR_PROTOCOL_RE = regex.compile(r"</?.+?>|\w+?://")
+
+
 # noinspection PyMissingTypeHints
 def strip_urls_and_tags(string):
-    return regex.sub(r"</?.+?>|\w+?://", "", regex.sub(URL_REGEX, "", string))
+    return TAG_OR_PROTOCOL_RE.sub("", URL_REGEX.sub("", string))
 
 
 # noinspection PyUnusedLocal,PyMissingTypeHints
 def mostly_dots(s, site, *args):
-    body = strip_urls_and_tags(s)
-    body_length = len(body)
+    body = text_features(s).derive('urls_and_tags_stripped', strip_urls_and_tags)
+    body_length = body.char_stats.length
 
-    dot_count = len(regex.findall(r"\.", body))
+    dot_count = body.char_stats.dots
 
     if body_length and dot_count / float(body_length) >= 0.4:
         return True, u"Post contains {} dots out of {} characters".format(dot_count, body_length)
@@ -550,7 +860,7 @@ def mostly_dots(s, site, *args):
 
 
 def mevaqesh_troll(s, *args):
-    s = s.lower().replace(' ', '')
+    s = text_features(s).lower.replace(' ', '')
     bad = 'mevaqeshthereforehasnoshareintheworldtocome'
     if bad in s:
         return True, "Post matches pattern from a known troll"
@@ -561,6 +871,510 @@ def mevaqesh_troll(s, *args):
 load_blacklists()
 
 
+ZERO_WIDTH_RE = regex.compile("[\xad\u200b\u200c]")
+CODE_BLOCK_RE = regex.compile("(?s)<code>.*?</code>")
+CODE_BLOCK_PLACEHOLDER = u"<pre><code>placeholder for omitted code/код block</pre></code>"
+
+
+def strip_zero_width(body):
+    return ZERO_WIDTH_RE.sub("", body)
+
+
+def strip_code_blocks(body):
+    # use a placeholder to avoid triggering "few unique characters" when most of post is code
+    pieces = []
+    for segment in text_features(body).segments:
+        if segment.kind != 'code':
+            pieces.append(body[segment.start:segment.end])
+        elif segment.tag == "<pre>":
+            # The placeholder has a <code> in it, which the <code> block pass used to replace again
+            pieces.append("<pre>" + CODE_BLOCK_PLACEHOLDER)
+        elif segment.tag == "<code>":
+            pieces.append(CODE_BLOCK_PLACEHOLDER)
+        else:
+            # Only blocks without attributes are omitted, but the <code> blocks inside the others are
+            inner_end = segment.start + len(segment.tag) + len(segment.text)
+            pieces.extend([segment.tag, CODE_BLOCK_RE.sub(CODE_BLOCK_PLACEHOLDER, segment.text),
+                           body[inner_end:segment.end]])
+    return "".join(pieces)
+
+
+class BodyViews:
+    """
+    The variants of a post body that rules scan, each built on first use and then shared by all rules.
+    """
+    # view name: (view it is derived from, transformation)
+    views = {
+        'raw': (None, None),
+        'zero_width_stripped': ('raw', strip_zero_width),
+        'code_stripped': ('zero_width_stripped', strip_code_blocks),
+    }
+
+    def __init__(self, body):
+        self._cache = {'raw': body}
+
+    def get(self, name):
+        try:
+            return self._cache[name]
+        except KeyError:
+            base, transform = BodyViews.views[name]
+            text = transform(self.get(base))
+            self._cache[name] = text
+            return text
+
+
+class Rule:
+    """
+    A single entry of FindSpam.rules, with its regex compiled and its flags resolved once.
+    """
+    def __init__(self, rule, city_list):
+        self.reason = rule['reason']
+        self.is_regex_check = 'regex' in rule
+        self.city_list = city_list
+        self.prefilter = None
+        self.domain_index = None
+        if self.is_regex_check:
+            if 'blacklists' in rule:
+                self.blacklists = [[entry for entry in entries if not RegexQuarantine.contains(self.reason, entry)]
+                                   for entries in rule['blacklists']()]
+                self.pattern_template = rule['regex']
+                self.prefilter = LiteralPrefilter(self.blacklists)
+                if rule.get('index_domains', False):
+                    self.domain_index = DomainIndex(self.blacklists[0])
+                self.prefiltered_regexes = OrderedDict()
+                self.prefiltered_regexes_lock = threading.Lock()
+                # The entries without a literal to prefilter them by, compiled once, for the texts where none of the
+                # others can match
+                self.unfiltered_regex = self.build_regex(self.prefilter.unfiltered) \
+                    if self.prefilter.unfiltered_count() else None
+                pattern = self.pattern_template(*[build_trie_regex(entries)[0] for entries in self.blacklists])
+            else:
+                pattern = rule['regex']() if callable(rule['regex']) else rule['regex']
+            self.regex = self.compile(pattern)
+            self.method = None
+        else:
+            assert 'method' in rule
+            self.regex = None
+            self.method = rule['method']
+        self.whole_post = rule.get('whole_post', False)
+        self.all = rule['all']
+        self.sites = frozenset(rule['sites'])
+        self.max_rep = rule['max_rep']
+        self.max_score = rule['max_score']
+        self.title = rule['title']
+        self.body = rule['body']
+        self.username = rule['username']
+        self.stripcodeblocks = rule['stripcodeblocks']
+        self.body_summary = rule.get('body_summary', False)
+        self.answers = rule.get('answers', True)
+        self.questions = rule.get('questions', True)
+        self.body_view = 'code_stripped' if self.stripcodeblocks else 'zero_width_stripped'
+
+    def compile(self, pattern):
+        # using a named list \L in some regexes
+        return regex.compile(pattern, regex.UNICODE, city=self.city_list)
+
+    def find(self, text, type_of_text, batch_candidates=None):
+        """
+        :param batch_candidates: The prefilter's candidates for the texts of the batch being scanned, by text
+        :return: A RegexMatches of the rule in the text, or None if it doesn't match
+
+        Raises TimeoutError if the regex runs for longer than RULE_REGEX_TIMEOUT.
+        """
+        if self.prefilter is None:
+            matches = RegexMatches(self.regex, text, type_of_text)
+            return matches if matches else None
+
+        if batch_candidates is not None and text in batch_candidates:
+            candidates = batch_candidates[text]
+        else:
+            candidates = self.prefilter.candidates(text)
+        domains = ()
+        if candidates is not None and self.domain_index is not None:
+            domains, others = self.domain_index.split(candidates[0])
+            # The plain domains are left out of the regex, which is only run for the other candidates
+            candidates = (others,) + candidates[1:] if others or any(candidates[1:]) else None
+        GlobalVars.prefilter_stats_lock.acquire()
+        GlobalVars.prefilter_checks += 1
+        if candidates is None and not domains:
+            GlobalVars.prefilter_rejections += 1
+        GlobalVars.prefilter_stats_lock.release()
+        if domains:
+            # The prefilter found these domains in the text, so the rule matches without running a regex, and only a
+            # regex of the domains is needed for the why
+            return RegexMatches(self.prefiltered_regex((domains,) + ((),) * (len(self.blacklists) - 1), False),
+                                text, type_of_text, known_to_match=True)
+        if candidates is None:
+            if self.unfiltered_regex is None:
+                return None
+            matches = RegexMatches(self.unfiltered_regex, text, type_of_text)
+            return matches if matches else None
+        matches = RegexMatches(self.prefiltered_regex(candidates), text, type_of_text)
+        return matches if matches else None
+
+    def slow_entries(self, text):
+        """
+        After the rule timed out on a text, finds which of its blacklist entries take longer than ENTRY_REGEX_TIMEOUT
+        on it alone. A rule without blacklists is a single pattern, which is only to blame itself if it times out
+        again, since a single timeout can come from the process being held up by something else.
+
+        The entries are searched for in groups, halving the groups that time out, so that one slow entry among n
+        takes about log2(n) timeouts to find rather than one search per entry. This stops after BLAME_TIME_BUDGET,
+        with whatever it has found so far.
+        """
+        if self.prefilter is None:
+            try:
+                for _ in self.regex.finditer(text, timeout=RULE_REGEX_TIMEOUT):
+                    pass
+            except TimeoutError:
+                return [self.regex.pattern]
+            return []
+        slow = []
+        groups = [(list_index, entry_indices) for list_index, entry_indices
+                  in enumerate(self.with_unfiltered(self.prefilter.candidates(text))) if entry_indices][::-1]
+        deadline = time.monotonic() + BLAME_TIME_BUDGET
+        while groups:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                log('warning', 'Ran out of time looking for the entries of "{}" to blame, with {} found'.format(
+                    self.reason, len(slow)))
+                break
+            list_index, entry_indices = groups.pop()
+            entry_indices_by_list = [()] * len(self.blacklists)
+            entry_indices_by_list[list_index] = entry_indices
+            timeout = min(ENTRY_REGEX_TIMEOUT, remaining)
+            try:
+                self.build_regex(entry_indices_by_list).search(text, timeout=timeout)
+            except TimeoutError:
+                if len(entry_indices) > 1:
+                    half = len(entry_indices) // 2
+                    groups.extend(((list_index, entry_indices[half:]), (list_index, entry_indices[:half])))
+                elif timeout == ENTRY_REGEX_TIMEOUT:
+                    slow.append(self.blacklists[list_index][entry_indices[0]])
+        return slow
+
+    def with_unfiltered(self, candidates):
+        """
+        :return: The prefilter's candidates (or None) along with the entries it always leaves to be checked
+        """
+        if candidates is None:
+            return tuple(tuple(entry_indices) for entry_indices in self.prefilter.unfiltered)
+        return tuple(tuple(sorted(set(entry_indices).union(unfiltered)))
+                     for entry_indices, unfiltered in zip(candidates, self.prefilter.unfiltered))
+
+    def build_regex(self, entry_indices_by_list):
+        alternations = []
+        for entries, entry_indices in zip(self.blacklists, entry_indices_by_list):
+            # (?!) never matches, where an empty alternation would match everywhere
+            alternations.append(build_trie_regex([entries[i] for i in entry_indices])[0] if entry_indices else "(?!)")
+        return self.compile(self.pattern_template(*alternations))
+
+    def prefiltered_regex(self, candidates, with_unfiltered=True):
+        """
+        The rule's regex built from only the candidate entries of its blacklists, and the entries the prefilter
+        can't rule out. Entries whose required literals aren't in a text can't match anywhere in it, so this finds
+        the same matches as the full regex. Without with_unfiltered, it's built from just the candidates.
+        """
+        key = (candidates, with_unfiltered)
+        self.prefiltered_regexes_lock.acquire()
+        try:
+            compiled = self.prefiltered_regexes.get(key)
+            if compiled is not None:
+                self.prefiltered_regexes.move_to_end(key)
+                return compiled
+        finally:
+            self.prefiltered_regexes_lock.release()
+
+        compiled = self.build_regex(self.with_unfiltered(candidates) if with_unfiltered else candidates)
+
+        self.prefiltered_regexes_lock.acquire()
+        self.prefiltered_regexes[key] = compiled
+        if len(self.prefiltered_regexes) > PREFILTERED_REGEX_CACHE_SIZE:
+            self.prefiltered_regexes.popitem(last=False)
+        self.prefiltered_regexes_lock.release()
+        return compiled
+
+    def is_quarantined(self):
+        # Rules with blacklists leave out just their quarantined entries instead
+        return self.is_regex_check and self.prefilter is None and \
+            RegexQuarantine.contains(self.reason, self.regex.pattern)
+
+    def applies_to_site(self, site):
+        # Sites in self.sites are excluded if self.all is True, and whitelisted otherwise
+        return self.all != (site in self.sites)
+
+    def should_check_body(self, is_answer, body_is_summary):
+        return (not body_is_summary or self.body_summary) and \
+            (not is_answer or self.answers) and \
+            (is_answer or self.questions)
+
+
+# A rule that applies to a post, and which of the post's fields it has to be run against
+RuleTargets = namedtuple("RuleTargets", ["rule", "title", "body", "username"])
+
+
+class RegexMatches:
+    """
+    The matches of a regex in a text, from a single finditer pass. Only the first match is looked for up front;
+    the pass is continued for the rest when the "Position X-Y" explanation is actually needed.
+    """
+    def __init__(self, compiled_regex, text, type_of_text, known_to_match=False):
+        self.compiled_regex = compiled_regex
+        self.text = text
+        self.type_of_text = type_of_text
+        self.explanation = None
+        if known_to_match:
+            self.iterator = None
+            self.first = None
+            self.matched = True
+        else:
+            self.iterator = compiled_regex.finditer(text, timeout=RULE_REGEX_TIMEOUT)
+            self.first = next(self.iterator, None)
+            self.matched = self.first is not None
+
+    def __bool__(self):
+        return self.matched
+
+    def explain(self):
+        if self.explanation is None:
+            matches = [self.first] if self.first is not None else []
+            if self.iterator is None:
+                self.iterator = self.compiled_regex.finditer(self.text, timeout=RULE_REGEX_TIMEOUT)
+            try:
+                matches.extend(self.iterator)
+            except TimeoutError:
+                log('warning', 'Gave up on finding the rest of the matches for a why after {}s'.format(
+                    RULE_REGEX_TIMEOUT))
+            self.explanation = FindSpam.generate_why(matches, self.type_of_text)
+        return self.explanation
+
+
+class RuleSet:
+    """
+    FindSpam.rules compiled against one version of the blacklists.
+    """
+    def __init__(self, rules, city_list, blacklists_version, quarantine_version):
+        self.rules = [compiled for compiled in (Rule(rule, city_list) for rule in rules)
+                      if not compiled.is_quarantined()]
+        self.blacklists_version = blacklists_version
+        self.quarantine_version = quarantine_version
+        # Distinct max_rep and max_score values, so that a post's rep and score map to a bucket index
+        self.rep_thresholds = sorted(set(rule.max_rep for rule in self.rules))
+        self.score_thresholds = sorted(set(rule.max_score for rule in self.rules))
+        # (site, is_answer, body_is_summary, rep bucket, score bucket) -> tuple of RuleTargets
+        self.index = {}
+
+    def is_stale(self):
+        return self.blacklists_version != GlobalVars.blacklists_version or \
+            self.quarantine_version != RegexQuarantine.version
+
+    def rules_for_post(self, post):
+        """
+        The rules which apply to a post, in rule order, along with the fields each of them needs to check.
+        """
+        key = (post.post_site, post.is_answer, post.body_is_summary,
+               bisect_left(self.rep_thresholds, post.owner_rep), bisect_left(self.score_thresholds, post.post_score))
+        try:
+            return self.index[key]
+        except KeyError:
+            applicable = self.build_index_entry(*key)
+            self.index[key] = applicable
+            return applicable
+
+    def build_index_entry(self, site, is_answer, body_is_summary, rep_bucket, score_bucket):
+        # A post in rep bucket i has owner_rep <= rep_thresholds[i], so every rule whose max_rep is at least
+        # rep_thresholds[i] applies to it; likewise for the score.
+        min_rep = self.rep_thresholds[rep_bucket] if rep_bucket < len(self.rep_thresholds) else None
+        min_score = self.score_thresholds[score_bucket] if score_bucket < len(self.score_thresholds) else None
+        if min_rep is None or min_score is None:
+            return ()
+
+        applicable = []
+        for rule in self.rules:
+            if rule.applies_to_site(site) and rule.max_rep >= min_rep and rule.max_score >= min_score:
+                check_body = rule.body and rule.should_check_body(is_answer, body_is_summary)
+                applicable.append(RuleTargets(rule, rule.title, check_body, rule.username))
+        return tuple(applicable)
+
+
+# noinspection PyClassHasNoInit
+class RuleStats:
+    """
+    Calls, time taken and matches of each rule, per field it was run against, accumulated over scanned posts.
+    Rules are identified by their reason, and whole post rules are counted under the 'post' field.
+    """
+    # (reason, field) -> [calls, total seconds, max seconds, matches]
+    totals = {}
+    # the same, since the statistics were last sent to metasmoke
+    interval = {}
+    lock = threading.Lock()
+
+    @staticmethod
+    def record(timings):
+        """
+        Adds the (reason, field, seconds, matched) timings of one post, all under a single lock acquisition.
+        """
+        RuleStats.lock.acquire()
+        try:
+            for reason, field, seconds, matched in timings:
+                for stats in (RuleStats.totals, RuleStats.interval):
+                    entry = stats.get((reason, field))
+                    if entry is None:
+                        stats[(reason, field)] = [1, seconds, seconds, 1 if matched else 0]
+                    else:
+                        entry[0] += 1
+                        entry[1] += seconds
+                        entry[2] = max(entry[2], seconds)
+                        if matched:
+                            entry[3] += 1
+        finally:
+            RuleStats.lock.release()
+
+    @staticmethod
+    def take_totals():
+        """
+        Takes the statistics accumulated since the last call, and starts over. Scan worker processes hand theirs to
+        the main process this way.
+        """
+        RuleStats.lock.acquire()
+        totals = RuleStats.totals
+        RuleStats.totals = {}
+        RuleStats.interval = {}
+        RuleStats.lock.release()
+        return totals
+
+    @staticmethod
+    def merge(totals):
+        """
+        Adds statistics taken with take_totals.
+        """
+        RuleStats.lock.acquire()
+        try:
+            for key, (calls, seconds, maximum, matches) in totals.items():
+                for stats in (RuleStats.totals, RuleStats.interval):
+                    entry = stats.get(key)
+                    if entry is None:
+                        stats[key] = [calls, seconds, maximum, matches]
+                    else:
+                        entry[0] += calls
+                        entry[1] += seconds
+                        entry[2] = max(entry[2], maximum)
+                        entry[3] += matches
+        finally:
+            RuleStats.lock.release()
+
+    @staticmethod
+    def most_expensive(count, stats=None):
+        """
+        :return: Up to count (reason, field, calls, total seconds, max seconds, matches) tuples, most total time first
+        """
+        if stats is None:
+            stats = RuleStats.totals
+        RuleStats.lock.acquire()
+        rows = [(reason, field) + tuple(entry) for (reason, field), entry in stats.items()]
+        RuleStats.lock.release()
+        rows.sort(key=lambda row: row[3], reverse=True)
+        return rows[:count]
+
+    @staticmethod
+    def take_interval_summary(count=10):
+        """
+        The most expensive rules since the last call, in a form that can be sent to metasmoke.
+        """
+        RuleStats.lock.acquire()
+        interval = RuleStats.interval
+        RuleStats.interval = {}
+        RuleStats.lock.release()
+        return [{'reason': reason, 'field': field, 'calls': calls, 'total_ms': round(total * 1000, 3),
+                 'max_ms': round(maximum * 1000, 3), 'matches': matches}
+                for reason, field, calls, total, maximum, matches in RuleStats.most_expensive(count, interval)]
+
+
+# noinspection PyClassHasNoInit
+class RegexQuarantine:
+    """
+    Blacklist entries, or the patterns of rules without blacklists, which ran past their time budget on a post.
+    They're left out of the rules until someone reviews them and releases them with !!/unquarantine.
+    """
+    # (reason, entry) -> link to the post it timed out on
+    entries = OrderedDict()
+    version = 0
+    lock = threading.Lock()
+    # Called after each entry is added or released, to store the quarantine across restarts; set by load_files
+    on_change = None
+
+    @staticmethod
+    def contains(reason, entry):
+        return (reason, entry) in RegexQuarantine.entries
+
+    @staticmethod
+    def add(reason, entry, post_url):
+        RegexQuarantine.lock.acquire()
+        try:
+            if (reason, entry) in RegexQuarantine.entries:
+                return
+            RegexQuarantine.entries[(reason, entry)] = post_url
+            RegexQuarantine.version += 1
+        finally:
+            RegexQuarantine.lock.release()
+        if RegexQuarantine.on_change is not None:
+            RegexQuarantine.on_change()
+
+        log('warning', 'Quarantined {} ({}) after it ran past its time budget on {}'.format(entry, reason, post_url))
+        if GlobalVars.charcoal_hq is not None:
+            GlobalVars.charcoal_hq.send_message(
+                "Quarantined {} after it ran past its time budget on {}. It won't be checked until it's "
+                "reviewed and released with !!/unquarantine.".format(RegexQuarantine.describe(reason, entry), post_url))
+
+    @staticmethod
+    def release(entry):
+        """
+        Releases the given quarantined entry, or everything quarantined from the rules with the given reason.
+
+        :return: How many were released
+        """
+        RegexQuarantine.lock.acquire()
+        try:
+            released = [key for key in RegexQuarantine.entries if entry in key]
+            for key in released:
+                del RegexQuarantine.entries[key]
+            if released:
+                RegexQuarantine.version += 1
+        finally:
+            RegexQuarantine.lock.release()
+        if released and RegexQuarantine.on_change is not None:
+            RegexQuarantine.on_change()
+        return len(released)
+
+    @staticmethod
+    def replace(entries):
+        """
+        Makes the given (reason, entry, post_url) list the quarantine, which is how scan workers follow the main
+        process's.
+        """
+        RegexQuarantine.lock.acquire()
+        try:
+            RegexQuarantine.entries = OrderedDict(((reason, entry), post_url) for reason, entry, post_url in entries)
+            RegexQuarantine.version += 1
+        finally:
+            RegexQuarantine.lock.release()
+
+    @staticmethod
+    def describe(reason, entry):
+        # Patterns of whole rules can be thousands of characters long
+        if len(entry) > 100:
+            entry = entry[:100] + "..."
+        return "`{}` from \"{}\"".format(entry, reason)
+
+    @staticmethod
+    def list_entries():
+        RegexQuarantine.lock.acquire()
+        try:
+            return [(reason, entry, post_url) for (reason, entry), post_url in RegexQuarantine.entries.items()]
+        finally:
+            RegexQuarantine.lock.release()
+
+
 # noinspection PyClassHasNoInit
 class FindSpam:
     bad_keywords_nwb = [  # "nwb" == "no word boundary"
@@ -691,14 +1505,21 @@ class FindSpam:
     ]
     rules = [
         # Sites in sites[] will be excluded if 'all' == True.  Whitelisted if 'all' == False.
+        # Rules built from the blacklist files use a callable 'regex', so that the pattern
+        # is rebuilt from the current blacklists whenever the rule set is compiled.
+        # Rules which name their lists in 'blacklists' get 'regex' called with the alternation of
+        # each list, and only the entries passing a literal prefilter are run against a post.
+        # With 'index_domains', plain domains in the first list that the prefilter finds in a text
+        # are taken as matches without running the regex.
         #
         # Category: Bad keywords
         # The big list of bad keywords, for titles and posts
-        {'regex': r"(?is)\b({})\b|{}".format("|".join(GlobalVars.bad_keywords), "|".join(bad_keywords_nwb)),
+        {'regex': r"(?is)\b({})\b|{}".format,
+         'blacklists': lambda: [GlobalVars.bad_keywords, FindSpam.bad_keywords_nwb],
          'all': True, 'sites': [], 'reason': "bad keyword in {}", 'title': True, 'body': True, 'username': True,
          'stripcodeblocks': False, 'body_summary': True, 'max_rep': 4, 'max_score': 1},
         # The small list of *potentially* bad keywords, for titles and posts
-        {'regex': r'(?is)\b({})\b'.format('|'.join(GlobalVars.watched_keywords.keys())),
+        {'regex': r'(?is)\b({})\b'.format, 'blacklists': lambda: [GlobalVars.watched_keywords.keys()],
          'reason': 'potentially bad keyword in {}',
          'all': True, 'sites': [], 'title': True, 'body': True, 'username': True,
          'stripcodeblocks': False, 'body_summary': True, 'max_rep': 30, 'max_score': 1},
@@ -823,8 +1644,9 @@ class FindSpam:
         #
         # Category: Suspicious links
         # Blacklisted sites
-        {'regex': u"(?i)({})".format("|".join(GlobalVars.blacklisted_websites)), 'all': True,
-         'sites': [], 'reason': "blacklisted website in {}", 'title': True, 'body': True, 'username': False,
+        {'regex': u"(?i)({})".format, 'blacklists': lambda: [GlobalVars.blacklisted_websites],
+         'index_domains': True, 'all': True, 'sites': [], 'reason': "blacklisted website in {}",
+         'title': True, 'body': True, 'username': False,
          'stripcodeblocks': False, 'body_summary': True, 'max_rep': 50, 'max_score': 5},
         # Suspicious sites
         {'regex': r"(?i)({}|({})[\w-]*?\.(co|net|org|in(\W|fo)|us|blogspot|wordpress))(?![^>]*<)".format(
@@ -1070,7 +1892,7 @@ class FindSpam:
         #
         # Category: other
         # Blacklisted usernames
-        {'regex': r"(?i)({})".format("|".join(GlobalVars.blacklisted_usernames)), 'all': True, 'sites': [],
+        {'regex': lambda: r"(?i)({})".format("|".join(GlobalVars.blacklisted_usernames)), 'all': True, 'sites': [],
          'reason': "blacklisted username", 'title': False, 'body': False, 'username': True, 'stripcodeblocks': False,
          'body_summary': False, 'max_rep': 1, 'max_score': 0},
         {'regex': u"(?i)^jeff$", 'all': False, 'sites': ["parenting.stackexchange.com"],
@@ -1095,99 +1917,218 @@ class FindSpam:
          'max_rep': 20, 'max_score': 0},
     ]
 
+    rule_set = None
+    rule_set_lock = threading.Lock()
+
+    @staticmethod
+    def get_rule_set():
+        """
+        Returns the compiled rule set, recompiling it if the blacklists were reloaded or the quarantine changed
+        since it was built.
+        """
+        rule_set = FindSpam.rule_set
+        if rule_set is None or rule_set.is_stale():
+            FindSpam.rule_set_lock.acquire()
+            try:
+                rule_set = FindSpam.rule_set
+                if rule_set is None or rule_set.is_stale():
+                    rule_set = RuleSet(FindSpam.rules, FindSpam.city_list, GlobalVars.blacklists_version,
+                                       RegexQuarantine.version)
+                    FindSpam.rule_set = rule_set
+            finally:
+                FindSpam.rule_set_lock.release()
+        return rule_set
+
     @staticmethod
     def test_post(post):
+        return FindSpam.test_posts([post])[0]
+
+    @staticmethod
+    def test_posts(posts, executor=None, chunk_size=TEST_POSTS_CHUNK_SIZE):
+        """
+        Scans a batch of posts. With an executor (a concurrent.futures pool), the batch is split into chunks of
+        chunk_size posts which are scanned on its workers.
+
+        :return: The sorted reasons and the why string of each post, in order
+        """
+        if executor is None:
+            return [(result, FindSpam.explain(why)) for result, why in FindSpam.scan_posts(posts)]
+        futures = [executor.submit(FindSpam.test_posts, posts[start:start + chunk_size])
+                   for start in range(0, len(posts), chunk_size)]
+        return [result for future in futures for result in future.result()]
+
+    @staticmethod
+    def scan_post(post, first_reason_only=False):
+        """
+        Runs the rules against a post without building the why string yet, which is only needed if the post
+        ends up being reported. With first_reason_only, the scan stops at the first rule that matches.
+
+        :return: The sorted reasons, and the explanations for each field to pass to FindSpam.explain
+        """
+        return FindSpam.scan_posts([post], [first_reason_only])[0]
+
+    @staticmethod
+    def scan_posts(posts, first_reason_only=None):
+        """
+        scan_post for a batch of posts. The rule set is looked up once for the batch, and each rule's literal
+        prefilter runs over all the texts of the batch that the rule checks together.
+
+        :param first_reason_only: For each post, whether its scan can stop at the first rule that matches
+        :return: What scan_post returns for each post, in order
+        """
+        rule_set = FindSpam.get_rule_set()
+        targets = [rule_set.rules_for_post(post) for post in posts]
+        body_views = [BodyViews(post.body) for post in posts]
+
+        # rule -> the texts it checks, without duplicates
+        texts_by_rule = OrderedDict()
+        for post, post_targets, views in zip(posts, targets, body_views):
+            for rule, check_title, check_body, check_username in post_targets:
+                if rule.prefilter is None:
+                    continue
+                texts = texts_by_rule.setdefault(rule, OrderedDict())
+                if check_title:
+                    texts[post.title] = None
+                if check_username:
+                    texts[post.user_name] = None
+                if check_body:
+                    texts[views.get(rule.body_view)] = None
+        batch_candidates = {rule: dict(zip(texts, rule.prefilter.candidates_of_texts(list(texts))))
+                            for rule, texts in texts_by_rule.items()}
+
+        if first_reason_only is None:
+            first_reason_only = [False] * len(posts)
+        return [FindSpam.scan_prepared_post(post, post_targets, views, batch_candidates, stop_early)
+                for post, post_targets, views, stop_early in zip(posts, targets, body_views, first_reason_only)]
+
+    @staticmethod
+    def scan_prepared_post(post, targets, body_views, batch_candidates, first_reason_only):
+        """
+        Scans one post of a scan_posts batch against the rules that apply to it.
+        """
         result = []
         why = {'title': [], 'body': [], 'username': []}
-        for rule in FindSpam.rules:
-            body_to_check = post.body
-            is_regex_check = 'regex' in rule
-            try:
-                check_if_answer = rule['answers']
-            except KeyError:
-                check_if_answer = True
-            try:
-                check_if_question = rule['questions']
-            except KeyError:
-                check_if_question = True
-            body_to_check = regex.sub("[\xad\u200b\u200c]", "", body_to_check)
-            if rule['stripcodeblocks']:
-                # use a placeholder to avoid triggering "few unique characters" when most of post is code
-                body_to_check = regex.sub("(?s)<pre>.*?</pre>",
-                                          u"<pre><code>placeholder for omitted code/код block</pre></code>",
-                                          body_to_check)
-                body_to_check = regex.sub("(?s)<code>.*?</code>",
-                                          u"<pre><code>placeholder for omitted code/код block</pre></code>",
-                                          body_to_check)
-            if rule['reason'] == 'Phone number detected in {}':
-                body_to_check = regex.sub("<img[^>]+>", "", body_to_check)
-                body_to_check = regex.sub("<a[^>]+>", "", body_to_check)
-            if rule['all'] != (post.post_site in rule['sites']) and post.owner_rep <= rule['max_rep'] and \
-                    post.post_score <= rule['max_score']:
-                matched_body = None
-                compiled_regex = None
-                if is_regex_check:
-                    compiled_regex = regex.compile(rule['regex'], regex.UNICODE, city=FindSpam.city_list)
-                    # using a named list \L in some regexes
-                    matched_title = compiled_regex.findall(post.title)
-                    matched_username = compiled_regex.findall(post.user_name)
-                    if (not post.body_is_summary or rule['body_summary']) and \
-                            (not post.is_answer or check_if_answer) and \
-                            (post.is_answer or check_if_question):
-                        matched_body = compiled_regex.findall(body_to_check)
-                else:
-                    assert 'method' in rule
-
-                    if 'whole_post' in rule and rule['whole_post']:
-                        matched_title, matched_username, matched_body, why_post = rule['method'](post)
-
-                        if matched_title:
-                            why["title"].append(u"Title - {}".format(why_post))
-                            result.append(rule['reason'].replace("{}", "title"))
-                        elif matched_username:
-                            why["username"].append(u"Username - {}".format(why_post))
-                            result.append(rule['reason'].replace("{}", "username"))
-                        elif matched_body:
-                            why["body"].append(u"Post - {}".format(why_post))
-                            result.append(rule['reason'].replace("{}", "body"))
-                    else:
-                        matched_title, why_title = rule['method'](post.title, post.post_site, post.user_name)
-                        if matched_title and rule['title']:
-                            why["title"].append(u"Title - {}".format(why_title))
-                        matched_username, why_username = rule['method'](post.user_name, post.post_site, post.user_name)
-                        if matched_username and rule['username']:
-                            why["username"].append(u"Username - {}".format(why_username))
-                        if (not post.body_is_summary or rule['body_summary']) and \
-                                (not post.is_answer or check_if_answer) and \
-                                (post.is_answer or check_if_question):
-                            matched_body, why_body = rule['method'](body_to_check, post.post_site, post.user_name)
-                            if matched_body and rule['body']:
-                                why["body"].append(u"Post - {}".format(why_body))
-                if matched_title and rule['title']:
-                    why["title"].append(FindSpam.generate_why(compiled_regex, post.title, u"Title", is_regex_check))
-                    result.append(rule['reason'].replace("{}", "title"))
-                if matched_username and rule['username']:
-                    why["username"].append(FindSpam.generate_why(compiled_regex, post.user_name, u"Username",
-                                                                 is_regex_check))
-                    result.append(rule['reason'].replace("{}", "username"))
-                if matched_body and rule['body']:
-                    why["body"].append(FindSpam.generate_why(compiled_regex, body_to_check, u"Body", is_regex_check))
-                    type_of_post = "answer" if post.is_answer else "body"
-                    result.append(rule['reason'].replace("{}", type_of_post))
+        timings = []
+        for rule, check_title, check_body, check_username in targets:
+            matched_title, matched_username, matched_body = None, None, None
+            if rule.whole_post:
+                start = time.perf_counter()
+                matched_title, matched_username, matched_body, why_post = rule.method(post)
+                timings.append((rule.reason, 'post', time.perf_counter() - start,
+                                matched_title or matched_username or matched_body))
+
+                if matched_title:
+                    why["title"].append(u"Title - {}".format(why_post))
+                    result.append(rule.reason.replace("{}", "title"))
+                elif matched_username:
+                    why["username"].append(u"Username - {}".format(why_post))
+                    result.append(rule.reason.replace("{}", "username"))
+                elif matched_body:
+                    why["body"].append(u"Post - {}".format(why_post))
+                    result.append(rule.reason.replace("{}", "body"))
+            elif rule.is_regex_check:
+                if check_title:
+                    start = time.perf_counter()
+                    matched_title = FindSpam.find_in_time(rule, post.title, u"Title", post, batch_candidates)
+                    timings.append((rule.reason, 'title', time.perf_counter() - start, matched_title))
+                if check_username:
+                    start = time.perf_counter()
+                    matched_username = FindSpam.find_in_time(rule, post.user_name, u"Username", post,
+                                                             batch_candidates)
+                    timings.append((rule.reason, 'username', time.perf_counter() - start, matched_username))
+                if check_body:
+                    body_to_check = body_views.get(rule.body_view)
+                    start = time.perf_counter()
+                    matched_body = FindSpam.find_in_time(rule, body_to_check, u"Body", post, batch_candidates)
+                    timings.append((rule.reason, 'body', time.perf_counter() - start, matched_body))
+            else:
+                if check_title:
+                    start = time.perf_counter()
+                    matched_title, why_title = rule.method(post.title, post.post_site, post.user_name)
+                    timings.append((rule.reason, 'title', time.perf_counter() - start, matched_title))
+                    if matched_title:
+                        why["title"].append(u"Title - {}".format(why_title))
+                if check_username:
+                    start = time.perf_counter()
+                    matched_username, why_username = rule.method(post.user_name, post.post_site, post.user_name)
+                    timings.append((rule.reason, 'username', time.perf_counter() - start, matched_username))
+                    if matched_username:
+                        why["username"].append(u"Username - {}".format(why_username))
+                if check_body:
+                    body_to_check = body_views.get(rule.body_view)
+                    start = time.perf_counter()
+                    matched_body, why_body = rule.method(body_to_check, post.post_site, post.user_name)
+                    timings.append((rule.reason, 'body', time.perf_counter() - start, matched_body))
+                    if matched_body:
+                        why["body"].append(u"Post - {}".format(why_body))
+            if matched_title and rule.title:
+                if rule.is_regex_check:
+                    why["title"].append(matched_title)
+                result.append(rule.reason.replace("{}", "title"))
+            if matched_username and rule.username:
+                if rule.is_regex_check:
+                    why["username"].append(matched_username)
+                result.append(rule.reason.replace("{}", "username"))
+            if matched_body and rule.body:
+                if rule.is_regex_check:
+                    why["body"].append(matched_body)
+                type_of_post = "answer" if post.is_answer else "body"
+                result.append(rule.reason.replace("{}", type_of_post))
+            if first_reason_only and result:
+                break
+        RuleStats.record(timings)
         result = list(set(result))
         result.sort()
-        why = "\n".join(chain(filter(None, why["title"]), filter(None, why["body"]),
-                              filter(None, why["username"]))).strip()
         return result, why
 
     @staticmethod
-    def generate_why(compiled_regex, matched_text, type_of_text, is_regex_check):
-        if is_regex_check:
-            matches = compiled_regex.finditer(matched_text)
-            why_for_matches = []
-            for match in matches:
-                span = match.span()
-                group = match.group()
-                why_for_matches.append(u"Position {}-{}: {}".format(span[0] + 1, span[1] + 1, group))
-            return type_of_text + u" - " + ", ".join(why_for_matches)
-        return ""
+    def find_in_time(rule, text, type_of_text, post, batch_candidates=None):
+        """
+        Rule.find, except that if the rule's regex runs past its time budget, the entries to blame are quarantined
+        and the rule is taken not to match.
+
+        :param batch_candidates: The prefilter candidates worked out by scan_posts, by rule
+        """
+        try:
+            return rule.find(text, type_of_text, (batch_candidates or {}).get(rule))
+        except TimeoutError:
+            slow_entries = rule.slow_entries(text)
+            if not slow_entries:
+                log('warning', 'Rule "{}" timed out on {}, but {}'.format(
+                    rule.reason, post.post_url,
+                    "none of its entries did alone" if rule.prefilter is not None else "not when run again"))
+            for entry in slow_entries:
+                RegexQuarantine.add(rule.reason, entry, post.post_url)
+            return None
+
+    @staticmethod
+    def explain(why):
+        """
+        Builds the why string from scan_post's explanations, running the rest of any regex matching it needs.
+        """
+        why = {field: [item if isinstance(item, str) else item.explain() for item in items]
+               for field, items in why.items()}
+        return "\n".join(chain(filter(None, why["title"]), filter(None, why["body"]),
+                               filter(None, why["username"]))).strip()
+
+    @staticmethod
+    def generate_why(matches, type_of_text):
+        why_for_matches = []
+        for match in matches:
+            span = match.span()
+            group = match.group()
+            why_for_matches.append(u"Position {}-{}: {}".format(span[0] + 1, span[1] + 1, group))
+        return type_of_text + u" - " + ", ".join(why_for_matches)
+
+
+LINK_TEXT_KEYWORDS_RE = regex.compile(
+    r"(?isu)"
+    r"\b(buy|cheap) |live[ -]?stream|"
+    r"\bmake (money|\$)|"
+    r"\b(porno?|(whole)?sale|coins|replica|luxury|essays?|in \L<city>)\b"
+    r"\b\L<city>(?:\b.{1.20}\b)?(service|escort|call girls?)|"
+    r"(best|make|full|hd|software|cell|data)[\w ]{1,20}(online|service|company|repair|recovery)|"
+    r"\b(writing service|essay (writing|tips))", city=FindSpam.city_list)
+
+
+FindSpam.get_rule_set()
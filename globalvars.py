@@ -52,6 +52,9 @@ class GlobalVars:
     blacklisted_websites = []
     bad_keywords = []
     watched_keywords = {}
+    # How build_trie_regex shrank each list-backed blacklist
+    blacklist_pattern_stats = {}
+    blacklists_version = 0
     ignored_posts = []
     auto_ignored_posts = []
     startup_utc = datetime.utcnow().strftime("%H:%M:%S")
@@ -401,8 +404,19 @@ class GlobalVars:
 
     num_posts_scanned = 0
     post_scan_time = 0
+    # Posts which were already reported, ignored or marked as false positives, so weren't scanned again
+    num_scans_avoided = 0
     posts_scan_stats_lock = threading.Lock()
 
+    # The ScanPool scanning posts in worker processes, if scan_workers is set
+    scan_pool = None
+    # The IngestionPool handling the posts from the websocket
+    ingestion_pool = None
+
+    prefilter_checks = 0
+    prefilter_rejections = 0
+    prefilter_stats_lock = threading.Lock()
+
     config = RawConfigParser()
 
     if os.path.isfile('config'):
@@ -444,6 +458,29 @@ class GlobalVars:
         metasmoke_ws_host = ""
         log('info', "No metasmoke websocket host found, which is okay if you're anti-websocket")
 
+    try:
+        # Posts by blacklisted users are reported anyway, so optionally stop scanning them at the first reason
+        blacklisted_user_first_reason_only = config.getboolean("Config", "blacklisted_user_first_reason_only")
+    except NoOptionError:
+        blacklisted_user_first_reason_only = False
+
+    try:
+        # How many worker processes to scan posts on; 0 scans them in this process
+        scan_workers = config.getint("Config", "scan_workers")
+    except NoOptionError:
+        scan_workers = 0
+
+    try:
+        # How many threads handle the posts from the websocket, and how many posts can wait for them
+        ingestion_workers = config.getint("Config", "ingestion_workers")
+    except NoOptionError:
+        ingestion_workers = 4
+
+    try:
+        ingestion_queue_size = config.getint("Config", "ingestion_queue_size")
+    except NoOptionError:
+        ingestion_queue_size = 1000
+
     try:
         github_username = config.get("Config", "github_username")
         github_password = config.get("Config", "github_password")
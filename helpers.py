@@ -1,8 +1,9 @@
 # coding=utf-8
 import os
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 from datetime import datetime
 from termcolor import colored
+import threading
 
 Response = namedtuple('Response', 'command_status message')
 
@@ -21,6 +22,59 @@ def all_matches_unique(match):
     return len(match[0][1::2]) == len(set(match[0][1::2]))
 
 
+class LRUCache:
+    """
+    A bounded, thread-safe memo which evicts the least recently used keys, and counts its hits and misses.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, key, compute):
+        self.lock.acquire()
+        try:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            self.misses += 1
+        finally:
+            self.lock.release()
+
+        # Computed outside the lock, so two threads may occasionally both compute the same key
+        value = compute()
+        self.lock.acquire()
+        self.entries[key] = value
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        self.lock.release()
+        return value
+
+    def take_counts(self):
+        """
+        :return: The hits and misses since the last call, starting the counts over
+        """
+        self.lock.acquire()
+        counts = (self.hits, self.misses)
+        self.hits = 0
+        self.misses = 0
+        self.lock.release()
+        return counts
+
+    def add_counts(self, hits, misses):
+        self.lock.acquire()
+        self.hits += hits
+        self.misses += misses
+        self.lock.release()
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0
+
+
 # noinspection PyMissingTypeHints
 def log(log_level, *args):
     colors = {
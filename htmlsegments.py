@@ -0,0 +1,68 @@
+# coding=utf-8
+# noinspection PyCompatibility
+import regex
+from collections import namedtuple
+
+
+# A piece of a post body, with its offsets into the body.
+#   kind: 'text', 'code' (a <pre> or <code> block, with the tags around it), 'anchor' (an opening <a> tag),
+#         'image' (an <img> tag) or 'tag' (any other tag, opening or closing)
+#   tag: the HTML of the (opening) tag, or None for text
+#   text: the text for text segments, the HTML inside a code block, or the HTML inside an anchor up to its </a>
+#   attributes: the attributes of the tag, as a dict
+#   quote_depth: how many blockquotes the segment is in
+Segment = namedtuple("Segment", ["kind", "start", "end", "tag", "text", "attributes", "quote_depth"])
+
+# Like the regexes which strip tags, a tag runs to the first >
+TAG_RE = regex.compile(r"<(/?)([A-Za-z][A-Za-z0-9]*)([^<>]*)>")
+ATTRIBUTE_RE = regex.compile(r"""([A-Za-z-]+)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))""")
+# Tags whose content is code up to their closing tag
+CODE_TAGS = {"pre": "</pre>", "code": "</code>"}
+
+
+def parse_attributes(tag_html):
+    return {match.group(1).lower(): next(value for value in match.groups()[1:] if value is not None)
+            for match in ATTRIBUTE_RE.finditer(tag_html)}
+
+
+def segment_body(body):
+    """
+    Splits a post body into segments in one pass over it. Code blocks are single segments, so nothing inside them
+    is taken for a tag.
+    """
+    segments = []
+    quote_depth = 0
+    position = 0
+    length = len(body)
+    while position < length:
+        match = TAG_RE.search(body, position)
+        if match is None:
+            segments.append(Segment("text", position, length, None, body[position:], {}, quote_depth))
+            break
+        start, end = match.span()
+        if start > position:
+            segments.append(Segment("text", position, start, None, body[position:start], {}, quote_depth))
+
+        is_closing, name, tag_html = match.group(1), match.group(2).lower(), match.group(0)
+        if not is_closing and name in CODE_TAGS:
+            close = body.find(CODE_TAGS[name], end)
+            if close != -1:
+                block_end = close + len(CODE_TAGS[name])
+                segments.append(Segment("code", start, block_end, tag_html, body[end:close],
+                                        parse_attributes(match.group(3)), quote_depth))
+                position = block_end
+                continue
+
+        if not is_closing and name == "a":
+            close = body.find("</a>", end)
+            segments.append(Segment("anchor", start, end, tag_html, body[end:close] if close != -1 else None,
+                                    parse_attributes(match.group(3)), quote_depth))
+        elif not is_closing and name == "img":
+            segments.append(Segment("image", start, end, tag_html, None, parse_attributes(match.group(3)),
+                                    quote_depth))
+        else:
+            if name == "blockquote":
+                quote_depth = max(quote_depth - 1, 0) if is_closing else quote_depth + 1
+            segments.append(Segment("tag", start, end, tag_html, None, {}, quote_depth))
+        position = end
+    return segments
@@ -0,0 +1,112 @@
+# coding=utf-8
+from collections import deque
+import threading
+
+from helpers import log
+
+
+class IngestionPool:
+    """
+    Hands websocket events to a fixed number of worker threads through a bounded queue, so that the thread receiving
+    them only has to put them in the queue.
+
+    Backpressure: an event whose key matches one still waiting replaces it, since only the latest is worth
+    handling (coalesced). When the queue is full, the oldest waiting event is dropped to make room (dropped), and
+    set aside for the workers to pass to overflow_handler instead, which should only do the cheapest part of the
+    handling; they get to those before any waiting events. At most max_waiting events are set aside, beyond which
+    the oldest are lost altogether. A warning is logged when events start being dropped, and again once the queue
+    has caught up.
+    """
+    def __init__(self, name, handler, workers=4, max_waiting=1000, overflow_handler=None):
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.max_waiting = max_waiting
+        self.overflow_handler = overflow_handler
+        # keys of the waiting events, oldest first, and the events by key
+        self.order = deque()
+        self.waiting = {}
+        # dropped events, oldest first, for overflow_handler
+        self.overflow = deque(maxlen=max_waiting)
+        self.condition = threading.Condition()
+
+        self.handled = 0
+        self.coalesced = 0
+        self.dropped = 0
+        # Whether events have been dropped since the queue was last down to half full
+        self.dropping = False
+
+    def start(self):
+        for index in range(self.workers):
+            threading.Thread(name="{} {}".format(self.name, index + 1), target=self.run, daemon=True).start()
+
+    def put(self, key, event):
+        started_dropping = False
+        self.condition.acquire()
+        try:
+            if key in self.waiting:
+                self.waiting[key] = event
+                self.coalesced += 1
+                return
+            if len(self.order) >= self.max_waiting:
+                dropped = self.waiting.pop(self.order.popleft())
+                if self.overflow_handler is not None:
+                    self.overflow.append(dropped)
+                self.dropped += 1
+                started_dropping = not self.dropping
+                self.dropping = True
+            self.order.append(key)
+            self.waiting[key] = event
+            self.condition.notify()
+        finally:
+            self.condition.release()
+
+        if started_dropping:
+            log('warning', "{} has {} events waiting, so it's dropping the oldest".format(self.name,
+                                                                                          self.max_waiting))
+
+    def take(self):
+        """
+        :return: The next event and whether it's one to pass to overflow_handler
+        """
+        caught_up = False
+        self.condition.acquire()
+        try:
+            while not self.order and not self.overflow:
+                self.condition.wait()
+            if self.overflow:
+                return self.overflow.popleft(), True
+            if self.dropping and len(self.order) <= self.max_waiting // 2:
+                self.dropping = False
+                caught_up = True
+            return self.waiting.pop(self.order.popleft()), False
+        finally:
+            self.condition.release()
+            if caught_up:
+                log('warning', "{} has caught up, and stopped dropping events".format(self.name))
+
+    # noinspection PyBroadException
+    def run(self):
+        while True:
+            event, overflowed = self.take()
+            if overflowed:
+                try:
+                    self.overflow_handler(event)
+                except Exception as e:
+                    log('error', "Exception in {} overflow:".format(self.name), e)
+                continue
+            try:
+                self.handler(event)
+            except Exception as e:
+                log('error', "Exception in {}:".format(self.name), e)
+            self.condition.acquire()
+            self.handled += 1
+            self.condition.release()
+
+    def stats(self):
+        self.condition.acquire()
+        try:
+            return {'waiting': len(self.order), 'handled': self.handled, 'coalesced': self.coalesced,
+                    'dropped': self.dropped}
+        finally:
+            self.condition.release()
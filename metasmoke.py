@@ -17,6 +17,7 @@ import parsing
 import apigetpost
 import spamhandling
 import classes
+from findspam import RuleStats
 from helpers import log, only_blacklists_changed
 from gitmanager import GitManager
 from blacklists import load_blacklists
@@ -351,10 +352,15 @@ class Metasmoke:
             payload = {'key': GlobalVars.metasmoke_key,
                        'statistic': {'posts_scanned': GlobalVars.num_posts_scanned, 'api_quota': GlobalVars.apiquota}}
 
+        payload['statistic']['scans_avoided'] = GlobalVars.num_scans_avoided
+
         GlobalVars.post_scan_time = 0
         GlobalVars.num_posts_scanned = 0
+        GlobalVars.num_scans_avoided = 0
         GlobalVars.posts_scan_stats_lock.release()
 
+        payload['statistic']['rule_stats'] = RuleStats.take_interval_summary()
+
         headers = {'Content-type': 'application/json'}
 
         requests.post(GlobalVars.metasmoke_host + "/statistics.json",
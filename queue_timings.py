@@ -1,14 +1,19 @@
 # coding=utf-8
 # queue_timings.py
 # Analysis script for bodyfetcher queue timings. Call from the command line using Python 3.
+# Pass BodyFetcher.max_queue_age (plus some slack) to count the posts which waited for longer than that:
+#
+#   python3 queue_timings.py 65
 
 import os.path
 # noinspection PyPep8Naming
 import pickle
 import math
+import sys
 
 
 def main():
+    bound = float(sys.argv[1]) if len(sys.argv) > 1 else None
     if os.path.isfile("bodyfetcherQueueTimings.p"):
         try:
             with open("bodyfetcherQueueTimings.p", "rb") as f:
@@ -19,7 +24,8 @@ def main():
             if resp == "y":
                 os.remove("bodyfetcherQueueTimings.p")
 
-        print("SITE,MIN,MAX,AVG,Q1,MEDIAN,Q3,STDDEV,COUNT,98P_MIN,98P_MAX")
+        print("SITE,MIN,MAX,AVG,Q1,MEDIAN,Q3,STDDEV,COUNT,98P_MIN,98P_MAX" + (",OVER_BOUND" if bound else ""))
+        total_over_bound = 0
         # noinspection PyUnboundLocalVariable
         for site, times in queue_data.items():
             sorted_times = sorted(times)
@@ -34,9 +40,16 @@ def main():
             min98 = max(mean - 2 * stddev, min(times))
             max98 = min(mean + 2 * stddev, max(times))
 
-            print("{0},{1},{2},{3},{4},{5},{6},{7},{8},{9},{10}"
-                  .format(site.split(".")[0], min(times), max(times), mean, q1, median,
-                          q3, stddev, len(times), min98, max98))
+            row = "{0},{1},{2},{3},{4},{5},{6},{7},{8},{9},{10}".format(
+                site.split(".")[0], min(times), max(times), mean, q1, median, q3, stddev, len(times), min98, max98)
+            if bound:
+                over_bound = sum(1 for x in times if x > bound)
+                total_over_bound += over_bound
+                row += ",{0}".format(over_bound)
+            print(row)
+
+        if bound:
+            print("{0} posts waited for longer than {1}s.".format(total_over_bound, bound))
 
     else:
         print("bodyfetcherQueueTimings.p doesn't exist. No data to analyse.")
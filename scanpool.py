@@ -0,0 +1,337 @@
+# coding=utf-8
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+from blacklists import load_blacklists
+from classes import Post
+from findspam import (FindSpam, RegexQuarantine, RuleStats, NS_RESOLVER, DOMAIN_CACHE, POST_LINKS_CACHE,
+                      SIMILARITY_CACHE)
+from globalvars import GlobalVars
+from helpers import log
+
+
+# How many posts are sent to a worker at a time
+SCAN_POOL_CHUNK_SIZE = 10
+# Seconds a worker may spend on one chunk, after which it's replaced and the chunk is sent to its replacement
+SCAN_POOL_TIMEOUT = 60
+# Seconds a batch is waited for at most, however busy the workers are, after which the posts left are given up on
+SCAN_POOL_DEADLINE = 3 * SCAN_POOL_TIMEOUT
+
+# The caches whose hits and misses are counted, in the order their counts are sent back from the workers
+COUNTED_CACHES = (DOMAIN_CACHE, POST_LINKS_CACHE, SIMILARITY_CACHE)
+
+# What the rules look at of a post, which is all that's sent to the workers.
+#   parent: for an answer, its question's id and the (id, body) of the question's answers
+PostRecord = namedtuple("PostRecord", ["title", "body", "user_name", "user_url", "post_site", "post_id", "post_url",
+                                       "is_answer", "body_is_summary", "owner_rep", "post_score", "parent"])
+
+
+def post_record(post):
+    parent = None
+    if post.parent is not None:
+        parent = (post.parent.post_id, tuple((answer.post_id, answer.body) for answer in post.parent.answers or []))
+    return PostRecord(post.title, post.body, post.user_name, post.user_url, post.post_site, post.post_id,
+                      post.post_url, post.is_answer, post.body_is_summary, post.owner_rep, post.post_score, parent)
+
+
+def post_from_record(record):
+    # An empty API response leaves the Post blank, rather than unescaping the fields a second time
+    post = Post(api_response={})
+    for field, value in zip(PostRecord._fields, record):
+        if field != "parent":
+            post["_" + field] = value
+    if record.parent is not None:
+        question_id, answers = record.parent
+        question = Post(api_response={})
+        question["_post_id"] = question_id
+        question["_answers"] = []
+        for answer_id, body in answers:
+            answer = Post(api_response={})
+            answer["_post_id"] = answer_id
+            answer["_body"] = body
+            question["_answers"].append(answer)
+        post["_parent"] = question
+    return post
+
+
+def take_scan_counters():
+    """
+    Takes the rule statistics, prefilter counts, NS lookup counters and cache hit counts added up by the scans since
+    the last call, starting them over. The workers send theirs back with each chunk.
+    """
+    GlobalVars.prefilter_stats_lock.acquire()
+    prefilter = (GlobalVars.prefilter_checks, GlobalVars.prefilter_rejections)
+    GlobalVars.prefilter_checks = 0
+    GlobalVars.prefilter_rejections = 0
+    GlobalVars.prefilter_stats_lock.release()
+    return {'rules': RuleStats.take_totals(), 'prefilter': prefilter, 'nameservers': NS_RESOLVER.take_counters(),
+            'caches': [cache.take_counts() for cache in COUNTED_CACHES]}
+
+
+def merge_scan_counters(counters):
+    RuleStats.merge(counters['rules'])
+    checks, rejections = counters['prefilter']
+    GlobalVars.prefilter_stats_lock.acquire()
+    GlobalVars.prefilter_checks += checks
+    GlobalVars.prefilter_rejections += rejections
+    GlobalVars.prefilter_stats_lock.release()
+    NS_RESOLVER.add_counters(counters['nameservers'])
+    for cache, (hits, misses) in zip(COUNTED_CACHES, counters['caches']):
+        cache.add_counts(hits, misses)
+
+
+# Workers are forked from a server process that has only imported this module, not from the main process: once
+# that's running threads, a copy of it would have the locks other threads held, and thread pools like NS_RESOLVER's
+# without any of their threads.
+WORKER_CONTEXT = multiprocessing.get_context("forkserver")
+WORKER_CONTEXT.set_forkserver_preload(["scanpool"])
+
+# A worker's pool of one process, and the token of the chunk its process is scanning (0 if none) and since when
+WorkerPool = namedtuple("WorkerPool", ["pool", "running", "since"])
+
+# The versions of the main process's blacklists and quarantine that this worker process last took over, and the
+# worker's running and since values
+worker_state = {'blacklists_version': None, 'quarantine_version': None, 'running': None, 'since': None}
+
+
+def init_worker(blacklists_version, running, since):
+    worker_state['running'] = running
+    worker_state['since'] = since
+    # The main process reports and stores what the workers quarantine, since they aren't in chat
+    GlobalVars.charcoal_hq = None
+    RegexQuarantine.on_change = None
+    # The server process loaded the blacklists when it started, which may be before the main process last did
+    load_blacklists()
+    worker_state['blacklists_version'] = blacklists_version
+    FindSpam.get_rule_set()
+    take_scan_counters()
+
+
+def scan_in_worker(blacklists_version, quarantine_version, quarantined, records, first_reason_only):
+    """
+    Runs in a worker process. Catches up with the main process's blacklists and quarantine, then scans the posts.
+
+    :return: The worker's pid, the seconds it spent scanning, what FindSpam.scan_posts returned for the posts with
+             the explanations of reported posts as strings, what it quarantined while scanning them, and the
+             counters the scans added up
+    """
+    start = time.perf_counter()
+    if blacklists_version != worker_state['blacklists_version']:
+        load_blacklists()
+        worker_state['blacklists_version'] = blacklists_version
+    if quarantine_version != worker_state['quarantine_version']:
+        RegexQuarantine.replace(quarantined)
+        worker_state['quarantine_version'] = quarantine_version
+    known = set((reason, entry) for reason, entry, _ in quarantined)
+
+    results = []
+    for result, why in FindSpam.scan_posts([post_from_record(record) for record in records], first_reason_only):
+        # The matches can't be sent back, and only reported posts need their why string
+        why = {field: [item if isinstance(item, str) else item.explain() for item in items] if result else []
+               for field, items in why.items()}
+        results.append((result, why))
+    newly_quarantined = [(reason, entry, post_url) for reason, entry, post_url in RegexQuarantine.list_entries()
+                         if (reason, entry) not in known]
+    return os.getpid(), time.perf_counter() - start, results, newly_quarantined, take_scan_counters()
+
+
+def run_chunk(scan, token, *args):
+    """
+    Runs in a worker process. Lets the main process see which chunk the worker is on and since when, while it
+    scans it.
+    """
+    worker_state['since'].value = time.time()
+    worker_state['running'].value = token
+    try:
+        return scan(*args)
+    finally:
+        worker_state['running'].value = 0
+
+
+class ScanPool:
+    """
+    Scans posts on a pool of worker processes, so that scanning can use more than the one core the GIL allows.
+
+    Each batch sent to the workers carries the versions of the blacklists and the quarantine, so that they reload
+    the blacklists, and follow the quarantine, when the main process's change. The function the workers run is
+    scan_in_worker unless another is passed in, which is how the tests stall a worker.
+
+    Each worker is a pool of one process, and a question and all of its answers are always scanned by the same
+    worker, so that the index of answers seen that similar_answer keeps in each process has all of a question's.
+    A worker that has been on one chunk for longer than SCAN_POOL_TIMEOUT is terminated and replaced, and that
+    chunk gets one more go on the replacement. It isn't scanned in this process instead, since that would hold up
+    the thread waiting for the batch, which is BodyFetcher's. A chunk whose replacement worker gets stuck on it too,
+    or which isn't done by SCAN_POOL_DEADLINE, is given up on, and its posts are counted in fallback_counts.
+    """
+    def __init__(self, workers, chunk_size=SCAN_POOL_CHUNK_SIZE, scan=scan_in_worker):
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.scan = scan
+        self.worker_pools = [self.start_worker() for _ in range(workers)]
+        self.tokens = itertools.count(1)
+        self.started = time.monotonic()
+        # pid -> [seconds spent scanning, posts scanned]
+        self.busy = {}
+        # Chunks sent to a replacement worker, and posts given up on
+        self.retried_chunks = 0
+        self.abandoned_posts = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def start_worker():
+        running = WORKER_CONTEXT.Value('l', 0)
+        since = WORKER_CONTEXT.Value('d', 0.0)
+        return WorkerPool(WORKER_CONTEXT.Pool(1, init_worker, (GlobalVars.blacklists_version, running, since)),
+                          running, since)
+
+    def worker_for(self, post):
+        question_id = post.parent.post_id if post.parent is not None else post.post_id
+        return zlib.crc32("{} {}".format(post.post_site, question_id).encode("utf-8")) % self.workers
+
+    def submit(self, worker, args):
+        """
+        :return: The worker's WorkerPool, the token of the chunk and its AsyncResult
+        """
+        self.lock.acquire()
+        worker_pool = self.worker_pools[worker]
+        token = next(self.tokens)
+        self.lock.release()
+        return worker_pool, token, worker_pool.pool.apply_async(run_chunk, (self.scan, token) + args)
+
+    def scan_posts(self, posts, first_reason_only=None):
+        """
+        FindSpam.scan_posts, run on the workers.
+        """
+        if first_reason_only is None:
+            first_reason_only = [False] * len(posts)
+        records = [post_record(post) for post in posts]
+        # The indices of the posts each worker scans
+        assigned = [[] for _ in range(self.workers)]
+        for index, post in enumerate(posts):
+            assigned[self.worker_for(post)].append(index)
+
+        # The version is read first, so a change while listing the entries is sent again with the next batch
+        quarantine_version = RegexQuarantine.version
+        quarantined = RegexQuarantine.list_entries()
+        chunks = []
+        for worker, indices in enumerate(assigned):
+            for start in range(0, len(indices), self.chunk_size):
+                chunk_indices = indices[start:start + self.chunk_size]
+                args = (GlobalVars.blacklists_version, quarantine_version, quarantined,
+                        [records[index] for index in chunk_indices],
+                        [first_reason_only[index] for index in chunk_indices])
+                chunks.append((worker, chunk_indices, args, self.submit(worker, args)))
+
+        deadline = time.time() + SCAN_POOL_DEADLINE
+        scans = [None] * len(posts)
+        for worker, chunk_indices, args, submitted in chunks:
+            result = self.wait_for(worker, args, deadline, *submitted)
+            if result is None and self.worker_pools[worker] is not submitted[0]:
+                # Its worker got stuck, and has been replaced, so it gets one more go on the new one
+                self.lock.acquire()
+                self.retried_chunks += 1
+                self.lock.release()
+                result = self.wait_for(worker, args, deadline, *self.submit(worker, args))
+            if result is None:
+                log('warning', 'Gave up on scanning these posts, as their scan worker got stuck on them twice or '
+                               'fell behind: {}'.format(", ".join(posts[index].post_url or posts[index].post_id
+                                                                  for index in chunk_indices)))
+                self.lock.acquire()
+                self.abandoned_posts += len(chunk_indices)
+                self.lock.release()
+                for index in chunk_indices:
+                    scans[index] = ([], {"title": [], "body": [], "username": []})
+                continue
+
+            pid, seconds, results, newly_quarantined, counters = result
+            self.lock.acquire()
+            busy = self.busy.setdefault(pid, [0, 0])
+            busy[0] += seconds
+            busy[1] += len(results)
+            self.lock.release()
+            for reason, entry, post_url in newly_quarantined:
+                RegexQuarantine.add(reason, entry, post_url)
+            merge_scan_counters(counters)
+            for index, scan in zip(chunk_indices, results):
+                scans[index] = scan
+        return scans
+
+    def wait_for(self, worker, args, deadline, worker_pool, token, chunk):
+        """
+        Waits for a chunk's result, until the deadline (by time.time()) at most. A worker that has been on one chunk
+        for longer than SCAN_POOL_TIMEOUT is replaced, whether it's this one or one that its own batch has stopped
+        waiting for; a chunk that was waiting behind the one it got stuck on is sent to the new worker.
+
+        A worker that hasn't started a chunk for longer than SCAN_POOL_TIMEOUT while this one waits, such as one
+        whose process never got going, is replaced too.
+
+        :return: The chunk's result, or None if its worker got stuck on it or the deadline passed
+        """
+        waiting_since = time.time()
+        while True:
+            try:
+                return chunk.get(min(SCAN_POOL_TIMEOUT / 10, max(deadline - time.time(), 0)))
+            except multiprocessing.TimeoutError:
+                pass
+            now = time.time()
+            running = worker_pool.running.value
+            if running != 0 and now - worker_pool.since.value > SCAN_POOL_TIMEOUT:
+                self.replace_worker(worker, worker_pool)
+                if running == token:
+                    return None
+            if self.worker_pools[worker] is not worker_pool:
+                worker_pool, token, chunk = self.submit(worker, args)
+                waiting_since = now
+                continue
+            elif running == 0 and now - max(worker_pool.since.value, waiting_since) > SCAN_POOL_TIMEOUT:
+                self.replace_worker(worker, worker_pool)
+                return None
+            if now > deadline:
+                return None
+
+    def replace_worker(self, worker, worker_pool):
+        """
+        Terminates a stuck worker, unless another batch got to it first, and starts a new one in its place.
+        """
+        self.lock.acquire()
+        try:
+            if self.worker_pools[worker] is not worker_pool:
+                return
+            worker_pool.pool.terminate()
+            self.worker_pools[worker] = self.start_worker()
+        finally:
+            self.lock.release()
+
+    def fallback_counts(self):
+        """
+        :return: How many chunks were sent to a replacement worker, and how many posts were given up on
+        """
+        self.lock.acquire()
+        try:
+            return self.retried_chunks, self.abandoned_posts
+        finally:
+            self.lock.release()
+
+    def utilization(self):
+        """
+        :return: (pid, fraction of the time since the pool started spent scanning, posts scanned) of each worker
+                 that has scanned anything, busiest first
+        """
+        elapsed = time.monotonic() - self.started
+        self.lock.acquire()
+        try:
+            rows = [(pid, seconds / elapsed if elapsed else 0, posts) for pid, (seconds, posts) in self.busy.items()]
+        finally:
+            self.lock.release()
+        return sorted(rows, key=lambda row: row[1], reverse=True)
+
+    def close(self):
+        self.lock.acquire()
+        for worker_pool in self.worker_pools:
+            worker_pool.pool.terminate()
+        self.lock.release()
@@ -16,6 +16,11 @@ from classes import Post, PostParseError
 from helpers import log
 
 
+# The posts of a batch are scanned this many at a time, so that spam among the first ones is reported without waiting
+# for the rest to be scanned
+REPORT_CHUNK_SIZE = 10
+
+
 # noinspection PyMissingTypeHints
 def should_whitelist_prevent_alert(user_url, reasons):
     is_whitelisted = datahandling.is_whitelisted_user(parsing.get_user_from_url(user_url))
@@ -31,14 +36,77 @@ def should_reasons_prevent_tavern_posting(reasons):
     return len(reasons_comparison) == 0
 
 
+# noinspection PyMissingTypeHints
+def is_post_suppressed(post):
+    return datahandling.has_already_been_posted(post.post_site, post.post_id, post.title) \
+        or datahandling.is_false_positive((post.post_id, post.post_site)) \
+        or datahandling.is_ignored_post((post.post_id, post.post_site)) \
+        or datahandling.is_auto_ignored_post((post.post_id, post.post_site))
+
+
 # noinspection PyMissingTypeHints
 def check_if_spam(post):
     # if not post.body:
     #     body = ""
     # test, why = FindSpam.test_post(title, body, user_name, post_site,
     # is_answer, body_is_summary, owner_rep, post_score)
-    test, why = FindSpam.test_post(post)
-    if datahandling.is_blacklisted_user(parsing.get_user_from_url(post.user_url)):
+    return check_posts_if_spam([post])[0]
+
+
+# noinspection PyMissingTypeHints
+def check_posts_if_spam(posts):
+    """
+    check_if_spam for a batch of posts, which are scanned together. Returns the results in order.
+    """
+    results = [(False, None, "")] * len(posts)
+    to_scan = []
+    for index, post in enumerate(posts):
+        if is_post_suppressed(post):
+            # It wouldn't be reported whatever the scan found, so don't scan it
+            GlobalVars.posts_scan_stats_lock.acquire()
+            GlobalVars.num_scans_avoided += 1
+            GlobalVars.posts_scan_stats_lock.release()
+            continue  # Don't repost. Reddit will hate you.
+        to_scan.append((index, datahandling.is_blacklisted_user(parsing.get_user_from_url(post.user_url))))
+
+    scan_posts = GlobalVars.scan_pool.scan_posts if GlobalVars.scan_pool is not None else FindSpam.scan_posts
+    scans = scan_posts([posts[index] for index, _ in to_scan],
+                       [is_blacklisted_user and GlobalVars.blacklisted_user_first_reason_only
+                        for _, is_blacklisted_user in to_scan])
+    for (index, is_blacklisted_user), (test, why_parts) in zip(to_scan, scans):
+        results[index] = spam_check_result(posts[index], test, why_parts, is_blacklisted_user)
+    return results
+
+
+# noinspection PyMissingTypeHints
+def iter_posts_if_spam(posts, chunk_size=REPORT_CHUNK_SIZE):
+    """
+    check_posts_if_spam, yielding the results in order as each chunk of chunk_size posts has been scanned.
+
+    A chunk whose scan raises is scanned again a post at a time, and a post that raises on its own is logged and
+    taken as not spam, so that one bad post doesn't keep the spam among the rest from being reported.
+    """
+    for start in range(0, len(posts), chunk_size):
+        chunk = posts[start:start + chunk_size]
+        try:
+            results = check_posts_if_spam(chunk)
+        except Exception as e:
+            log('error', "Exception scanning posts, scanning them one at a time:", e)
+            results = []
+            for post in chunk:
+                try:
+                    results.append(check_posts_if_spam([post])[0])
+                except Exception as e:
+                    log('error', "Exception scanning post {}:".format(post.post_url or post.post_id), e)
+                    results.append((False, None, ""))
+        for result in results:
+            yield result
+
+
+# noinspection PyMissingTypeHints
+def spam_check_result(post, test, why_parts, is_blacklisted_user):
+    why = ""
+    if is_blacklisted_user:
         test.append("blacklisted user")
         blacklisted_user_data = datahandling.get_blacklisted_user_data(parsing.get_user_from_url(post.user_url))
         if len(blacklisted_user_data) > 1:
@@ -55,13 +123,10 @@ def check_if_spam(post):
             else:
                 why += u"\n" + u"Blacklisted user - blacklisted by {}".format(blacklisted_by)
     if 0 < len(test):
-        if datahandling.has_already_been_posted(post.post_site, post.post_id, post.title) \
-                or datahandling.is_false_positive((post.post_id, post.post_site)) \
-                or should_whitelist_prevent_alert(post.user_url, test) \
-                or datahandling.is_ignored_post((post.post_id, post.post_site)) \
-                or datahandling.is_auto_ignored_post((post.post_id, post.post_site)):
-            return False, None, ""  # Don't repost. Reddit will hate you.
-        return True, test, why
+        if should_whitelist_prevent_alert(post.user_url, test):
+            return False, None, ""
+        # Only now that the post is going to be reported is it worth building the why string
+        return True, test, FindSpam.explain(why_parts) + why
     return False, None, ""
 
 
@@ -77,6 +142,11 @@ def check_if_spam_json(json_data):
     return is_spam, reason, why
 
 
+# noinspection PyMissingTypeHints
+def check_if_spam_event(event):
+    return check_if_spam(Post(event=event))
+
+
 # noinspection PyBroadException,PyProtectedMember
 def handle_spam(post, reasons, why):
     post_url = parsing.to_protocol_relative(parsing.url_to_shortlink(post.post_url))
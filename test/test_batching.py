@@ -0,0 +1,64 @@
+import re
+
+from batching import BatchingController
+from globalvars import GlobalVars
+
+
+def test_static_policy_until_enough_arrivals():
+    controller = BatchingController(10, min_arrivals=3)
+    controller.record_arrival("a.stackexchange.com", now=0)
+    controller.record_arrival("a.stackexchange.com", now=10)
+    assert controller.policy("a.stackexchange.com", 2, 60) == (2, 60, "static")
+    assert controller.policy("b.stackexchange.com", 1, 60) == (1, 60, "static")
+
+
+def test_adaptive_policy():
+    controller = BatchingController(10, overrides={"meta.stackexchange.com": (1, 30)}, min_arrivals=3,
+                                    arrival_smoothing=1)
+    for now in range(0, 50, 5):
+        controller.record_arrival("slow.stackexchange.com", now=now)
+        controller.record_arrival("meta.stackexchange.com", now=now)
+    for now in range(0, 50):
+        controller.record_arrival("busy.stackexchange.com", now=now)
+    # A post every 5s, so 2 of them arrive within the 10s wait, but the batch doesn't shrink below the static size
+    assert controller.policy("slow.stackexchange.com", 3, 60) == (3, 10, "adaptive")
+    assert controller.policy("slow.stackexchange.com", 1, 60) == (2, 10, "adaptive")
+    # 10 of them arrive within the wait, so the batch grows past the static size of 3
+    assert controller.policy("busy.stackexchange.com", 3, 60) == (10, 10, "adaptive")
+    assert controller.policy("busy.stackexchange.com", 3, 5) == (5, 5, "adaptive")
+    assert controller.policy("meta.stackexchange.com", 3, 60) == (1, 30, "override")
+
+    controller.record_scans("slow.stackexchange.com", 5, 20)
+    size, wait, _ = controller.policy("slow.stackexchange.com", 1, 60)
+    assert wait < 10 and size < 2
+
+    quota = GlobalVars.apiquota
+    GlobalVars.apiquota = 0
+    try:
+        # Running out of quota, the busy site's batches and wait grow further
+        assert controller.policy("busy.stackexchange.com", 3, 60) == (20, 20, "adaptive")
+        report = controller.report(lambda site: (3, 60))
+    finally:
+        GlobalVars.apiquota = quota
+    assert report.startswith("busy.stackexchange.com: 20 posts or 20s (adaptive)")
+    assert "meta.stackexchange.com: 1 posts or 30s (override)" in report
+
+
+def test_adaptive_policy_saves_api_calls():
+    controller = BatchingController(10, min_arrivals=3, arrival_smoothing=1)
+    for now in range(0, 50):
+        controller.record_arrival("busy.stackexchange.com", now=now)
+    report = controller.report(lambda site: (3, 60))
+    calls, static_calls = re.search(r"About (\d+) API calls an hour, against (\d+)", report).groups()
+    assert int(calls) < int(static_calls)
+
+
+def test_quiet_sites_keep_their_static_batch_size():
+    controller = BatchingController(10, min_arrivals=3, arrival_smoothing=1)
+    for now in range(0, 300, 30):
+        controller.record_arrival("quiet.stackexchange.com", now=now)
+    assert controller.policy("quiet.stackexchange.com", 2, 60) == (2, 10, "adaptive")
+    # Flushed at most once per post, however short the wait
+    report = controller.report(lambda site: (2, 60))
+    calls, static_calls = re.search(r"About (\d+) API calls an hour, against (\d+)", report).groups()
+    assert (int(calls), int(static_calls)) == (120, 60)
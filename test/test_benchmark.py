@@ -0,0 +1,21 @@
+# coding=utf-8
+from benchmark import generate_corpus, offline_dns, replay
+
+
+# noinspection PyMissingTypeHints
+def test_generated_corpus_is_reproducible():
+    corpus = generate_corpus(20, seed=3)
+    assert corpus == generate_corpus(20, seed=3)
+    assert corpus != generate_corpus(20, seed=4)
+    assert all(question["site"] and "answers" in question for question in corpus)
+
+
+# noinspection PyMissingTypeHints
+def test_replay():
+    corpus = generate_corpus(10, seed=1, spam_ratio=1)
+    with offline_dns():
+        results = replay(corpus)
+    assert results["posts"] == 10 + sum(len(question["answers"]) for question in corpus)
+    assert 0 < results["flagged"] <= results["posts"]
+    assert results["p50_ms"] <= results["p95_ms"] <= results["p99_ms"]
+    assert results["rules"]
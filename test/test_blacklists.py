@@ -2,6 +2,9 @@
 
 from glob import glob
 from helpers import only_blacklists_changed
+from blacklists import build_trie_regex, required_literals, LiteralPrefilter, DomainIndex
+import regex
+import warnings
 
 
 def test_blacklist_integrity():
@@ -34,3 +37,49 @@ def test_blacklist_pull_diff():
                           test/test_blacklists.py
                           blacklisted_usernames.txt"""
     assert not only_blacklists_changed(mixed_files_diff)
+
+
+def test_trie_regex_matches_like_the_joined_list():
+    entries = ["example\\.com", "exam", "examples?", "EXAMPLE\\.co", "ex", "spam-site\\.net", "exam"]
+    pattern, stats = build_trie_regex(entries)
+    assert stats.entries == 7
+    assert stats.literals == 6
+    assert stats.branches < stats.entries
+    text = "an example.com, an exam, an Example.co.uk, examples at spam-site.net"
+    for wrapper in [r"(?i)({})", r"(?is)\b({})\b"]:
+        joined = regex.compile(wrapper.format("|".join(entries)))
+        trie = regex.compile(wrapper.format(pattern))
+        assert [m.span() for m in trie.finditer(text)] == [m.span() for m in joined.finditer(text)]
+
+
+def test_required_literals():
+    assert required_literals("buy\\W?cheap\\W?pills") == {"cheap"}
+    assert required_literals("(casino|poker)[ -]?online") == {"online"}
+    assert required_literals("(casinos?|pokers?)\\d+") == {"casino", "poker"}
+    assert required_literals("\\d+-\\d+") == {"-"}
+    assert required_literals("[a-z]+") is None
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        required_literals("^(?s).{0,200}brain[-']?pills")
+    assert caught == []
+
+
+def test_literal_prefilter_candidates():
+    prefilter = LiteralPrefilter([["cheap\\W?pills", "(casino|poker)s?"], ["x\\d"]])
+    # An entry without a literal is left to the caller, rather than making every text a candidate
+    assert prefilter.unfiltered == [[], [0]]
+    assert prefilter.unfiltered_count() == 1
+    assert prefilter.candidates("nothing to see here") is None
+    assert prefilter.candidates("Play POKER and buy CHEAP-PILLS") == ((0, 1), ())
+
+    prefilter = LiteralPrefilter([["cheap\\W?pills", "(casino|poker)s?"]])
+    assert prefilter.candidates("nothing to see here") is None
+    assert prefilter.candidates("casinos") == ((1,),)
+    assert prefilter.candidates_of_texts(["casinos", "nothing", "", "CHEAP PILLS"]) == \
+        [((1,),), None, None, ((0,),)]
+
+
+def test_domain_index():
+    index = DomainIndex(["spam\\.com", "Example\\.co\\.uk", "spam(site)?", "//sh\\.st/"])
+    assert index.domains == {0: "spam.com", 1: "example.co.uk"}
+    assert index.split((0, 2, 3)) == ((0,), (2, 3))
@@ -0,0 +1,57 @@
+import time
+from datetime import datetime
+
+from batching import BatchingController
+from bodyfetcher import BodyFetcher
+
+
+def make_fetcher():
+    fetcher = BodyFetcher()
+    fetcher.queue = {}
+    fetcher.flush_deadlines = {}
+    fetcher.flush_heap = []
+    return fetcher
+
+
+def test_flush_threshold():
+    fetcher = make_fetcher()
+    assert fetcher.flush_threshold("stackoverflow.com") == 3
+    assert fetcher.flush_threshold("unknown.stackexchange.com") == fetcher.threshold
+    expected = 1 if datetime.utcnow().hour in range(4, 12) else fetcher.threshold
+    assert fetcher.flush_threshold("askubuntu.com") == expected
+
+
+def test_sites_are_flushed_by_deadline():
+    fetcher = make_fetcher()
+    now = time.monotonic()
+    fetcher.queue_modify_lock.acquire()
+    fetcher.schedule_flush("later.stackexchange.com", now + 0.2)
+    fetcher.schedule_flush("flushed.stackexchange.com", now - 2)
+    fetcher.schedule_flush("due.stackexchange.com", now - 1)
+    # flushed before its deadline came up
+    del fetcher.flush_deadlines["flushed.stackexchange.com"]
+    fetcher.queue_modify_lock.release()
+
+    assert fetcher.next_due_site() == "due.stackexchange.com"
+    assert fetcher.next_due_site() == "later.stackexchange.com"
+    assert time.monotonic() >= now + 0.2
+    assert fetcher.flush_deadlines == {}
+
+
+def test_adaptive_batches_stay_within_latency_target():
+    fetcher = make_fetcher()
+    fetcher.batching = BatchingController(fetcher.batching_latency_target, arrival_smoothing=1)
+    for now in range(20):
+        fetcher.batching.record_arrival("stackoverflow.com", now=now / 2)
+        fetcher.batching.record_arrival("askubuntu.com", now=now / 2)
+
+    # About 20 posts arrive within the latency target, so a batch grows past the static threshold
+    size, wait, source = fetcher.flush_policy("stackoverflow.com")
+    assert (wait, source) == (fetcher.batching_latency_target, "adaptive")
+    assert fetcher.flush_threshold("stackoverflow.com") < size <= wait * 2
+    # Except at the time sensitive sites in the hours they're flushed post by post
+    size, _, source = fetcher.flush_policy("askubuntu.com")
+    if fetcher.flushed_post_by_post("askubuntu.com"):
+        assert (size, source) == (1, "static")
+    else:
+        assert size > fetcher.flush_threshold("askubuntu.com")
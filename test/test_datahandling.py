@@ -1,9 +1,30 @@
 # -*- coding: utf-8 -*-
 
-from datahandling import append_pings
+import os
+import pickle
+import pytest
+
+from datahandling import append_pings, store_regex_quarantine
+from findspam import RegexQuarantine
 
 
 # noinspection PyMissingTypeHints
 def test_append_pings():
     assert append_pings("foo", ["user1", "some user"]) == "foo (@user1 @someuser)"
     assert append_pings("foo", [u"Doorknob 冰"]) == u"foo (@Doorknob冰)"
+
+
+# noinspection PyMissingTypeHints
+@pytest.mark.skipif(os.path.isfile("regexQuarantine.p"), reason="shouldn't overwrite file")
+def test_regex_quarantine_is_stored():
+    RegexQuarantine.on_change = store_regex_quarantine
+    try:
+        RegexQuarantine.add("bad keyword in {}", "(?:a|aa)+b", "//stackoverflow.com/q/1")
+        with open("regexQuarantine.p", "rb") as f:
+            assert ("bad keyword in {}", "(?:a|aa)+b", "//stackoverflow.com/q/1") in pickle.load(f)
+        assert RegexQuarantine.release("(?:a|aa)+b") == 1
+        with open("regexQuarantine.p", "rb") as f:
+            assert ("bad keyword in {}", "(?:a|aa)+b", "//stackoverflow.com/q/1") not in pickle.load(f)
+    finally:
+        RegexQuarantine.on_change = None
+        os.remove("regexQuarantine.p")
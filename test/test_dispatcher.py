@@ -0,0 +1,47 @@
+import threading
+import time
+
+from dispatcher import DelayedDispatcher
+
+
+def test_calls_run_in_order_of_their_delay():
+    dispatcher = DelayedDispatcher("test dispatcher", workers=1)
+    calls = []
+    done = threading.Event()
+    start = time.monotonic()
+    dispatcher.schedule(0.2, lambda: (calls.append("later"), done.set()))
+    dispatcher.schedule(0.1, calls.append, "sooner")
+    dispatcher.schedule(0, calls.append, "now")
+    assert done.wait(5)
+
+    assert calls == ["now", "sooner", "later"]
+    assert time.monotonic() - start >= 0.2
+    stats = dispatcher.stats()
+    assert stats['depth'] == 0
+    assert stats['dispatched'] == 3
+    assert stats['max_lateness_ms'] < 1000
+
+
+def test_depth_counts_calls_waiting_for_a_thread():
+    dispatcher = DelayedDispatcher("test dispatcher", workers=1)
+    started = threading.Event()
+    release = threading.Event()
+    dispatcher.schedule(0, lambda: (started.set(), release.wait(5)))
+    assert started.wait(5)
+    dispatcher.schedule(0, lambda: None)
+    dispatcher.schedule(0, lambda: None)
+    dispatcher.schedule(60, lambda: None)
+    deadline = time.monotonic() + 5
+    while not dispatcher.heap[0][0] > time.monotonic() + 30 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # The two calls due now are waiting behind the blocked one, and the last one for its time
+    assert dispatcher.stats()['depth'] == 3
+    release.set()
+
+
+def test_exceptions_are_logged():
+    dispatcher = DelayedDispatcher("test dispatcher", workers=1)
+    done = threading.Event()
+    dispatcher.schedule(0, lambda: 1 / 0)
+    dispatcher.schedule(0, done.set)
+    assert done.wait(5)
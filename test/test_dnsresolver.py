@@ -0,0 +1,100 @@
+from collections import namedtuple
+import threading
+import time
+import dns.exception
+import dns.resolver
+
+from dnsresolver import NameserverResolver
+
+Server = namedtuple('Server', 'target')
+RRSet = namedtuple('RRSet', 'ttl')
+
+
+class Name:
+    def __init__(self, name):
+        self.name = name
+
+    def to_text(self):
+        return self.name
+
+
+class Answer(list):
+    def __init__(self, nameservers, ttl):
+        super().__init__(Server(Name(ns)) for ns in nameservers)
+        self.rrset = RRSet(ttl)
+
+
+class StubResolver:
+    def __init__(self, zones, delay=0):
+        self.zones = zones
+        self.delay = delay
+        self.queries = []
+        self.lock = threading.Lock()
+
+    def query(self, domain, rdtype):
+        with self.lock:
+            self.queries.append(domain)
+        time.sleep(self.delay)
+        if domain not in self.zones:
+            raise dns.resolver.NXDOMAIN()
+        if self.zones[domain] is None:
+            raise dns.exception.Timeout()
+        nameservers, ttl = self.zones[domain]
+        return Answer(nameservers, ttl)
+
+
+def test_answers_and_nxdomains_are_cached():
+    stub = StubResolver({'example.com': (['ns1.example.net.'], 300)})
+    resolver = NameserverResolver(resolver=stub)
+    assert resolver.nameservers(['example.com', 'nowhere.com'], 5) == \
+        {'example.com': ['ns1.example.net.'], 'nowhere.com': None}
+    assert resolver.nameservers(['example.com', 'nowhere.com'], 5) == \
+        {'example.com': ['ns1.example.net.'], 'nowhere.com': None}
+    assert sorted(stub.queries) == ['example.com', 'nowhere.com']
+    stats = resolver.stats()
+    assert (stats['hits'], stats['negative_hits'], stats['misses'], stats['lookups']) == (1, 1, 2, 2)
+
+
+def test_expired_and_evicted_entries_are_looked_up_again():
+    stub = StubResolver({'a.com': (['ns.a.com.'], 0), 'b.com': (['ns.b.com.'], 300), 'c.com': (['ns.c.com.'], 300)})
+    resolver = NameserverResolver(resolver=stub, max_entries=2)
+    resolver.nameservers(['a.com'], 5)
+    resolver.nameservers(['a.com'], 5)
+    assert stub.queries == ['a.com', 'a.com']
+
+    resolver.nameservers(['b.com'], 5)
+    resolver.nameservers(['c.com'], 5)
+    resolver.nameservers(['b.com'], 5)
+    assert stub.queries == ['a.com', 'a.com', 'b.com', 'c.com']
+    assert list(resolver.cache.keys()) == ['c.com', 'b.com']
+
+
+def test_errors_are_not_cached():
+    stub = StubResolver({'flaky.com': None})
+    resolver = NameserverResolver(resolver=stub)
+    assert resolver.nameservers(['flaky.com'], 5) == {}
+    assert resolver.nameservers(['flaky.com'], 5) == {}
+    assert stub.queries == ['flaky.com', 'flaky.com']
+    assert resolver.stats()['errors'] == 2
+
+
+def test_lookups_run_concurrently_within_the_deadline():
+    zones = {'{}.com'.format(i): (['ns.example.net.'], 300) for i in range(4)}
+    resolver = NameserverResolver(resolver=StubResolver(zones, delay=0.2), workers=4)
+    start = time.monotonic()
+    assert len(resolver.nameservers(list(zones), 5)) == 4
+    assert time.monotonic() - start < 0.6
+
+    slow = NameserverResolver(resolver=StubResolver({'slow.com': (['ns.slow.com.'], 300)}, delay=0.3))
+    assert slow.nameservers(['slow.com'], 0.05) == {}
+    assert slow.stats()['deadline_misses'] == 1
+    time.sleep(0.4)
+    # the lookup finished after the deadline, and was still cached
+    assert slow.nameservers(['slow.com'], 0.05) == {'slow.com': ['ns.slow.com.']}
+
+
+def test_resolve_is_used_when_there_is_one():
+    stub = StubResolver({'example.com': (['ns1.example.net.'], 300)})
+    stub.resolve = stub.query
+    stub.query = None
+    assert NameserverResolver(resolver=stub).nameservers(['example.com'], 5) == {'example.com': ['ns1.example.net.']}
@@ -0,0 +1,21 @@
+from helpers import LRUCache
+
+
+def test_lru_cache():
+    computed = []
+
+    def compute(key):
+        computed.append(key)
+        return key * 2
+
+    cache = LRUCache(2)
+    assert cache.get_or_compute(1, lambda: compute(1)) == 2
+    assert cache.get_or_compute(1, lambda: compute(1)) == 2
+    assert cache.get_or_compute(2, lambda: compute(2)) == 4
+    cache.get_or_compute(1, lambda: compute(1))
+    cache.get_or_compute(3, lambda: compute(3))
+    # 2 was the least recently used key, so it was evicted
+    assert cache.get_or_compute(2, lambda: compute(2)) == 4
+    assert computed == [1, 2, 3, 2]
+    assert (cache.hits, cache.misses) == (2, 4)
+    assert cache.hit_rate() == 2 / 6
@@ -0,0 +1,29 @@
+from htmlsegments import segment_body
+
+
+def test_segments_map_back_to_the_body():
+    body = ('<p>See <a href="https://example.com/" rel="nofollow noreferrer">the docs</a>:</p>\n'
+            '<blockquote><pre class="lang-py"><code>x = "<a>" if y &lt; 2</code></pre>'
+            '<img src="https://i.stack.imgur.com/a.png" alt="a"></blockquote><p>done</p>')
+    segments = segment_body(body)
+
+    assert "".join(body[segment.start:segment.end] for segment in segments) == body
+    assert [segment.kind for segment in segments] == \
+        ['tag', 'text', 'anchor', 'text', 'tag', 'text', 'tag', 'text', 'tag', 'code', 'image', 'tag', 'tag', 'text',
+         'tag']
+
+    anchor = segments[2]
+    assert anchor.attributes == {'href': 'https://example.com/', 'rel': 'nofollow noreferrer'}
+    assert anchor.text == "the docs"
+
+    code = segments[9]
+    assert code.text == '<code>x = "<a>" if y &lt; 2</code>'
+    assert code.quote_depth == 1
+    assert segments[10].attributes['src'] == "https://i.stack.imgur.com/a.png"
+    assert segments[-1].quote_depth == 0
+
+
+def test_unclosed_blocks_are_ordinary_tags():
+    segments = segment_body("<pre>no end <a href='x'>link")
+    assert [segment.kind for segment in segments] == ['tag', 'text', 'anchor', 'text']
+    assert segments[2].text is None
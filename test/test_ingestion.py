@@ -0,0 +1,28 @@
+import threading
+
+from ingestion import IngestionPool
+
+
+def test_backpressure():
+    handled = []
+    overflowed = []
+    pool = IngestionPool("test ingestion", handled.append, workers=1, max_waiting=2,
+                         overflow_handler=overflowed.append)
+    pool.put("a", "a1")
+    pool.put("b", "b1")
+    pool.put("a", "a2")
+    pool.put("c", "c1")
+    assert pool.stats() == {'waiting': 2, 'handled': 0, 'coalesced': 1, 'dropped': 1}
+    # The dropped event is set aside for the overflow handling, which the workers do
+    assert list(pool.overflow) == ["a2"]
+    assert overflowed == []
+    assert pool.dropping
+
+    done = threading.Event()
+    pool.put("d", "d1")
+    pool.handler = lambda event: (handled.append(event), event == "d1" and done.set())
+    pool.start()
+    assert done.wait(5)
+    assert handled == ["c1", "d1"]
+    assert overflowed == ["a2", "b1"]
+    assert not pool.dropping
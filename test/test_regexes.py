@@ -1,8 +1,13 @@
 # -*- coding: utf-8 -*-
-from findspam import FindSpam
+from concurrent.futures import ThreadPoolExecutor
+from globalvars import GlobalVars
+from findspam import FindSpam, BodyViews, Rule, RuleStats, RegexQuarantine, text_features, similar_answer, \
+    username_similar_website
 import pytest
+import findspam
 from classes import Post
 from helpers import log
+from blacklists import load_blacklists
 
 
 # noinspection PyMissingTypeHints
@@ -94,3 +99,205 @@ def test_regexes(title, body, username, site, body_is_summary, is_answer, match)
     if len(result) > 0:
         isspam = True
     assert match == isspam
+
+
+# noinspection PyMissingTypeHints
+def test_rule_set_rebuilt_after_blacklist_reload():
+    rule_set = FindSpam.get_rule_set()
+    assert FindSpam.get_rule_set() is rule_set
+    load_blacklists()
+    assert FindSpam.get_rule_set() is not rule_set
+
+
+# noinspection PyMissingTypeHints
+def test_body_views_are_built_once():
+    views = BodyViews(u"<p>x\u200by <code>code</code></p><img src='a'>")
+    assert views.get('zero_width_stripped') == u"<p>xy <code>code</code></p><img src='a'>"
+    assert views.get('code_stripped') == \
+        u"<p>xy <pre><code>placeholder for omitted code/\u043a\u043e\u0434 block</pre></code></p><img src='a'>"
+    assert views.get('code_stripped') is views.get('code_stripped')
+
+
+# noinspection PyMissingTypeHints
+def test_why_is_built_from_the_scan_matches():
+    post = Post(api_response={'title': 'viagra and more viagra', 'body': 'body',
+                              'owner': {'display_name': 'user', 'reputation': 1, 'link': ''},
+                              'site': 'stackoverflow.com', 'question_id': '1', 'IsAnswer': False,
+                              'BodyIsSummary': False, 'score': 0})
+    result, why = FindSpam.scan_post(post)
+    assert "bad keyword in title" in result
+    assert not any(isinstance(item, str) for item in why['title'])
+    assert u"Title - Position 1-7: viagra, Position 17-23: viagra" in FindSpam.explain(why).split("\n")
+    assert FindSpam.test_post(post) == (result, FindSpam.explain(why))
+
+
+# noinspection PyMissingTypeHints
+def test_posts_are_scanned_in_batches():
+    posts = [Post(api_response={'title': title, 'body': body,
+                                'owner': {'display_name': 'user', 'reputation': 1, 'link': ''},
+                                'site': 'stackoverflow.com', 'question_id': str(index), 'IsAnswer': False,
+                                'BodyIsSummary': False, 'score': 0})
+             for index, (title, body) in enumerate([('viagra for sale', 'body'), ('How do I sort a list?', 'thanks'),
+                                                    ('Call 1-866-978-6819', 'gmail customer service')])]
+    results = [FindSpam.test_post(post) for post in posts]
+    assert FindSpam.test_posts(posts) == results
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        assert FindSpam.test_posts(posts, executor, chunk_size=2) == results
+    assert results[0][0] and not results[1][0] and results[2][0]
+
+
+# noinspection PyMissingTypeHints
+def test_catastrophic_keyword_is_quarantined():
+    slow_keyword = r"(?:a|aa)+(?:c|\s)"
+    GlobalVars.bad_keywords.append(slow_keyword)
+    GlobalVars.blacklists_version += 1
+    try:
+        post = Post(api_response={'title': 'title', 'body': "a" * 60 + "!",
+                                  'owner': {'display_name': 'user', 'reputation': 1, 'link': ''},
+                                  'site': 'stackoverflow.com', 'question_id': '1', 'IsAnswer': False,
+                                  'BodyIsSummary': False, 'score': 0})
+        FindSpam.test_post(post)
+        assert RegexQuarantine.contains("bad keyword in {}", slow_keyword)
+        rule = [rule for rule in FindSpam.get_rule_set().rules if rule.prefilter is not None][0]
+        assert slow_keyword not in rule.blacklists[0]
+        assert RegexQuarantine.release(slow_keyword) == 1
+    finally:
+        GlobalVars.bad_keywords.remove(slow_keyword)
+        GlobalVars.blacklists_version += 1
+
+
+# noinspection PyMissingTypeHints
+def test_blame_pass_stops_when_out_of_time(monkeypatch):
+    slow_keyword = r"(?:a|aa)+(?:c|\s)"
+    GlobalVars.bad_keywords.append(slow_keyword)
+    GlobalVars.blacklists_version += 1
+    try:
+        rule = [rule for rule in FindSpam.get_rule_set().rules if rule.reason == "bad keyword in {}"][0]
+        assert rule.slow_entries("a" * 60 + "!") == [slow_keyword]
+        monkeypatch.setattr(findspam, "BLAME_TIME_BUDGET", 0)
+        assert rule.slow_entries("a" * 60 + "!") == []
+    finally:
+        GlobalVars.bad_keywords.remove(slow_keyword)
+        GlobalVars.blacklists_version += 1
+
+
+# noinspection PyMissingTypeHints
+def test_unfiltered_entries_are_checked_without_candidates():
+    rule = [rule for rule in FindSpam.get_rule_set().rules if rule.reason == "bad keyword in {}"][0]
+    text = "Try b-o-j-i-t-e-r today"
+    assert rule.prefilter.candidates(text) is None
+    assert rule.find(text, u"Body")
+    assert rule.find("Nothing to see here", u"Body") is None
+
+
+# noinspection PyMissingTypeHints
+def test_plain_domains_match_without_the_regex():
+    rule = Rule({'regex': u"(?i)({})".format, 'blacklists': lambda: [["spam\\.com", "cheap(pills)?\\.net"]],
+                 'index_domains': True, 'all': True, 'sites': [], 'reason': "blacklisted website in {}",
+                 'title': True, 'body': True, 'username': False, 'stripcodeblocks': False, 'max_rep': 1,
+                 'max_score': 0}, FindSpam.city_list)
+    # Bare mentions and longer domains match, as they do with the regex
+    matches = rule.find("See notSPAM.com or spam.com", u"Body")
+    assert matches.explain() == u"Body - Position 8-16: SPAM.com, Position 20-28: spam.com"
+    # The regex run for the other entries leaves the plain domains out
+    matches = rule.find("Buy at cheappills.net", u"Body")
+    assert matches.explain() == u"Body - Position 8-22: cheappills.net"
+    assert "spam" not in matches.compiled_regex.pattern
+    assert rule.find("Nothing to see here", u"Body") is None
+
+
+# noinspection PyMissingTypeHints
+def test_rule_pattern_is_only_blamed_if_it_times_out_again():
+    rule = Rule({'regex': r"(?:a|aa)+(?:c|\s)", 'all': True, 'sites': [], 'reason': "slow pattern in {}",
+                 'title': False, 'body': True, 'username': False, 'stripcodeblocks': False, 'max_rep': 1,
+                 'max_score': 0}, FindSpam.city_list)
+    # Timing out once on a text it runs through quickly, it was held up by something else
+    assert rule.slow_entries("a" * 10 + "!") == []
+    assert rule.slow_entries("a" * 60 + "!") == [rule.regex.pattern]
+
+
+# noinspection PyMissingTypeHints
+def test_text_features_are_shared():
+    text = u"<p>Visit http://example.com/a for \u0442\u0435\u0441\u0442 \u4e2d 42</p>"
+    features = text_features(text)
+    assert text_features(text) is features
+    assert len(features.links) == 1
+    assert len(features.domains) == 1
+    assert features.digit_count == 2
+    assert features.char_counts["4"] == 1
+    words = features.derive('word_chars', lambda s: "".join(char for char in s if char.isalpha()))
+    assert features.derive('word_chars', None) is words
+    assert words.script_counts == {'latin': 25, 'cyrillic': 4, 'other': 1}
+
+
+# noinspection PyMissingTypeHints
+def test_character_stats():
+    features = text_features(u"Nooooooooooooo... \u043d\u0435\u0442!")
+    assert features.char_stats.uniques == 8
+    assert features.char_stats.most_common_count == 13
+    assert features.char_stats.dots == 3
+    assert features.char_stats.scripts == {'latin': 14, 'cyrillic': 3, 'other': 5}
+    assert features.runs == [(u"o", 13), (u".", 3)]
+
+
+# noinspection PyMissingTypeHints
+def test_rules_for_post_follow_site_and_reputation():
+    def rules_for(site, reputation):
+        post = Post(api_response={'title': 'title', 'body': 'body',
+                                  'owner': {'display_name': 'user', 'reputation': reputation, 'link': ''},
+                                  'site': site, 'question_id': '1', 'IsAnswer': False,
+                                  'BodyIsSummary': False, 'score': 0})
+        return [targets.rule for targets in FindSpam.get_rule_set().rules_for_post(post)]
+
+    rule_set = FindSpam.get_rule_set()
+    so_rules = rules_for('stackoverflow.com', 1)
+    assert so_rules == [rule for rule in rule_set.rules if rule.applies_to_site('stackoverflow.com')]
+    assert all(rule.max_rep >= 50 for rule in rules_for('stackoverflow.com', 50))
+    assert len(rules_for('stackoverflow.com', 50)) < len(so_rules)
+    assert rules_for('stackoverflow.com', 10 ** 7) == []
+
+
+# noinspection PyMissingTypeHints
+def test_rule_stats_recorded():
+    post = Post(api_response={'title': 'Buy cheap viagra', 'body': '<p>viagra</p>',
+                              'owner': {'display_name': 'user', 'reputation': 1, 'link': ''},
+                              'site': 'stackoverflow.com', 'question_id': '1', 'IsAnswer': False,
+                              'BodyIsSummary': False, 'score': 0})
+    RuleStats.take_interval_summary()
+    FindSpam.test_post(post)
+    keyword_stats = [row for row in RuleStats.most_expensive(1000) if row[0] == "bad keyword in {}"]
+    assert {row[1] for row in keyword_stats} == {'title', 'body', 'username'}
+    assert all(calls >= 1 and matches <= calls for _, _, calls, _, _, matches in keyword_stats)
+    summary = RuleStats.take_interval_summary(count=1000)
+    assert any(row['reason'] == "bad keyword in {}" and row['field'] == 'title' and row['matches'] == 1
+               for row in summary)
+    assert RuleStats.take_interval_summary() == []
+
+
+# noinspection PyMissingTypeHints
+def test_similar_answer():
+    question = Post(api_response={'title': 'Shortest quine', 'body': '<p>Write a quine.</p>',
+                                  'site': 'codegolf.stackexchange.com', 'question_id': '1001'})
+
+    def answer(answer_id, body):
+        return Post(api_response={'title': '', 'body': body, 'site': 'codegolf.stackexchange.com',
+                                  'answer_id': answer_id, 'IsAnswer': True}, parent=question)
+
+    original = "<p>Python 3, 42 bytes</p><pre><code>s='s=%r;print(s%%s)';print(s%s)</code></pre>"
+    assert similar_answer(answer('2001', original)) == (False, False, False, "")
+    assert similar_answer(answer('2002', "<p>Ruby, 11 bytes</p><pre><code>puts 'hello world!'</code></pre>")) == \
+        (False, False, False, "")
+    matched = similar_answer(answer('2003', original.replace("42", "43")))
+    assert matched[2] and matched[3].startswith("Answer similar to answer 2001, ratio 0.9")
+
+
+# noinspection PyMissingTypeHints
+@pytest.mark.parametrize("body, username, match", [
+    ('<a href="http://www.best-essay-help.com/">here</a>', 'Best Essay Help', True),
+    ('<a href="http://www.best-essay-help.com/">here</a>', 'best-essay-help', True),
+    ('<a href="http://www.besteasyhelp.com/">here</a>', 'Best Essay Help', False),
+    ('<a href="http://github.com/">here</a> and <a href="https://shop-now.in/">here</a>', 'shop now', True),
+    ('no links at all', 'shop now', False),
+])
+def test_username_similar_website(body, username, match):
+    assert username_similar_website(body, 'stackoverflow.com', username)[0] is match
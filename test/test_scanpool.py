@@ -0,0 +1,171 @@
+import functools
+import os
+import time
+
+from classes import Post
+from findspam import FindSpam, RuleStats
+from globalvars import GlobalVars
+import scanpool
+from scanpool import ScanPool, post_record, post_from_record
+
+
+def make_posts():
+    question = Post(api_response={'title': 'Call 1-866-978-6819 for gmail customer service',
+                                  'body': '<p>gmail customer service number</p>',
+                                  'owner': {'display_name': 'user', 'reputation': 1, 'link': 'https://a/users/1/u'},
+                                  'site': 'stackoverflow.com', 'question_id': '1', 'score': 0,
+                                  'link': 'https://stackoverflow.com/q/1',
+                                  'answers': [{'answer_id': '2', 'body': '<p>Try sorted(x) &amp; friends</p>'}]})
+    answer = Post(api_response={'title': '', 'body': '<p>Try sorted(x) &amp; friends</p>', 'IsAnswer': True,
+                                'owner': {'display_name': 'other', 'reputation': 101, 'link': ''},
+                                'site': 'stackoverflow.com', 'answer_id': '2', 'score': 3}, parent=question)
+    return [question, answer]
+
+
+def test_post_records():
+    question, answer = make_posts()
+    copy = post_from_record(post_record(answer))
+    assert repr(copy) == repr(answer)
+    assert copy.parent.post_id == "1"
+    assert [(other.post_id, other.body) for other in copy.parent.answers] == \
+        [(other.post_id, other.body) for other in question.answers]
+    assert repr(post_from_record(post_record(question))) == repr(question)
+
+
+def test_scan_pool():
+    posts = make_posts()
+    expected = [FindSpam.test_post(post) for post in posts]
+    assert expected[0][0] and not expected[1][0]
+
+    pool = ScanPool(2, chunk_size=1)
+    try:
+        calls = sum(entry[0] for entry in RuleStats.totals.values())
+        checks = GlobalVars.prefilter_checks
+        scans = pool.scan_posts(posts)
+        assert [(result, FindSpam.explain(why)) for result, why in scans] == expected
+        assert sum(posts for _, _, posts in pool.utilization()) == 2
+        # The workers' statistics are merged into this process's
+        assert sum(entry[0] for entry in RuleStats.totals.values()) > calls
+        assert GlobalVars.prefilter_checks > checks
+    finally:
+        pool.close()
+
+
+def test_answers_of_a_question_share_a_worker():
+    question = Post(api_response={'title': 'Shortest quine in Python', 'body': '<p>How short can a quine get?</p>',
+                                  'site': 'superuser.com', 'question_id': '3001'})
+
+    def answer(answer_id, body):
+        return Post(api_response={'title': '', 'body': body, 'site': 'superuser.com',
+                                  'answer_id': answer_id, 'IsAnswer': True}, parent=question)
+
+    original = "<p>Python 3, 42 bytes</p><pre><code>s='s=%r;print(s%%s)';print(s%s)</code></pre>"
+    pool = ScanPool(4, chunk_size=1)
+    try:
+        # Each answer comes in its own batch, as they would from separate API calls
+        for answer_id, body in [('4001', original),
+                                ('4002', "<p>Ruby, 11 bytes</p><pre><code>puts 'hello world!'</code></pre>")]:
+            result, _ = pool.scan_posts([answer(answer_id, body)])[0]
+            assert "answer similar to existing answer on post" not in result
+        result, _ = pool.scan_posts([answer('4003', original.replace("42", "43"))])[0]
+        assert "answer similar to existing answer on post" in result
+    finally:
+        pool.close()
+
+
+def stalled_scan(*args):
+    time.sleep(30)
+
+
+def slow_scan(*args):
+    time.sleep(0.6)
+    return scanpool.scan_in_worker(*args)
+
+
+def stall_once_scan(marker, *args):
+    if not os.path.exists(marker):
+        open(marker, "w").close()
+        time.sleep(30)
+    return scanpool.scan_in_worker(*args)
+
+
+def test_stuck_worker_is_replaced(monkeypatch):
+    monkeypatch.setattr(scanpool, "SCAN_POOL_TIMEOUT", 1)
+    posts = make_posts()
+    pool = ScanPool(1, chunk_size=1, scan=stalled_scan)
+    try:
+        stuck = pool.worker_pools[0]
+        scans = pool.scan_posts(posts)
+        # Both chunks got stuck, and then got stuck again on the replacements, so they were given up on
+        assert [(result, FindSpam.explain(why)) for result, why in scans] == [([], "")] * 2
+        assert pool.worker_pools[0] is not stuck
+        assert pool.fallback_counts() == (2, 2)
+    finally:
+        pool.close()
+
+
+def test_stuck_chunk_is_sent_to_the_replacement(monkeypatch, tmp_path):
+    monkeypatch.setattr(scanpool, "SCAN_POOL_TIMEOUT", 1)
+    posts = make_posts()
+    expected = [FindSpam.test_post(post) for post in posts]
+    pool = ScanPool(1, chunk_size=2, scan=functools.partial(stall_once_scan, str(tmp_path / "stalled")))
+    try:
+        stuck = pool.worker_pools[0]
+        scans = pool.scan_posts(posts)
+        assert [(result, FindSpam.explain(why)) for result, why in scans] == expected
+        assert pool.worker_pools[0] is not stuck
+        assert pool.fallback_counts() == (1, 0)
+    finally:
+        pool.close()
+
+
+def test_batch_is_given_up_on_at_the_deadline(monkeypatch):
+    monkeypatch.setattr(scanpool, "SCAN_POOL_DEADLINE", 1)
+    posts = make_posts()
+    pool = ScanPool(1, chunk_size=1, scan=stalled_scan)
+    try:
+        worker_pool = pool.worker_pools[0]
+        start = time.monotonic()
+        scans = pool.scan_posts(posts)
+        assert time.monotonic() - start < 10
+        assert [result for result, _ in scans] == [[], []]
+        # It's not been on the chunk for long enough to count as stuck
+        assert pool.worker_pools[0] is worker_pool
+        assert pool.fallback_counts() == (0, 2)
+    finally:
+        pool.close()
+
+
+def test_slow_worker_is_kept(monkeypatch):
+    monkeypatch.setattr(scanpool, "SCAN_POOL_TIMEOUT", 2)
+    posts = make_posts()
+    pool = ScanPool(1, chunk_size=1, scan=slow_scan)
+    try:
+        # A worker that takes longer than the timeout to start up counts as stuck, which isn't what's tested here
+        pool.scan_posts(posts[:1])
+        worker_pool = pool.worker_pools[0]
+        # Together the chunks take longer than the timeout, but neither of them does on its own
+        scans = pool.scan_posts(posts + posts)
+        assert [result for result, _ in scans] == [result for result, _ in pool.scan_posts(posts)] * 2
+        assert pool.worker_pools[0] is worker_pool
+    finally:
+        pool.close()
+
+
+def test_worker_that_never_starts_is_replaced(monkeypatch):
+    monkeypatch.setattr(scanpool, "SCAN_POOL_TIMEOUT", 1)
+    posts = make_posts()
+    expected = [FindSpam.test_post(post) for post in posts]
+    pool = ScanPool(1, chunk_size=2)
+    try:
+        pool.worker_pools[0].pool.terminate()
+        # Like a worker whose process keeps dying before it gets to any chunk
+        stuck = scanpool.WorkerPool(scanpool.WORKER_CONTEXT.Pool(1, time.sleep, (30,)),
+                                    scanpool.WORKER_CONTEXT.Value('l', 0), scanpool.WORKER_CONTEXT.Value('d', 0.0))
+        pool.worker_pools[0] = stuck
+        scans = pool.scan_posts(posts)
+        assert [(result, FindSpam.explain(why)) for result, why in scans] == expected
+        assert pool.worker_pools[0] is not stuck
+        assert [result for result, _ in pool.scan_posts(posts)] == [result for result, _ in expected]
+    finally:
+        pool.close()
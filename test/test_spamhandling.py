@@ -1,12 +1,15 @@
 # coding=utf-8
-from spamhandling import check_if_spam, check_if_spam_json
-from datahandling import add_blacklisted_user, add_whitelisted_user
+import spamhandling
+from spamhandling import check_if_spam, check_if_spam_json, check_if_spam_event, check_posts_if_spam, \
+    iter_posts_if_spam
+from datahandling import add_blacklisted_user, add_whitelisted_user, add_false_positive
+from globalvars import GlobalVars
 from blacklists import load_blacklists
 from parsing import get_user_from_url
 import pytest
 import os
 import json
-from classes import Post
+from classes import Post, QuestionEvent
 
 
 load_blacklists()
@@ -88,6 +91,58 @@ def test_check_if_spam_json(data, match):
     assert not is_spam
 
 
+# noinspection PyMissingTypeHints
+def test_iter_posts_if_spam(monkeypatch):
+    posts = [Post(api_response={'title': title, 'body': '<p>{}</p>'.format(title),
+                                'owner': {'display_name': 'user', 'reputation': 1, 'link': ''},
+                                'site': 'stackoverflow.com', 'question_id': str(index), 'score': 0})
+             for index, title in enumerate(['Call 1-866-978-6819 for gmail customer service', 'How do I sort a list?',
+                                            'viagra for sale'])]
+    expected = check_posts_if_spam(posts)
+    assert expected[0][0] and not expected[1][0] and expected[2][0]
+
+    scanned = []
+    monkeypatch.setattr(spamhandling, "check_posts_if_spam",
+                        lambda chunk: scanned.extend(chunk) or expected[len(scanned) - len(chunk):len(scanned)])
+    results = iter_posts_if_spam(posts, chunk_size=2)
+    # The first spam comes out before the last chunk has been scanned
+    assert next(results) == expected[0]
+    assert scanned == posts[:2]
+    assert [expected[0]] + list(results) == expected
+
+
+# noinspection PyMissingTypeHints
+def test_iter_posts_if_spam_isolates_failures(monkeypatch):
+    posts = [Post(api_response={'title': title, 'body': '<p>{}</p>'.format(title),
+                                'owner': {'display_name': 'user', 'reputation': 1, 'link': ''},
+                                'site': 'stackoverflow.com', 'question_id': str(index), 'score': 0})
+             for index, title in enumerate(['How do I sort a list?', 'Call 1-866-978-6819 for gmail customer service',
+                                            'viagra for sale'])]
+    expected = check_posts_if_spam(posts)
+    check = spamhandling.check_posts_if_spam
+
+    def failing_check(chunk):
+        if posts[0] in chunk:
+            raise ValueError("bad post")
+        return check(chunk)
+
+    monkeypatch.setattr(spamhandling, "check_posts_if_spam", failing_check)
+    # The bad post's chunk-mate is still reported, and so is the chunk after it
+    assert list(iter_posts_if_spam(posts, chunk_size=2)) == [(False, None, "")] + expected[1:]
+
+
+# noinspection PyMissingTypeHints
+def test_check_if_spam_event():
+    event = QuestionEvent.from_frame(json.loads(test_data_inputs[0]))
+    assert (event.site, event.post_id) == ("diy.stackexchange.com", 57991)
+    assert repr(Post(event=event)) == repr(Post(json_data=test_data_inputs[0]))
+    is_spam, reason, _ = check_if_spam_event(event)
+    assert not is_spam
+
+    # A socket reset's data isn't a question
+    assert QuestionEvent.from_frame({"action": "155-questions-active", "data": "not json"}) is None
+
+
 @pytest.mark.skipif(os.path.isfile("blacklistedUsers.p"),
                     reason="shouldn't overwrite file")
 def test_blacklisted_user():
@@ -137,3 +192,22 @@ def test_whitelisted_user():
     assert is_spam is False
     # cleanup
     os.remove("whitelistedUsers.p")
+
+
+# noinspection PyMissingTypeHints
+@pytest.mark.skipif(os.path.isfile("falsePositives.p"),
+                    reason="shouldn't overwrite file")
+def test_false_positive_not_scanned():
+    post = Post(api_response={'title': 'baba ji', 'body': '',
+                              'owner': {'display_name': '', 'reputation': 1, 'link': ''},
+                              'site': 'stackoverflow.com', 'question_id': '4', 'IsAnswer': False, 'score': 0})
+    is_spam, reason, _ = check_if_spam(post)
+    assert is_spam is True
+    add_false_positive(('4', 'stackoverflow.com'))
+    scans_avoided = GlobalVars.num_scans_avoided
+    is_spam, reason, _ = check_if_spam(post)
+    assert is_spam is False
+    assert GlobalVars.num_scans_avoided == scans_avoided + 1
+    # cleanup
+    GlobalVars.false_positives.remove(('4', 'stackoverflow.com'))
+    os.remove("falsePositives.p")
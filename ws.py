@@ -23,7 +23,7 @@ from bodyfetcher import BodyFetcher
 from chatcommunicate import watcher, special_room_watcher
 from datetime import datetime
 from utcdate import UtcDate
-from spamhandling import check_if_spam_json
+from spamhandling import check_if_spam_event
 from globalvars import GlobalVars
 from datahandling import load_files, filter_auto_ignored_posts
 from metasmoke import Metasmoke
@@ -34,118 +34,9 @@ import requests
 # noinspection PyPackageRequirements
 from tld.utils import update_tld_names, TldIOError
 from helpers import log
-
-try:
-    update_tld_names()
-except TldIOError as ioerr:
-    with open('errorLogs.txt', 'a') as errlogs:
-        if "permission denied:" in str(ioerr).lower():
-            if "/usr/local/lib/python2.7/dist-packages/" in str(ioerr):
-                errlogs.write("WARNING: Cannot update TLD names, due to `tld` being system-wide installed and not "
-                              "user-level installed.  Skipping TLD names update. \n")
-
-            if "/home/" in str(ioerr) and ".local/lib/python2.7/site-packages/tld/" in str(ioerr):
-                errlogs.write("WARNING: Cannot read/write to user-space `tld` installation, check permissions on the "
-                              "path.  Skipping TLD names update. \n")
-
-            errlogs.close()
-            pass
-
-        elif "certificate verify failed" in str(ioerr).lower():
-            # Ran into this error in testing on Windows, best to throw a warn if we get this...
-            errlogs.write("WARNING: Cannot verify SSL connection for TLD names update; skipping TLD names update.")
-            errlogs.close()
-            pass
-
-        else:
-            raise ioerr
-
-if "ChatExchangeU" in os.environ:
-    username = os.environ["ChatExchangeU"]
-else:
-    username = input("Username: ")
-if "ChatExchangeP" in os.environ:
-    password = os.environ["ChatExchangeP"]
-else:
-    password = getpass.getpass("Password: ")
-
-# We need an instance of bodyfetcher before load_files() is called
-GlobalVars.bodyfetcher = BodyFetcher()
-
-load_files()
-filter_auto_ignored_posts()
-
-# chat.stackexchange.com logon/wrapper
-chatlogoncount = 0
-for cl in range(1, 10):
-    chatlogoncount += 1
-    try:
-        # chat.stackexchange.com
-        GlobalVars.wrap.login(username, password)
-        GlobalVars.smokeDetector_user_id[GlobalVars.charcoal_room_id] = str(GlobalVars.wrap.get_me().id)
-
-        # chat.meta.stackexchange.com
-        GlobalVars.wrapm.login(username, password)
-        GlobalVars.smokeDetector_user_id[GlobalVars.meta_tavern_room_id] = str(GlobalVars.wrapm.get_me().id)
-
-        # chat.stackoverflow.com
-        GlobalVars.wrapso.login(username, password)
-        GlobalVars.smokeDetector_user_id[GlobalVars.socvr_room_id] = str(GlobalVars.wrapso.get_me().id)
-
-        # If we didn't error out horribly, we can be done with this loop
-        break
-
-    except (ValueError, AssertionError):
-        # One of the chats died, so let's wait a second, and start over.
-        time.sleep(1)
-        continue  # If we did error, we need to try this again.
-
-# Handle "too many logon attempts" case to prevent infinite looping and to handle the 'too many logons' error.
-if chatlogoncount >= 10:
-    raise RuntimeError("Could not get at least one of the chat logons.")
-
-GlobalVars.s = "[ " + GlobalVars.chatmessage_prefix + " ] " \
-               "SmokeDetector started at [rev " +\
-               GlobalVars.commit_with_author +\
-               "](" + GlobalVars.bot_repository + "/commit/" +\
-               GlobalVars.commit['id'] +\
-               ") (running on " +\
-               GlobalVars.location +\
-               ")"
-GlobalVars.s_reverted = "[ " + GlobalVars.chatmessage_prefix + " ] " \
-                        "SmokeDetector started in [reverted mode](" + \
-                        "https://charcoal-se.org/smokey/SmokeDetector-Statuses#reverted-mode) " \
-                        "at [rev " + \
-                        GlobalVars.commit_with_author + \
-                        "](" + GlobalVars.bot_repository + "/commit/" + \
-                        GlobalVars.commit['id'] + \
-                        ") (running on " +\
-                        GlobalVars.location +\
-                        ")"
-GlobalVars.standby_message = "[ " + GlobalVars.chatmessage_prefix + " ] " \
-                             "SmokeDetector started in [standby mode](" + \
-                             "https://charcoal-se.org/smokey/SmokeDetector-Statuses#standby-mode) " + \
-                             "at [rev " +\
-                             GlobalVars.commit_with_author +\
-                             "](" + GlobalVars.bot_repository + "/commit/" +\
-                             GlobalVars.commit['id'] +\
-                             ") (running on " +\
-                             GlobalVars.location +\
-                             ")"
-
-GlobalVars.charcoal_hq = GlobalVars.wrap.get_room(GlobalVars.charcoal_room_id)
-
-if "standby" in sys.argv:
-    GlobalVars.charcoal_hq.send_message(GlobalVars.standby_message)
-    GlobalVars.standby_mode = True
-    Metasmoke.send_status_ping()
-
-    while GlobalVars.standby_mode:
-        time.sleep(3)
-
-tavern_id = GlobalVars.meta_tavern_room_id
-GlobalVars.tavern_on_the_meta = GlobalVars.wrapm.get_room(tavern_id)
-GlobalVars.socvr = GlobalVars.wrapso.get_room(GlobalVars.socvr_room_id)
+from scanpool import ScanPool
+from ingestion import IngestionPool
+from classes import QuestionEvent
 
 
 def check_socket_connections():
@@ -155,101 +46,6 @@ def check_socket_connections():
         os._exit(10)
 
 
-threading.Timer(90, check_socket_connections).start()
-
-# If you change these sites, please also update the wiki at
-# https://github.com/Charcoal-SE/SmokeDetector/wiki/Chat-Rooms
-
-GlobalVars.specialrooms = [
-    {
-        "sites": ["math.stackexchange.com"],
-        "room": GlobalVars.wrap.get_room("2165"),
-        "unwantedReasons": []
-    },
-    {
-        "sites": ["english.stackexchange.com"],
-        "room": GlobalVars.wrap.get_room("95"),
-        "unwantedReasons": []
-    },
-    {
-        "sites": ["stackoverflow.com"],
-        "room": GlobalVars.wrapso.get_room("111347"),
-        "unwantedReasons": [],
-        "stdwatcher": True
-    },
-    {
-        "sites": ["parenting.stackexchange.com"],
-        "room": GlobalVars.wrap.get_room("388"),
-        "unwantedReasons": []
-    },
-    {
-        "sites": ["bitcoin.stackexchange.com"],
-        "room": GlobalVars.wrap.get_room("8089"),
-        "unwantedReasons": []
-    },
-    {
-        "sites": ["judaism.stackexchange.com"],
-        "room": GlobalVars.wrap.get_room("468"),
-        "unwantedReasons": []
-    },
-    {
-        "sites": ["money.stackexchange.com"],
-        "room": GlobalVars.wrap.get_room("35068"),
-        "unwantedReasons": ["All-caps title", "All-caps body", "All-caps answer"]
-    },
-    {
-        "sites": ["movies.stackexchange.com"],
-        "room": GlobalVars.wrap.get_room("40705"),
-        "unwantedReasons": []
-    },
-    {
-        "sites": ["ethereum.stackexchange.com"],
-        "room": GlobalVars.wrap.get_room("34620"),
-        "unwantedReasons": []
-    },
-    {
-        "sites": ["ru.stackoverflow.com"],
-        "room": GlobalVars.wrap.get_room("22462"),
-        "unwantedReasons": []
-    },
-    {
-        "sites": ["magento.stackexchange.com"],
-        "room": GlobalVars.wrap.get_room("47869"),
-        "unwantedReasons": []
-    },
-    {
-        "sites": ["rpg.stackexchange.com"],
-        "room": GlobalVars.wrap.get_room("11"),
-        "unwantedReasons": []
-    },
-    {
-        "sites": ["ell.stackexchange.com"],
-        "room": GlobalVars.wrap.get_room("24938"),
-        "unwantedReasons": []
-    },
-    {
-        "sites": ["bricks.stackexchange.com"],
-        "room": GlobalVars.wrap.get_room("1964"),
-        "unwantedReasons": []
-    },
-    {
-        "sites": ["crafts.stackexchange.com"],
-        "room": GlobalVars.wrap.get_room("38932"),
-        "unwantedReasons": []
-    },
-    {
-        "sites": ["graphicdesign.stackexchange.com"],
-        "room": GlobalVars.wrap.get_room("56223"),
-        "unwantedReasons": []
-    },
-    {
-        "sites": ["scifi.stackexchange.com"],
-        "room": GlobalVars.wrap.get_room("59281"),
-        "unwantedReasons": []
-    }
-]
-
-
 # noinspection PyProtectedMember
 def restart_automatically(time_in_seconds):
     time.sleep(time_in_seconds)
@@ -257,77 +53,309 @@ def restart_automatically(time_in_seconds):
     os._exit(1)
 
 
-Thread(name="auto restart thread", target=restart_automatically, args=(21600,)).start()
-
-log('info', GlobalVars.location)
-log('info', GlobalVars.metasmoke_host)
-
-DeletionWatcher.update_site_id_list()
-
-ws = websocket.create_connection("wss://qa.sockets.stackexchange.com/")
-ws.send("155-questions-active")
-
-GlobalVars.charcoal_hq.join()
-GlobalVars.charcoal_hq.watch_socket(watcher)
-
-if 'charcoal-hq-only' not in sys.argv:
-    GlobalVars.tavern_on_the_meta.join()
-    GlobalVars.socvr.join()
-    GlobalVars.tavern_on_the_meta.watch_socket(watcher)
-    GlobalVars.socvr.watch_socket(watcher)
-
-    for room in GlobalVars.specialrooms:
-        if "watcher" in room:
-            room["room"].join()
-            room["room"].watch_socket(special_room_watcher)
-        if "stdwatcher" in room:
-            room["room"].join()
-            room["room"].watch_socket(watcher)
-
-if "first_start" in sys.argv and GlobalVars.on_master:
-    GlobalVars.charcoal_hq.send_message(GlobalVars.s)
-elif "first_start" in sys.argv and not GlobalVars.on_master:
-    GlobalVars.charcoal_hq.send_message(GlobalVars.s_reverted)
+def handle_active_question(event):
+    is_spam, reason, why = check_if_spam_event(event)
+    GlobalVars.bodyfetcher.add_to_queue(event, True if is_spam else None)
 
-Metasmoke.send_status_ping()  # This will call itself every minute or so
-threading.Timer(600, Metasmoke.send_statistics).start()
 
-metasmoke_ws_t = Thread(name="metasmoke websocket", target=Metasmoke.init_websocket)
-metasmoke_ws_t.start()
+def queue_active_question(event):
+    # When the pool is overwhelmed, the summary scan is skipped, but the post is still fetched and scanned in full
+    GlobalVars.bodyfetcher.add_to_queue(event)
 
-Metasmoke.check_last_pingtime()  # This will call itself every 10 seconds or so
 
-while True:
+def main():
     try:
-        a = ws.recv()
-        if a is not None and a != "":
-            action = json.loads(a)["action"]
-            if action == "hb":
-                ws.send("hb")
-            if action == "155-questions-active":
-                is_spam, reason, why = check_if_spam_json(a)
-                t = Thread(name="bodyfetcher post enqueing",
-                           target=GlobalVars.bodyfetcher.add_to_queue,
-                           args=(a, True if is_spam else None))
-                t.start()
-
-    except Exception as e:
-        exc_type, exc_obj, exc_tb = sys.exc_info()
-        now = datetime.utcnow()
-        delta = now - UtcDate.startup_utc_date
-        seconds = delta.total_seconds()
-        tr = traceback.format_exc()
-        exception_only = ''.join(traceback.format_exception_only(type(e), e))\
-                           .strip()
-        n = os.linesep
-        logged_msg = str(now) + " UTC" + n + exception_only + n + tr + n + n
-        log('error', logged_msg)
-        with open("errorLogs.txt", "a") as f:
-            f.write(logged_msg)
-        if seconds < 180 and exc_type != websocket.WebSocketConnectionClosedException\
-                and exc_type != KeyboardInterrupt and exc_type != SystemExit and exc_type != requests.ConnectionError:
-            # noinspection PyProtectedMember
-            os._exit(4)
-        ws = websocket.create_connection("ws://qa.sockets.stackexchange.com/")
-        ws.send("155-questions-active")
-        GlobalVars.charcoal_hq.send_message("Recovered from `" + exception_only + "`")
+        update_tld_names()
+    except TldIOError as ioerr:
+        with open('errorLogs.txt', 'a') as errlogs:
+            if "permission denied:" in str(ioerr).lower():
+                if "/usr/local/lib/python2.7/dist-packages/" in str(ioerr):
+                    errlogs.write("WARNING: Cannot update TLD names, due to `tld` being system-wide installed and not "
+                                  "user-level installed.  Skipping TLD names update. \n")
+
+                if "/home/" in str(ioerr) and ".local/lib/python2.7/site-packages/tld/" in str(ioerr):
+                    errlogs.write("WARNING: Cannot read/write to user-space `tld` installation, check permissions on "
+                                  "the path.  Skipping TLD names update. \n")
+
+                errlogs.close()
+                pass
+
+            elif "certificate verify failed" in str(ioerr).lower():
+                # Ran into this error in testing on Windows, best to throw a warn if we get this...
+                errlogs.write("WARNING: Cannot verify SSL connection for TLD names update; skipping TLD names update.")
+                errlogs.close()
+                pass
+
+            else:
+                raise ioerr
+
+    if "ChatExchangeU" in os.environ:
+        username = os.environ["ChatExchangeU"]
+    else:
+        username = input("Username: ")
+    if "ChatExchangeP" in os.environ:
+        password = os.environ["ChatExchangeP"]
+    else:
+        password = getpass.getpass("Password: ")
+
+    # We need an instance of bodyfetcher before load_files() is called
+    GlobalVars.bodyfetcher = BodyFetcher()
+
+    if GlobalVars.scan_workers > 0:
+        GlobalVars.scan_pool = ScanPool(GlobalVars.scan_workers)
+
+    load_files()
+    filter_auto_ignored_posts()
+    GlobalVars.bodyfetcher.start_flush_scheduler()
+
+    # chat.stackexchange.com logon/wrapper
+    chatlogoncount = 0
+    for cl in range(1, 10):
+        chatlogoncount += 1
+        try:
+            # chat.stackexchange.com
+            GlobalVars.wrap.login(username, password)
+            GlobalVars.smokeDetector_user_id[GlobalVars.charcoal_room_id] = str(GlobalVars.wrap.get_me().id)
+
+            # chat.meta.stackexchange.com
+            GlobalVars.wrapm.login(username, password)
+            GlobalVars.smokeDetector_user_id[GlobalVars.meta_tavern_room_id] = str(GlobalVars.wrapm.get_me().id)
+
+            # chat.stackoverflow.com
+            GlobalVars.wrapso.login(username, password)
+            GlobalVars.smokeDetector_user_id[GlobalVars.socvr_room_id] = str(GlobalVars.wrapso.get_me().id)
+
+            # If we didn't error out horribly, we can be done with this loop
+            break
+
+        except (ValueError, AssertionError):
+            # One of the chats died, so let's wait a second, and start over.
+            time.sleep(1)
+            continue  # If we did error, we need to try this again.
+
+    # Handle "too many logon attempts" case to prevent infinite looping and to handle the 'too many logons' error.
+    if chatlogoncount >= 10:
+        raise RuntimeError("Could not get at least one of the chat logons.")
+
+    GlobalVars.s = "[ " + GlobalVars.chatmessage_prefix + " ] " \
+                   "SmokeDetector started at [rev " +\
+                   GlobalVars.commit_with_author +\
+                   "](" + GlobalVars.bot_repository + "/commit/" +\
+                   GlobalVars.commit['id'] +\
+                   ") (running on " +\
+                   GlobalVars.location +\
+                   ")"
+    GlobalVars.s_reverted = "[ " + GlobalVars.chatmessage_prefix + " ] " \
+                            "SmokeDetector started in [reverted mode](" + \
+                            "https://charcoal-se.org/smokey/SmokeDetector-Statuses#reverted-mode) " \
+                            "at [rev " + \
+                            GlobalVars.commit_with_author + \
+                            "](" + GlobalVars.bot_repository + "/commit/" + \
+                            GlobalVars.commit['id'] + \
+                            ") (running on " +\
+                            GlobalVars.location +\
+                            ")"
+    GlobalVars.standby_message = "[ " + GlobalVars.chatmessage_prefix + " ] " \
+                                 "SmokeDetector started in [standby mode](" + \
+                                 "https://charcoal-se.org/smokey/SmokeDetector-Statuses#standby-mode) " + \
+                                 "at [rev " +\
+                                 GlobalVars.commit_with_author +\
+                                 "](" + GlobalVars.bot_repository + "/commit/" +\
+                                 GlobalVars.commit['id'] +\
+                                 ") (running on " +\
+                                 GlobalVars.location +\
+                                 ")"
+
+    GlobalVars.charcoal_hq = GlobalVars.wrap.get_room(GlobalVars.charcoal_room_id)
+
+    if "standby" in sys.argv:
+        GlobalVars.charcoal_hq.send_message(GlobalVars.standby_message)
+        GlobalVars.standby_mode = True
+        Metasmoke.send_status_ping()
+
+        while GlobalVars.standby_mode:
+            time.sleep(3)
+
+    tavern_id = GlobalVars.meta_tavern_room_id
+    GlobalVars.tavern_on_the_meta = GlobalVars.wrapm.get_room(tavern_id)
+    GlobalVars.socvr = GlobalVars.wrapso.get_room(GlobalVars.socvr_room_id)
+
+    threading.Timer(90, check_socket_connections).start()
+
+    # If you change these sites, please also update the wiki at
+    # https://github.com/Charcoal-SE/SmokeDetector/wiki/Chat-Rooms
+
+    GlobalVars.specialrooms = [
+        {
+            "sites": ["math.stackexchange.com"],
+            "room": GlobalVars.wrap.get_room("2165"),
+            "unwantedReasons": []
+        },
+        {
+            "sites": ["english.stackexchange.com"],
+            "room": GlobalVars.wrap.get_room("95"),
+            "unwantedReasons": []
+        },
+        {
+            "sites": ["stackoverflow.com"],
+            "room": GlobalVars.wrapso.get_room("111347"),
+            "unwantedReasons": [],
+            "stdwatcher": True
+        },
+        {
+            "sites": ["parenting.stackexchange.com"],
+            "room": GlobalVars.wrap.get_room("388"),
+            "unwantedReasons": []
+        },
+        {
+            "sites": ["bitcoin.stackexchange.com"],
+            "room": GlobalVars.wrap.get_room("8089"),
+            "unwantedReasons": []
+        },
+        {
+            "sites": ["judaism.stackexchange.com"],
+            "room": GlobalVars.wrap.get_room("468"),
+            "unwantedReasons": []
+        },
+        {
+            "sites": ["money.stackexchange.com"],
+            "room": GlobalVars.wrap.get_room("35068"),
+            "unwantedReasons": ["All-caps title", "All-caps body", "All-caps answer"]
+        },
+        {
+            "sites": ["movies.stackexchange.com"],
+            "room": GlobalVars.wrap.get_room("40705"),
+            "unwantedReasons": []
+        },
+        {
+            "sites": ["ethereum.stackexchange.com"],
+            "room": GlobalVars.wrap.get_room("34620"),
+            "unwantedReasons": []
+        },
+        {
+            "sites": ["ru.stackoverflow.com"],
+            "room": GlobalVars.wrap.get_room("22462"),
+            "unwantedReasons": []
+        },
+        {
+            "sites": ["magento.stackexchange.com"],
+            "room": GlobalVars.wrap.get_room("47869"),
+            "unwantedReasons": []
+        },
+        {
+            "sites": ["rpg.stackexchange.com"],
+            "room": GlobalVars.wrap.get_room("11"),
+            "unwantedReasons": []
+        },
+        {
+            "sites": ["ell.stackexchange.com"],
+            "room": GlobalVars.wrap.get_room("24938"),
+            "unwantedReasons": []
+        },
+        {
+            "sites": ["bricks.stackexchange.com"],
+            "room": GlobalVars.wrap.get_room("1964"),
+            "unwantedReasons": []
+        },
+        {
+            "sites": ["crafts.stackexchange.com"],
+            "room": GlobalVars.wrap.get_room("38932"),
+            "unwantedReasons": []
+        },
+        {
+            "sites": ["graphicdesign.stackexchange.com"],
+            "room": GlobalVars.wrap.get_room("56223"),
+            "unwantedReasons": []
+        },
+        {
+            "sites": ["scifi.stackexchange.com"],
+            "room": GlobalVars.wrap.get_room("59281"),
+            "unwantedReasons": []
+        }
+    ]
+
+    Thread(name="auto restart thread", target=restart_automatically, args=(21600,)).start()
+
+    log('info', GlobalVars.location)
+    log('info', GlobalVars.metasmoke_host)
+
+    DeletionWatcher.update_site_id_list()
+
+    ws = websocket.create_connection("wss://qa.sockets.stackexchange.com/")
+    ws.send("155-questions-active")
+
+    GlobalVars.charcoal_hq.join()
+    GlobalVars.charcoal_hq.watch_socket(watcher)
+
+    if 'charcoal-hq-only' not in sys.argv:
+        GlobalVars.tavern_on_the_meta.join()
+        GlobalVars.socvr.join()
+        GlobalVars.tavern_on_the_meta.watch_socket(watcher)
+        GlobalVars.socvr.watch_socket(watcher)
+
+        for room in GlobalVars.specialrooms:
+            if "watcher" in room:
+                room["room"].join()
+                room["room"].watch_socket(special_room_watcher)
+            if "stdwatcher" in room:
+                room["room"].join()
+                room["room"].watch_socket(watcher)
+
+    if "first_start" in sys.argv and GlobalVars.on_master:
+        GlobalVars.charcoal_hq.send_message(GlobalVars.s)
+    elif "first_start" in sys.argv and not GlobalVars.on_master:
+        GlobalVars.charcoal_hq.send_message(GlobalVars.s_reverted)
+
+    Metasmoke.send_status_ping()  # This will call itself every minute or so
+    threading.Timer(600, Metasmoke.send_statistics).start()
+
+    metasmoke_ws_t = Thread(name="metasmoke websocket", target=Metasmoke.init_websocket)
+    metasmoke_ws_t.start()
+
+    Metasmoke.check_last_pingtime()  # This will call itself every 10 seconds or so
+
+    # Only receiving happens on this thread, so that it's always ready to answer heartbeats
+    GlobalVars.ingestion_pool = IngestionPool("websocket post ingestion", handle_active_question,
+                                              GlobalVars.ingestion_workers, GlobalVars.ingestion_queue_size,
+                                              queue_active_question)
+    GlobalVars.ingestion_pool.start()
+
+    while True:
+        try:
+            a = ws.recv()
+            if a is not None and a != "":
+                frame = json.loads(a)
+                action = frame["action"]
+                if action == "hb":
+                    ws.send("hb")
+                if action == "155-questions-active":
+                    event = QuestionEvent.from_frame(frame)
+                    if event is not None:
+                        # Repeats of a question still waiting are coalesced
+                        GlobalVars.ingestion_pool.put((event.site, event.post_id), event)
+
+        except Exception as e:
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            now = datetime.utcnow()
+            delta = now - UtcDate.startup_utc_date
+            seconds = delta.total_seconds()
+            tr = traceback.format_exc()
+            exception_only = ''.join(traceback.format_exception_only(type(e), e))\
+                               .strip()
+            n = os.linesep
+            logged_msg = str(now) + " UTC" + n + exception_only + n + tr + n + n
+            log('error', logged_msg)
+            with open("errorLogs.txt", "a") as f:
+                f.write(logged_msg)
+            if seconds < 180 and exc_type != websocket.WebSocketConnectionClosedException\
+                    and exc_type != KeyboardInterrupt and exc_type != SystemExit\
+                    and exc_type != requests.ConnectionError:
+                # noinspection PyProtectedMember
+                os._exit(4)
+            ws = websocket.create_connection("ws://qa.sockets.stackexchange.com/")
+            ws.send("155-questions-active")
+            GlobalVars.charcoal_hq.send_message("Recovered from `" + exception_only + "`")
+
+
+if __name__ == "__main__":
+    main()